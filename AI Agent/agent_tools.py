@@ -6,12 +6,23 @@ CSV tabanlı küp verisi ile çalışan akıllı agent
 import pandas as pd
 import numpy as np
 import json
-from typing import Optional, List, Dict
+import csv
+from typing import Optional, List, Dict, Union, Callable
 import anthropic
 import os
+import re
 import glob
 import sys
 import io
+import time
+import asyncio
+import threading
+import uuid
+import copy
+import hashlib
+from collections import deque
+from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
 # Windows cp1254 encoding emoji desteklemiyor - stdout'u UTF-8'e çevir
 if sys.stdout and hasattr(sys.stdout, 'encoding') and sys.stdout.encoding and sys.stdout.encoding.lower() not in ('utf-8', 'utf8'):
@@ -25,29 +36,1114 @@ if sys.stdout and hasattr(sys.stdout, 'encoding') and sys.stdout.encoding and sy
 SEVKIYAT_MOTORU_AVAILABLE = True  # Her zaman True çünkü inline
 print("✅ Sevkiyat hesaplama INLINE modda çalışıyor")
 
+# =============================================================================
+# PAYLAŞIMLI KÜP - VERİ VERSİYONU + COPY-ON-WRITE
+# =============================================================================
+# Küp tüm oturumlar arasında TEK kopya olarak paylaşılır (salt-okunur).
+# Araçlar kup.X.copy() yerine kup_kopya(kup.X) kullanır: CoW aktifken kopya
+# sığdır (veri paylaşılır), yalnızca yazılan kolonlar çoğaltılır.
+
+VERI_UZANTILARI = ('.csv', '.xlsx', '.xls')
+
+
+def _cow_etkinlestir() -> bool:
+    """pandas copy-on-write modunu aç (pandas 3+ zaten her zaman CoW)"""
+    try:
+        if int(pd.__version__.split('.')[0]) >= 3:
+            return True
+        pd.set_option('mode.copy_on_write', True)
+        return True
+    except Exception:
+        return False
+
+
+COW_AKTIF = _cow_etkinlestir()
+
+
+def kup_kopya(df: pd.DataFrame) -> pd.DataFrame:
+    """Paylaşılan küp tablosunun araç içinde değiştirilebilir kopyası"""
+    if df is None:
+        return df
+    return df.copy(deep=not COW_AKTIF)
+
+
+def veri_versiyonu_hesapla(veri_klasoru: str) -> str:
+    """Veri klasörünün versiyonu: dosya adı + boyut + değişiklik zamanı özeti"""
+    ozet = hashlib.sha1()
+    if os.path.isdir(veri_klasoru):
+        for f in sorted(os.listdir(veri_klasoru)):
+            if not f.lower().endswith(VERI_UZANTILARI):
+                continue
+            try:
+                bilgi = os.stat(os.path.join(veri_klasoru, f))
+            except OSError:
+                continue
+            ozet.update(f"{f}|{bilgi.st_size}|{bilgi.st_mtime_ns}\n".encode('utf-8'))
+    return ozet.hexdigest()[:16]
+
+
 # =============================================================================
 # VERİ YÜKLEYİCİ
 # =============================================================================
 
+# =============================================================================
+# EXCEL OKUYUCU - her sayfa tek geçişte okunur
+# =============================================================================
+# Eski akış: header'ı bulmak için sayfa nrows=30 ile okunuyor, sonra tüm sayfa
+# header=N ile tekrar parse ediliyordu. ExcelOkuyucu çalışma kitabını bir kez
+# açar, sayfanın satırlarını bir kez akıtır; header ilk satırlardan bulunur ve
+# tablo zaten okunmuş satırlardan kurulur. Sonuç pd.read_excel ile aynıdır
+# (Unnamed/tekrarlı kolon adları, NA metinleri, tip çıkarımı).
+
+# pandas read_excel'in NaN saydığı metinler
+EXCEL_NA_DEGERLERI = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+    'n/a', 'nan', 'null',
+}
+# Hata hücreleri (read_only modda metin olarak gelir) - pandas bunları NaN yapar
+EXCEL_HATA_DEGERLERI = {
+    '#DIV/0!', '#N/A', '#NAME?', '#NULL!', '#NUM!', '#REF!', '#VALUE!', '#GETTING_DATA',
+}
+
+
+def _excel_hucre(deger, na_metinleri: bool = True):
+    """Hücre değerini pandas openpyxl okuyucusu gibi normalize et"""
+    if deger is None:
+        return None
+    if isinstance(deger, float):
+        if deger != deger:
+            return None
+        if deger.is_integer():
+            return int(deger)
+    elif isinstance(deger, str):
+        if deger in EXCEL_HATA_DEGERLERI:
+            # Header'da hata hücresi kolon adı NaN olur (Unnamed değil)
+            return None if na_metinleri else np.nan
+        if na_metinleri and deger in EXCEL_NA_DEGERLERI:
+            return None
+    return deger
+
+
+def header_satiri_bul(satirlar: list, anahtarlar: list, min_eslesme: int = 2):
+    """
+    Anahtar kelime eşleşmesi en yüksek satırı header olarak seç
+    
+    Returns:
+        (satır indeksi, eşleşme sayısı) - bulunamazsa (None, 0)
+    """
+    header_row = None
+    best = 0
+    for idx, row in enumerate(satirlar):
+        row_text = ' '.join(str(v).lower() for v in row if v is not None and v == v)
+        matches = sum(1 for kw in anahtarlar if kw in row_text)
+        if matches > best and matches >= min_eslesme:
+            best = matches
+            header_row = idx
+    return header_row, best
+
+
+def satirlardan_tablo(satirlar: list, header_satiri: int = 0) -> pd.DataFrame:
+    """Okunmuş satırlardan read_excel(header=header_satiri) eşdeğeri DataFrame kur"""
+    # Satır sonlarındaki boş hücreler ve sayfa sonundaki boş satırlar atılır
+    temiz = []
+    for i, row in enumerate(satirlar):
+        # Header satırında NA metinleri kolon adı olarak kalır
+        row = [_excel_hucre(v, na_metinleri=(i != header_satiri)) for v in row]
+        while row and row[-1] is None:
+            row.pop()
+        temiz.append(row)
+    while temiz and not temiz[-1]:
+        temiz.pop()
+    
+    if header_satiri is None or header_satiri >= len(temiz):
+        return pd.DataFrame()
+    
+    genislik = max(len(r) for r in temiz[header_satiri:])
+    baslik = temiz[header_satiri] + [None] * (genislik - len(temiz[header_satiri]))
+    
+    # Kolon adları: boş -> "Unnamed: i", tekrar -> "ad.1", "ad.2"
+    kolonlar = []
+    gorulen = set()
+    for i, ad in enumerate(baslik):
+        if ad is None:
+            ad = f"Unnamed: {i}"
+        elif ad != ad:
+            kolonlar.append(ad)
+            continue
+        aday, sayac = ad, 0
+        while aday in gorulen:
+            sayac += 1
+            aday = f"{ad}.{sayac}"
+        gorulen.add(aday)
+        kolonlar.append(aday)
+    
+    govde = temiz[header_satiri + 1:]
+    veri = {}
+    for j, kolon in enumerate(kolonlar):
+        seri = pd.Series([r[j] if j < len(r) else None for r in govde])
+        if seri.dtype == object or pd.api.types.is_string_dtype(seri.dtype):
+            # Metin olarak gelmiş sayılar read_excel'de olduğu gibi sayıya çevrilir
+            try:
+                seri = pd.to_numeric(seri)
+            except (ValueError, TypeError):
+                if seri.dtype == object:
+                    seri = seri.where(seri.notna(), np.nan)
+        veri[j] = seri
+    df = pd.DataFrame(veri)
+    df.columns = kolonlar
+    return df
+
+
+class _OpenpyxlMotoru:
+    """openpyxl read_only akışı - her ortamda var, yedek motor"""
+    
+    def __init__(self, path: str):
+        import openpyxl
+        self._wb = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+        self.sayfalar = list(self._wb.sheetnames)
+    
+    def satirlar(self, sayfa: str) -> list:
+        ws = self._wb[sayfa]
+        ws.reset_dimensions()
+        return list(ws.iter_rows(values_only=True))
+    
+    def kapat(self):
+        self._wb.close()
+
+
+class _CalamineMotoru:
+    """python-calamine (Rust) - openpyxl'den kat kat hızlı, .xls/.xlsb de okur"""
+    
+    def __init__(self, path: str):
+        from python_calamine import CalamineWorkbook
+        self._wb = CalamineWorkbook.from_path(path)
+        self.sayfalar = list(self._wb.sheet_names)
+    
+    @staticmethod
+    def _hucre(deger):
+        # Calamine boş hücreyi '' ve tarihi date olarak verir - openpyxl ile aynı forma getir
+        if deger == '':
+            return None
+        if type(deger) is date:
+            return datetime(deger.year, deger.month, deger.day)
+        return deger
+    
+    def satirlar(self, sayfa: str) -> list:
+        ham = self._wb.get_sheet_by_name(sayfa).to_python(skip_empty_area=False)
+        return [tuple(self._hucre(v) for v in row) for row in ham]
+    
+    def kapat(self):
+        if hasattr(self._wb, 'close'):
+            self._wb.close()
+
+
+class _PandasMotoru:
+    """Eski .xls için pandas (xlrd) - sayfa header=None ile bir kez okunur"""
+    
+    def __init__(self, path: str):
+        self._xl = pd.ExcelFile(path)
+        self.sayfalar = list(self._xl.sheet_names)
+    
+    def satirlar(self, sayfa: str) -> list:
+        ham = pd.read_excel(self._xl, sheet_name=sayfa, header=None)
+        return [tuple(None if pd.isna(v) else v for v in row) for row in ham.itertuples(index=False)]
+    
+    def kapat(self):
+        self._xl.close()
+
+
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+EXCEL_MOTORLARI = {
+    'calamine': _CalamineMotoru,
+    'openpyxl': _OpenpyxlMotoru,
+    'pandas': _PandasMotoru,
+}
+# Varsayılan motor: SANAL_PLANNER_EXCEL_MOTORU ile değiştirilebilir
+VARSAYILAN_EXCEL_MOTORU = os.environ.get(
+    'SANAL_PLANNER_EXCEL_MOTORU', 'calamine' if CALAMINE_AVAILABLE else 'openpyxl'
+)
+
+
+def _motor_sirasi(path: str, motor: str) -> list:
+    """Denenecek motorlar: istenen motor, sonra dosya tipine uygun yedekler"""
+    if path.lower().endswith('.xls'):
+        yedekler = ['calamine', 'pandas'] if CALAMINE_AVAILABLE else ['pandas']
+    else:
+        yedekler = ['openpyxl']
+    sira = [motor] if motor in EXCEL_MOTORLARI and not (motor == 'openpyxl' and path.lower().endswith('.xls')) else []
+    return sira + [m for m in yedekler if m not in sira]
+
+
+class ExcelOkuyucu:
+    """
+    Çalışma kitabını bir kez açıp sayfaları tek geçişte okuyan okuyucu
+    
+    Satırlar takılabilir bir motordan gelir (calamine varsa o, yoksa openpyxl);
+    motor açılamazsa sıradaki yedek motor denenir. Header bulma ve tablo
+    kurma motordan bağımsızdır.
+    
+    Kullanım:
+        with ExcelOkuyucu(path) as xl:
+            xl.sayfalar                              # sayfa isimleri
+            df = xl.oku('Trading', anahtarlar=[...]) # header otomatik bulunur
+    """
+    
+    def __init__(self, path: str, motor: str = None):
+        self.path = path
+        self._motor = None
+        hatalar = []
+        for ad in _motor_sirasi(path, motor or VARSAYILAN_EXCEL_MOTORU):
+            if ad == 'calamine' and not CALAMINE_AVAILABLE:
+                continue
+            try:
+                self._motor = EXCEL_MOTORLARI[ad](path)
+                self.motor = ad
+                break
+            except Exception as e:
+                hatalar.append(f"{ad}: {e}")
+        if self._motor is None:
+            raise ValueError(f"Excel açılamadı ({os.path.basename(path)}) - " + "; ".join(hatalar))
+        if hatalar:
+            print(f"   ℹ️ Excel yedek motorla açıldı ({self.motor}): {'; '.join(hatalar)}")
+        self.sayfalar = self._motor.sayfalar
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.kapat()
+    
+    def kapat(self):
+        if self._motor is not None:
+            self._motor.kapat()
+            self._motor = None
+    
+    def satirlar(self, sayfa: Union[int, str] = 0) -> list:
+        """Sayfanın tüm satırları (değer tuple'ları) - tek geçiş"""
+        if isinstance(sayfa, int):
+            sayfa = self.sayfalar[sayfa]
+        return self._motor.satirlar(sayfa)
+    
+    def oku(self, sayfa: Union[int, str] = 0, anahtarlar: list = None,
+            tarama: int = 30, min_eslesme: int = 2) -> pd.DataFrame:
+        """
+        Sayfayı DataFrame olarak oku
+        
+        anahtarlar: Verilirse ilk `tarama` satırda header aranır, bulunamazsa ilk satır header
+        """
+        satirlar = self.satirlar(sayfa)
+        header_row = 0
+        if anahtarlar:
+            bulunan, eslesme = header_satiri_bul(satirlar[:tarama], anahtarlar, min_eslesme)
+            if bulunan is not None:
+                print(f"      Header satırı: {bulunan} ({eslesme} eşleşme)")
+                header_row = bulunan
+        return satirlardan_tablo(satirlar, header_row)
+
+
+# =============================================================================
+# CSV AKIŞ OKUYUCU - büyük anlik_stok_satis parçaları
+# =============================================================================
+# Tam okumada her parça belleğe okunuyor, pd.concat ikinci kopyayı, _hazirla'daki
+# merge'ler birer kopya daha üretiyor - tepe bellek nihai tablonun birkaç katı.
+# Akış modunda parçalar chunk chunk (C motoru) okunur, her chunk master
+# lookup'larıyla zenginleştirilip önceden ayrılmış kolon dizilerine yazılır.
+# Parçaların toplam boyutu eşiği aşınca devreye girer (MB; 0 = her zaman, negatif = kapalı)
+STOK_AKIS_ESIGI_MB = int(os.environ.get("SANAL_PLANNER_STOK_AKIS_MB", "256"))
+STOK_AKIS_CHUNK = 200_000
+
+
+def csv_ayirici_bul(path: str, encoding: str = 'utf-8') -> str:
+    """İlk satırdan ayırıcıyı tespit et (python motorunun sep=None davranışı)"""
+    with open(path, encoding=encoding, newline='') as f:
+        ilk_satir = f.readline()
+    try:
+        return csv.Sniffer().sniff(ilk_satir).delimiter
+    except csv.Error:
+        return ';'
+
+
+def csv_satir_tahmini(path: str) -> int:
+    """Satır sayısı tahmini (satır sonu sayısı) - tampon ön ayırması için"""
+    satir = 0
+    with open(path, 'rb') as f:
+        while True:
+            blok = f.read(1 << 24)
+            if not blok:
+                break
+            satir += blok.count(b'\n')
+    return satir
+
+
+def _ortak_tip(a, b):
+    """pd.concat'in iki kolon tipi için seçeceği ortak tip"""
+    if a == b:
+        return a
+    return pd.concat([pd.Series([], dtype=a), pd.Series([], dtype=b)]).dtype
+
+
+def _eksik_tipi(tip):
+    """Eksik değer (NaN) taşıyabilen tip - int → float, bool → object"""
+    if isinstance(tip, np.dtype) and tip.kind in 'iu':
+        return np.dtype('float64')
+    if isinstance(tip, np.dtype) and tip.kind == 'b':
+        return np.dtype(object)
+    return tip
+
+
+class _KolonTamponu:
+    """
+    Önceden ayrılmış kolon dizileri - chunk'lar sırayla kopyalanır
+
+    Kolon tipi chunk'lar arasında değişirse (int → float vb.) pd.concat ile aynı
+    ortak tipe yükseltilir; sonradan gelen kolonların önceki satırları NaN olur.
+    """
+
+    def __init__(self, kapasite: int):
+        self.kapasite = max(int(kapasite), 1)
+        self.n = 0
+        self.diziler = {}   # kolon -> numpy dizisi
+        self.tipler = {}    # kolon -> pandas tipi (extension tipler object dizide tutulur)
+
+    def _tip_ayarla(self, kolon: str, tip):
+        eski = self.tipler.get(kolon)
+        if eski is None:
+            if self.n:
+                tip = _eksik_tipi(tip)
+            dizi = np.empty(self.kapasite, dtype=tip if isinstance(tip, np.dtype) else object)
+            if self.n:
+                dizi[:self.n] = np.nan
+            self.diziler[kolon] = dizi
+        else:
+            tip = _ortak_tip(eski, tip)
+            numpy_tipi = tip if isinstance(tip, np.dtype) else np.dtype(object)
+            if self.diziler[kolon].dtype != numpy_tipi:
+                self.diziler[kolon] = self.diziler[kolon].astype(numpy_tipi)
+        self.tipler[kolon] = tip
+
+    def _buyut(self, kapasite: int):
+        for kolon, dizi in self.diziler.items():
+            yeni = np.empty(kapasite, dtype=dizi.dtype)
+            yeni[:self.n] = dizi[:self.n]
+            self.diziler[kolon] = yeni
+        self.kapasite = kapasite
+
+    def ekle(self, chunk: pd.DataFrame):
+        m = len(chunk)
+        if self.n + m > self.kapasite:
+            self._buyut(max(self.n + m, int(self.kapasite * 1.25)))
+        bas, son = self.n, self.n + m
+        for kolon, seri in chunk.items():
+            self._tip_ayarla(kolon, seri.dtype)
+            self.diziler[kolon][bas:son] = seri.to_numpy()
+        for kolon in self.diziler.keys() - set(chunk.columns):
+            self._tip_ayarla(kolon, _eksik_tipi(self.tipler[kolon]))
+            self.diziler[kolon][bas:son] = np.nan
+        self.n = son
+
+    def tablo(self, kolon_sirasi: list = None) -> pd.DataFrame:
+        """Tamponu DataFrame'e çevir (diziler kopyalanmadan devredilir)"""
+        # Tahmin çok sapmışsa artan kapasite bellekte tutulmasın
+        kirp = self.kapasite - self.n > self.kapasite // 20
+        veriler = {}
+        for kolon in kolon_sirasi or list(self.diziler):
+            dizi = self.diziler.pop(kolon)[:self.n]
+            tip = self.tipler.pop(kolon)
+            if not isinstance(tip, np.dtype):
+                dizi = pd.array(dizi, dtype=tip)
+            elif kirp:
+                dizi = dizi.copy()
+            veriler[kolon] = dizi
+        return pd.DataFrame(veriler, copy=False)
+
+
+class _TembelVeri:
+    """
+    KupVeri alanı - ait olduğu veri grubu ilk erişimde yüklenir
+    
+    Grup yüklenirken (arka plan ön yüklemesi dahil) erişen thread grup
+    kilidinde bekler, yarım hazırlanmış tablo görmez.
+    """
+    
+    def __init__(self, grup: str):
+        self.grup = grup
+    
+    def __set_name__(self, sahip, ad):
+        self.ad = ad
+    
+    def __get__(self, kup, sahip=None):
+        if kup is None:
+            return self
+        if self.grup not in kup._yuklenen_gruplar:
+            kup._grup_yukle(self.grup)
+        try:
+            return kup.__dict__[self.ad]
+        except KeyError:
+            raise AttributeError(self.ad)
+    
+    def __set__(self, kup, deger):
+        kup.__dict__[self.ad] = deger
+
+
+# Stok durumu kategorileri (stok_durum categorical kodları bu sırada)
+STOK_DURUMLARI = ['SEVK_GEREKLI', 'FAZLA_STOK', 'YAVAS', 'NORMAL']
+
+
+# =============================================================================
+# TOPLAM KÜPÜ - özet araçlar için önceden hesaplanmış seviyeler
+# =============================================================================
+class ToplamKupu:
+    """
+    stok_satis'in yükleme anında hesaplanan toplamları
+
+    Seviyeler (her biri stok_durum kırılımlı):
+        'hiyerarsi': kategori_kod × mg × bolge × depo_kod
+        'magaza':    magaza_kod
+        'urun':      kategori_kod × mg × urun_kod (kategori/mg ürünle birlikte gelir)
+    Ölçüler stok, satis, ciro, kar toplamları + satir (kayıt sayısı); topla() istenen
+    boyutları içeren en küçük seviyeden toplar. Benzersiz mağaza/ürün sayıları
+    toplanamadığı için tekil() tablolarında ayrıca tutulur.
+    """
+
+    OLCULER = ['stok', 'satis', 'ciro', 'kar']
+    SEVIYELER = {
+        'hiyerarsi': ['kategori_kod', 'mg', 'bolge', 'depo_kod'],
+        'magaza': ['magaza_kod'],
+        'urun': ['kategori_kod', 'mg', 'urun_kod'],
+    }
+    # Ürün başına sabit kolonlar (KPI mg bazlı) - urun seviyesinde 'first' ile taşınır
+    ILK_KOLONLAR = {'urun': ['min_deger']}
+    TEKIL_SEVIYELER = [
+        (['kategori_kod'], ['urun_kod', 'magaza_kod']),
+        (['bolge'], ['urun_kod', 'magaza_kod']),
+        (['kategori_kod', 'mg'], ['urun_kod']),
+    ]
+
+    def __init__(self, df: pd.DataFrame):
+        self.olculer = [k for k in self.OLCULER if k in df.columns]
+        self.seviyeler = {}
+        self.ilk_kolonlar = {}
+        for ad, boyutlar in self.SEVIYELER.items():
+            boyutlar = [b for b in boyutlar if b in df.columns]
+            if not boyutlar or 'stok_durum' not in df.columns:
+                continue
+            ilk = [k for k in self.ILK_KOLONLAR.get(ad, []) if k in df.columns]
+            gruplar = df.groupby(boyutlar + ['stok_durum'], observed=True, dropna=False, sort=False)
+            tablo = gruplar[self.olculer + ilk].agg({**{k: 'sum' for k in self.olculer}, **{k: 'first' for k in ilk}})
+            tablo['satir'] = gruplar.size()
+            self.seviyeler[ad] = tablo
+            self.ilk_kolonlar[ad] = ilk
+
+        self.tekil_tablolar = {}
+        for boyutlar, kolonlar in self.TEKIL_SEVIYELER:
+            kolonlar = [k for k in kolonlar if k in df.columns]
+            if kolonlar and set(boyutlar).issubset(df.columns):
+                self.tekil_tablolar[tuple(boyutlar)] = df.groupby(boyutlar)[kolonlar].nunique()
+
+    def topla(self, boyutlar: list = (), durumlar: list = None, filtre: dict = None, dropna: bool = True):
+        """
+        En yakın seviyeden toplam
+
+        boyutlar: gruplama kolonları ('stok_durum' dahil olabilir); boşsa genel toplam (Series)
+        durumlar: yalnızca bu stok durumları (ör. ['FAZLA_STOK', 'YAVAS'])
+        filtre: {'kategori_kod': '10'} - araçlardaki gibi str karşılaştırma
+        """
+        boyutlar = list(boyutlar)
+        gerekli = set(boyutlar) | set(filtre or {})
+        adaylar = [ad for ad, tablo in self.seviyeler.items() if gerekli.issubset(tablo.index.names)]
+        if not adaylar:
+            raise KeyError(f"Toplam küpünde bu boyutları içeren seviye yok: {sorted(gerekli)}")
+        ad = min(adaylar, key=lambda a: len(self.seviyeler[a]))
+        tablo = self.seviyeler[ad].reset_index()
+
+        if durumlar is not None:
+            tablo = tablo[tablo['stok_durum'].isin(durumlar)]
+        for kolon, deger in (filtre or {}).items():
+            tablo = tablo[tablo[kolon].astype(str) == str(deger)]
+
+        olculer = self.olculer + ['satir']
+        if not boyutlar:
+            return tablo[olculer].sum()
+        ilk = [k for k in self.ilk_kolonlar[ad] if k not in boyutlar]
+        return tablo.groupby(boyutlar, dropna=dropna, observed=True)[olculer + ilk].agg(
+            {**{k: 'sum' for k in olculer}, **{k: 'first' for k in ilk}}
+        )
+
+    def tekil(self, boyutlar: list, filtre: dict = None) -> pd.DataFrame:
+        """
+        Benzersiz ürün/mağaza sayıları (ör. tekil(['bolge']) → bolge × [urun_kod, magaza_kod])
+
+        filtre: seviye değerleri str karşılaştırmayla seçilir; çok seviyelide seçilen seviye düşer
+        """
+        tablo = self.tekil_tablolar[tuple(boyutlar)]
+        for kolon, deger in (filtre or {}).items():
+            tablo = tablo[tablo.index.get_level_values(kolon).astype(str) == str(deger)]
+            if tablo.index.nlevels > 1:
+                tablo = tablo.droplevel(kolon)
+        return tablo
+
+
+# =============================================================================
+# DEPO STOK GÖRÜNÜMÜ - tipli, tekil depo × ürün stoğu
+# =============================================================================
+# Depo dosyası farklı kolon adlarıyla gelebiliyor (urun_kodu, sku, miktar...).
+# Araçlar her çağrıda kolon arayıp anahtarları çevirip yeniden gruplamak yerine
+# küp yüklemesi başına bir kez kurulan bu görünümü kullanır.
+
+# Depo kodu boş/okunamayan satırlar (sevkiyat_hesapla'daki varsayılan depo)
+VARSAYILAN_DEPO = 9001
+
+
+class DepoStoku:
+    """
+    depo_stok'un kanonik görünümü
+
+        tablo:       depo_kod (int64), urun_kod (int64), stok (float64) -
+                     depo × ürün tekil (tekrarlar toplanır), depo/ürün sıralı
+        urun_toplam: urun_kod → tüm depolardaki stok
+        index:       (depo_kod, urun_kod) MultiIndex - konum() ile hash arama
+    Ürün kodu sayıya çevrilemeyen satırlar atlanır.
+    """
+
+    URUN_KOLONLARI = ['urun_kod', 'urun_kodu', 'urunkod', 'sku', 'product_code']
+    DEPO_KOLONLARI = ['depo_kod', 'depo_kodu', 'depokod', 'depo', 'warehouse']
+    STOK_KOLONLARI = ['stok', 'miktar', 'adet', 'quantity', 'stock']
+
+    def __init__(self, df: pd.DataFrame):
+        kolonlar = {str(k).replace('\ufeff', '').lower().strip(): k for k in df.columns} if df is not None else {}
+        urun_kol = next((kolonlar[k] for k in self.URUN_KOLONLARI if k in kolonlar), None)
+        depo_kol = next((kolonlar[k] for k in self.DEPO_KOLONLARI if k in kolonlar), None)
+        stok_kol = next((kolonlar[k] for k in self.STOK_KOLONLARI if k in kolonlar), None)
+        self.eksik_kolonlar = [ad for ad, kol in (('urun_kod', urun_kol), ('stok', stok_kol)) if kol is None]
+
+        if self.eksik_kolonlar or len(df) == 0:
+            tablo = pd.DataFrame({'depo_kod': pd.Series(dtype='int64'), 'urun_kod': pd.Series(dtype='int64'),
+                                  'stok': pd.Series(dtype='float64')})
+        else:
+            urun = pd.to_numeric(df[urun_kol], errors='coerce')
+            gecerli = urun.notna().to_numpy()
+            depo = (pd.to_numeric(df[depo_kol], errors='coerce').fillna(VARSAYILAN_DEPO).astype('int64')
+                    if depo_kol is not None else pd.Series(VARSAYILAN_DEPO, index=df.index, dtype='int64'))
+            stok = pd.to_numeric(df[stok_kol], errors='coerce').fillna(0).astype('float64')
+            ham = pd.DataFrame({
+                'depo_kod': depo.to_numpy()[gecerli],
+                'urun_kod': urun.to_numpy()[gecerli].astype('int64'),
+                'stok': stok.to_numpy()[gecerli],
+            })
+            tablo = ham.groupby(['depo_kod', 'urun_kod'], sort=True)['stok'].sum().reset_index()
+
+        self.tablo = tablo
+        self.index = pd.MultiIndex.from_arrays([tablo['depo_kod'], tablo['urun_kod']])
+        self.stok = tablo['stok'].to_numpy()
+        self.urun_toplam = tablo.groupby('urun_kod')['stok'].sum()
+
+    def __len__(self) -> int:
+        return len(self.tablo)
+
+    def konum(self, depo_kod, urun_kod) -> np.ndarray:
+        """(depo, ürün) çiftlerinin tablo satırı - depoda olmayan çift -1"""
+        depo = pd.to_numeric(pd.Series(np.asarray(depo_kod)), errors='coerce').fillna(VARSAYILAN_DEPO).astype('int64')
+        urun = pd.to_numeric(pd.Series(np.asarray(urun_kod)), errors='coerce').fillna(-1).astype('int64')
+        return self.index.get_indexer(pd.MultiIndex.from_arrays([depo, urun]))
+
+    def urun_stok(self, urun_kod) -> np.ndarray:
+        """Ürün kodları için tüm depolardaki toplam stok (depoda yoksa 0)"""
+        urun = pd.to_numeric(pd.Series(np.asarray(urun_kod)), errors='coerce')
+        return self.urun_toplam.reindex(urun).fillna(0).to_numpy()
+
+    def urun_satirlari(self, urun_kod) -> pd.DataFrame:
+        """Tek ürünün depo bazında stoğu"""
+        kod = pd.to_numeric(pd.Series([urun_kod]), errors='coerce').iloc[0]
+        if pd.isna(kod):
+            return self.tablo.iloc[:0]
+        return self.tablo[self.tablo['urun_kod'] == int(kod)]
+
+
+# =============================================================================
+# COVER DİAGRAM GÖRÜNÜMÜ - ayrıştırılmış tablo + alt grup/mağaza toplamları
+# =============================================================================
+# Excel'den gelen cover diagram kolonları metin olabilir ('12,5', '%8').
+# Ayrıştırma ve filtresiz toplamlar küp yüklemesi başına bir kez yapılır;
+# cover_diagram_analiz her çağrıda yalnızca filtre + sıralama yapar.
+def _sayi_kolonu(seri: pd.Series) -> pd.Series:
+    """Hücre hücre parse_val'ın vektörel karşılığı: '12,5%' → 12.5, boş/okunamayan → 0"""
+    if pd.api.types.is_numeric_dtype(seri.dtype) and not pd.api.types.is_bool_dtype(seri.dtype):
+        return seri.astype('float64').fillna(0)
+    metin = seri.astype(str).str.replace('%', '', regex=False).str.replace(',', '.', regex=False).str.strip()
+    return pd.to_numeric(metin, errors='coerce').fillna(0)
+
+
+def _kolon_ara(kolonlar: list, *anahtar_setleri) -> Optional[str]:
+    """Adında setteki tüm anahtarlar geçen ilk kolon (setler sırayla denenir)"""
+    for anahtarlar in anahtar_setleri:
+        for kol in kolonlar:
+            kol_lower = str(kol).lower()
+            if all(k in kol_lower for k in anahtarlar):
+                return kol
+    return None
+
+
+class CoverDiyagrami:
+    """
+    cover_diagram'ın ayrıştırılmış görünümü
+
+        kolonlar:       bulunan kaynak kolonlar (alt_grup, magaza, ty_cover, ...; yoksa None)
+        tablo:          _alt_grup, _magaza + sayısal ölçüler (_cover, _ly_cover, _lfl_satis,
+                        _avg_stok, _satis_adet, _satis_tutar, _magaza_sayisi, _stok)
+        alt_grup_ozet:  alt grup → cover ort., stok/satış/ciro toplamı (filtresiz)
+        magaza_ozet:    mağaza → cover ort. (filtresiz)
+    filtre_maskesi() her satırdaki metni değil, büyük harfli tekil alt grup /
+    mağaza adlarını tarar; eşleşme satırlara kategori kodlarıyla yayılır.
+    """
+
+    KOLON_ANAHTARLARI = {
+        'alt_grup': (['alt', 'grup'], ['grup']),
+        'magaza': (['store'], ['mağaza']),
+        # TY ve LY Cover kolonları (Excel'den direkt okunur, hesaplama YOK)
+        'ty_cover': (['ty', 'store', 'back', 'cover'], ['ty', 'back', 'cover'], ['ty', 'cover']),
+        'ly_cover': (['ly', 'store', 'back', 'cover'], ['ly', 'back', 'cover'], ['ly', 'cover']),
+        'stok': (['stock', 'unit'], ['stok', 'adet'], ['avg', 'stock'], ['stok']),
+        'satis_adet': (['sales', 'unit'], ['satış', 'adet'], ['satis', 'adet']),
+        'satis_tutar': (['sales', 'value'], ['satış', 'tutar'], ['sales', 'try']),
+        'lfl_satis': (['lfl', 'satış'], ['satış', 'değişim'], ['lfl', 'sales']),
+        'magaza_sayisi': (['mağaza', 'sayı'], ['store', 'count'], ['mağaza sayısı']),
+    }
+    # tablo kolonu: kaynak kolon anahtarı
+    OLCULER = {
+        '_cover': 'ty_cover', '_ly_cover': 'ly_cover', '_lfl_satis': 'lfl_satis', '_avg_stok': 'stok',
+        '_satis_adet': 'satis_adet', '_satis_tutar': 'satis_tutar', '_magaza_sayisi': 'magaza_sayisi',
+    }
+
+    def __init__(self, df: pd.DataFrame):
+        self.kaynak_kolonlar = list(df.columns)
+        self.kolonlar = {ad: _kolon_ara(self.kaynak_kolonlar, *setler) for ad, setler in self.KOLON_ANAHTARLARI.items()}
+
+        tablo = pd.DataFrame(index=pd.RangeIndex(len(df)))
+        self._kodlar = {}
+        for ad in ('alt_grup', 'magaza'):
+            kol = self.kolonlar[ad]
+            if kol is not None:
+                tablo[f'_{ad}'] = df[kol].to_numpy()
+                kodlar, adlar = pd.factorize(df[kol].astype(str))
+                self._kodlar[ad] = (kodlar, np.asarray(pd.Index(adlar).str.upper(), dtype=object))
+        for hedef, kaynak in self.OLCULER.items():
+            if self.kolonlar[kaynak] is not None:
+                tablo[hedef] = _sayi_kolonu(df[self.kolonlar[kaynak]]).to_numpy()
+
+        # Toplam stok = Ortalama stok × Mağaza sayısı (eğer avg stok kolonuysa)
+        if '_avg_stok' in tablo.columns:
+            if '_magaza_sayisi' in tablo.columns:
+                tablo['_stok'] = tablo['_avg_stok'] * tablo['_magaza_sayisi']
+            else:
+                tablo['_stok'] = tablo['_avg_stok']
+        self.tablo = tablo
+
+        self.alt_grup_ozet = self.alt_grup_topla(tablo) if '_alt_grup' in tablo.columns else None
+        self.magaza_ozet = self.magaza_topla(tablo) if '_magaza' in tablo.columns and '_cover' in tablo.columns else None
+
+    @staticmethod
+    def alt_grup_topla(tablo: pd.DataFrame) -> pd.DataFrame:
+        """Alt grup bazında cover ortalaması + stok/satış/ciro toplamı"""
+        agg = {k: ('mean' if k == '_cover' else 'sum')
+               for k in ('_cover', '_stok', '_satis_adet', '_satis_tutar') if k in tablo.columns}
+        if not agg:
+            # Hiçbir ölçü yoksa satır sayısı
+            return tablo.groupby('_alt_grup').size().to_frame('_cover')
+        return tablo.groupby('_alt_grup').agg(agg)
+
+    @staticmethod
+    def magaza_topla(tablo: pd.DataFrame) -> pd.DataFrame:
+        """Mağaza bazında cover ortalaması"""
+        return tablo.groupby('_magaza').agg({'_cover': 'mean'})
+
+    def filtre_maskesi(self, alt_grup: str = None, magaza: str = None) -> Optional[np.ndarray]:
+        """Alt grup / mağaza adında geçen metne göre satır maskesi (filtre yoksa None)"""
+        maske = None
+        for ad, deger in (('alt_grup', alt_grup), ('magaza', magaza)):
+            if not deger:
+                continue
+            if ad not in self._kodlar:
+                return np.zeros(len(self.tablo), dtype=bool)
+            kodlar, adlar = self._kodlar[ad]
+            eslesen = np.asarray(pd.Series(adlar, dtype=object).str.contains(deger.upper()), dtype=bool)
+            # Boş hücrenin kodu -1: sona eklenen False'a düşer
+            satir = np.append(eslesen, False)[kodlar]
+            maske = satir if maske is None else maske & satir
+        return maske
+
+
+# =============================================================================
+# TOP-N SEÇİMİ + DEPO DAĞITIMI
+# =============================================================================
+# Araçlar 10-50 satır göstermek için tüm toplamı sıralıyordu (O(N log N)).
+# en_buyuk_n kısmi seçimle (np.partition) eşiği bulur, yalnızca seçilen n satırı
+# sıralar. Eşitlikte ilk gelen satır kalır (nlargest keep='first'), NaN en sona.
+def _secim_indeksleri(degerler: np.ndarray, n: int, artan: bool = False) -> np.ndarray:
+    """Sıralı ilk n satırın pozisyonları"""
+    m = len(degerler)
+    n = min(max(int(n), 0), m)
+    if n == 0:
+        return np.empty(0, dtype=np.intp)
+
+    anahtar = degerler if artan else -degerler
+    anahtar = np.where(np.isnan(anahtar), np.inf, anahtar)
+    if n < m:
+        esik = np.partition(anahtar, n - 1)[n - 1]
+        kesin = np.flatnonzero(anahtar < esik)
+        esit = np.flatnonzero(anahtar == esik)[:n - len(kesin)]
+        aday = np.concatenate([kesin, esit])
+    else:
+        aday = np.arange(m)
+    return aday[np.argsort(anahtar[aday], kind='stable')]
+
+
+def en_buyuk_n(veri: Union[pd.DataFrame, pd.Series], n: int, kolon: str = None, artan: bool = False):
+    """
+    sort_values(kolon, ascending=artan).head(n) karşılığı - O(N) seçim
+
+    veri: DataFrame (kolon zorunlu) veya Series (ör. groupby(...).sum())
+    """
+    seri = veri if kolon is None else veri[kolon]
+    degerler = pd.to_numeric(seri, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return veri.iloc[_secim_indeksleri(degerler, n, artan)]
+
+
+def en_kucuk_n(veri: Union[pd.DataFrame, pd.Series], n: int, kolon: str = None):
+    """sort_values(kolon).head(n) karşılığı"""
+    return en_buyuk_n(veri, n, kolon, artan=True)
+
+
+def depo_dagit(ihtiyac: np.ndarray, grup: np.ndarray, grup_stok: np.ndarray) -> np.ndarray:
+    """
+    Depo stoğunu ihtiyaç büyükten küçüğe sırayla dağıt (greedy) - satır başına sevk
+
+    ihtiyac: satır ihtiyaçları; grup: satırın depo×ürün grubu (-1 = depoda yok)
+    grup_stok: grup başına depo stoğu
+
+    Toplam ihtiyacı stoğa sığan gruplarda sıra sonucu değiştirmez, herkes tamamını
+    alır. Yalnızca stoğun yetmediği (çekişmeli) grupların satırları sıralanır ve
+    grup içi kümülatif toplamla dağıtılır; sıralı döngüyle aynı sonuç.
+    """
+    ihtiyac = np.asarray(ihtiyac, dtype='float64')
+    grup = np.asarray(grup, dtype=np.intp)
+    grup_stok = np.clip(np.asarray(grup_stok, dtype='float64'), 0, None)
+    sevk = np.zeros(len(ihtiyac))
+
+    gecerli = (grup >= 0) & (ihtiyac > 0)
+    if not gecerli.any():
+        return sevk
+    talep = np.bincount(grup[gecerli], weights=ihtiyac[gecerli], minlength=len(grup_stok))
+    yeterli = np.zeros(len(ihtiyac), dtype=bool)
+    yeterli[gecerli] = talep[grup[gecerli]] <= grup_stok[grup[gecerli]]
+    sevk[yeterli] = ihtiyac[yeterli]
+
+    cekismeli = np.flatnonzero(gecerli & ~yeterli)
+    cekismeli = cekismeli[grup_stok[grup[cekismeli]] > 0]
+    if len(cekismeli):
+        # grup, sonra ihtiyaç azalan; eşitlikte satır sırası (lexsort kararlı)
+        sira = cekismeli[np.lexsort((-ihtiyac[cekismeli], grup[cekismeli]))]
+        g = grup[sira]
+        miktar = ihtiyac[sira]
+        kumulatif = np.cumsum(miktar)
+        baslangic = np.r_[True, g[1:] != g[:-1]]
+        taban = np.maximum.accumulate(np.where(baslangic, np.arange(len(g)), 0))
+        onceki = kumulatif - miktar - (kumulatif[taban] - miktar[taban])
+        sevk[sira] = np.clip(grup_stok[g] - onceki, 0, miktar)
+    return sevk
+
+
 class KupVeri:
     """CSV ve Excel tabanlı küp verisi yönetimi"""
     
-    def __init__(self, veri_klasoru: str):
+    # =========================================================================
+    # VERİ GRUPLARI - her grup ilk erişimde (veya arka planda) yüklenir
+    # =========================================================================
+    # grup -> kaynaklar; 'stok' grubu yüklenince _hazirla join'leri çalışır
+    # (master'lar stok/satıştan önce okunur - akış modu chunk'ları onlarla zenginleştirir)
+    VERI_GRUPLARI = {
+        'stok': ['urun_master', 'magaza_master', 'depo_stok', 'kpi', 'stok_satis'],
+        'trading': ['trading'],
+        'sc': ['sc'],
+        'cover': ['cover'],
+        'kapasite': ['kapasite'],
+        'siparis': ['siparis'],
+    }
+    
+    stok_satis = _TembelVeri('stok')
+    urun_master = _TembelVeri('stok')
+    magaza_master = _TembelVeri('stok')
+    depo_stok = _TembelVeri('stok')
+    kpi = _TembelVeri('stok')
+    trading = _TembelVeri('trading')
+    trading_detay = _TembelVeri('trading')
+    online_offline = _TembelVeri('trading')
+    sc_sayfalari = _TembelVeri('sc')
+    cover_diagram = _TembelVeri('cover')
+    kapasite = _TembelVeri('kapasite')
+    siparis_takip = _TembelVeri('siparis')
+    
+    def __init__(self, veri_klasoru: str, ilerleme: Optional[Callable[[int, str], None]] = None,
+                 arka_plan: bool = True):
         """
         veri_klasoru: CSV ve Excel dosyalarının bulunduğu klasör
+        ilerleme: (yüzde, mesaj) ile çağrılan ilerleme bildirimi (arka plan yükleme için)
+        arka_plan: True ise tüm gruplar arka plan thread'inde önceden yüklenir;
+                   False ise her grup yalnızca ilk erişimde yüklenir
         """
         self.veri_klasoru = veri_klasoru
-        self._yukle()
-        self._hazirla()
+        self.veri_versiyonu = veri_versiyonu_hesapla(veri_klasoru)
+        self._ilerleme = ilerleme
+        self._arka_plan = arka_plan
+        self._tembel_durum_olustur()
+        self._imzalari_sabitle(self.VERI_GRUPLARI)
+        if arka_plan:
+            self._arka_planda_yukle()
+    
+    def _tembel_durum_olustur(self, yuklenen_gruplar=()):
+        """Grup kilitleri ve yükleme durumu (kopyalanan küpte yeniden oluşturulur)"""
+        self._yuklenen_gruplar = set(yuklenen_gruplar)
+        self._yukleyen_thread = {}
+        self._grup_kilitleri = {grup: threading.RLock() for grup in self.VERI_GRUPLARI}
+        # grup -> son yükleme hatası (tembel erişimde tekrar denenir)
+        self._grup_hatalari = {}
+        if not hasattr(self, '_parmak_izleri'):
+            self._parmak_izleri = {}
+    
+    def _imzalari_sabitle(self, gruplar):
+        """
+        Grupların kaynak parmak izlerini şimdiki dosyalara sabitle
+        
+        Tembel yüklenen grup sonradan değişmiş dosyalardan okunmaz (küp
+        veri_versiyonu ile tutarlı kalır) - _grup_yukle farkı hata olarak bildirir.
+        """
+        for grup in gruplar:
+            for kaynak in self.VERI_GRUPLARI[grup]:
+                self._parmak_izleri[kaynak] = self._dosya_imzasi(self._kaynak_dosyalari(kaynak))
+    
+    def yuklu_mu(self, grup: str) -> bool:
+        """Veri grubu yüklendi mi (yüklemeyi tetiklemez)"""
+        return grup in self._yuklenen_gruplar
+    
+    def _arka_planda_yukle(self):
+        threading.Thread(target=self._yukle, name="kup-on-yukleme", daemon=True).start()
+    
+    def _grup_yukle(self, grup: str):
+        """Grubun kaynaklarını oku; stok grubu için _hazirla'yı çalıştır"""
+        kilit = self._grup_kilitleri[grup]
+        with kilit:
+            # Aynı thread grup yüklerken alana erişirse (örn. _hazirla) tekrar yükleme
+            if grup in self._yuklenen_gruplar or self._yukleyen_thread.get(grup) == threading.get_ident():
+                return
+            degisen = [
+                kaynak for kaynak in self.VERI_GRUPLARI[grup]
+                if kaynak in self._parmak_izleri
+                and self._dosya_imzasi(self._kaynak_dosyalari(kaynak)) != self._parmak_izleri[kaynak]
+            ]
+            if degisen:
+                raise RuntimeError(f"Veri dosyaları küp yüklendikten sonra değişti ({', '.join(degisen)}) "
+                                   f"- yeni veri yükleniyor, biraz sonra tekrar deneyin")
+            self._yukleyen_thread[grup] = threading.get_ident()
+            try:
+                baslangic = time.time()
+                for kaynak in self.VERI_GRUPLARI[grup]:
+                    yuzde, mesaj = self._KAYNAK_ILERLEME[kaynak]
+                    self._ilerleme_bildir(yuzde, mesaj)
+                    self._kaynak_oku(kaynak)
+                if grup == 'stok':
+                    self._ilerleme_bildir(90, "Veri zenginleştiriliyor")
+                    self._hazirla()
+                self._yuklenen_gruplar.add(grup)
+                self._grup_hatalari.pop(grup, None)
+                print(f"   ⚡ Veri grubu yüklendi: {grup} ({time.time() - baslangic:.1f} sn)")
+            finally:
+                self._yukleyen_thread.pop(grup, None)
+    
+    def _ilerleme_bildir(self, yuzde: int, mesaj: str):
+        if self._ilerleme:
+            try:
+                self._ilerleme(yuzde, mesaj)
+            except Exception:
+                pass
+    
+    # =========================================================================
+    # KAYNAKLAR - her kaynak kendi dosyalarını bulur ve yükler
+    # =========================================================================
+    # (kaynak, ilerleme yüzdesi, mesaj) - yenile() yalnızca dosya imzası
+    # (ad + boyut + değişiklik zamanı) değişen kaynakları yeniden okur
+    KAYNAKLAR = [
+        ('urun_master', 5, "Master tablolar okunuyor"),
+        ('magaza_master', 7, "Master tablolar okunuyor"),
+        ('depo_stok', 9, "Depo stok okunuyor"),
+        ('kpi', 11, "KPI okunuyor"),
+        ('stok_satis', 13, "Stok/satış okunuyor"),
+        ('trading', 35, "Trading raporu okunuyor"),
+        ('sc', 50, "SC tablosu okunuyor"),
+        ('cover', 60, "Cover diagram okunuyor"),
+        ('kapasite', 70, "Kapasite okunuyor"),
+        ('siparis', 80, "Sipariş takip okunuyor"),
+    ]
+    _KAYNAK_ILERLEME = {kaynak: (yuzde, mesaj) for kaynak, yuzde, mesaj in KAYNAKLAR}
+    # Bu kaynaklardan biri değişirse _hazirla (join + hesaplamalar) yeniden çalışır
+    HAZIRLIK_KAYNAKLARI = {'stok_satis', 'urun_master', 'magaza_master', 'kpi'}
+    MASTER_DOSYALARI = {
+        'urun_master': "urun_master.csv",
+        'magaza_master': "magaza_master.csv",
+        'depo_stok': "depo_stok.csv",
+        'kpi': "kpi.csv",
+    }
     
-    def _yukle(self):
-        """Tüm veri dosyalarını yükle"""
+    def _yukle(self) -> dict:
+        """
+        Tüm veri gruplarını yükle (arka plan ön yüklemesi)
         
-        # =====================================================================
-        # 1. ANLIK STOK SATIŞ (CSV - parçalı dosyalar)
-        # =====================================================================
-        stok_satis_files = glob.glob(os.path.join(self.veri_klasoru, "anlik_stok_satis*.csv"))
+        Returns:
+            Yüklenemeyen gruplar: {grup: hata mesajı} (ilk erişimde tekrar denenir)
+        """
+        for grup in self.VERI_GRUPLARI:
+            try:
+                self._grup_yukle(grup)
+            except Exception as e:
+                self._grup_hatalari[grup] = str(e)
+                print(f"   ⚠️ Veri grubu yüklenemedi ({grup}): {e}")
+        if self._grup_hatalari:
+            self._ilerleme_bildir(100, f"Eksik veri: {', '.join(self._grup_hatalari)}")
+            return dict(self._grup_hatalari)
+        self._ilerleme_bildir(100, "Tüm veriler yüklendi")
+        self._yukleme_ozeti()
+        return {}
+    
+    def _kaynak_grubu(self, kaynak: str) -> str:
+        for grup, kaynaklar in self.VERI_GRUPLARI.items():
+            if kaynak in kaynaklar:
+                return grup
+    
+    @staticmethod
+    def _dosya_imzasi(dosyalar: List[str]) -> list:
+        """Kaynağın parmak izi: [dosya adı, boyut, değişiklik zamanı] listesi"""
+        imza = []
+        for f in sorted(set(dosyalar)):
+            try:
+                bilgi = os.stat(f)
+                imza.append([os.path.basename(f), bilgi.st_size, bilgi.st_mtime_ns])
+            except OSError:
+                imza.append([os.path.basename(f), -1, -1])
+        return imza
+    
+    def _excel_dosyalari(self) -> List[str]:
+        return [f for f in os.listdir(self.veri_klasoru) if f.endswith('.xlsx') or f.endswith('.xls')]
+    
+    def _kaynak_dosyalari(self, kaynak: str) -> List[str]:
+        """Kaynağa ait dosyaları bul (ilk eleman yüklenecek dosya)"""
+        if kaynak == 'stok_satis':
+            return sorted(glob.glob(os.path.join(self.veri_klasoru, "anlik_stok_satis*.csv")))
+        
+        elif kaynak in self.MASTER_DOSYALARI:
+            path = os.path.join(self.veri_klasoru, self.MASTER_DOSYALARI[kaynak])
+            return [path] if os.path.exists(path) else []
+        
+        elif kaynak == 'trading':
+            # Önce trading.xlsx, sonra *CUBE* pattern
+            trading_path = os.path.join(self.veri_klasoru, "trading.xlsx")
+            if os.path.exists(trading_path):
+                return [trading_path]
+            return glob.glob(os.path.join(self.veri_klasoru, "*CUBE*.xlsx")) + \
+                   glob.glob(os.path.join(self.veri_klasoru, "*cube*.xlsx")) + \
+                   glob.glob(os.path.join(self.veri_klasoru, "*Cube*.xlsx"))
+        
+        elif kaynak == 'sc':
+            return glob.glob(os.path.join(self.veri_klasoru, "*SC*.xlsx")) + \
+                   glob.glob(os.path.join(self.veri_klasoru, "*sc*.xlsx")) + \
+                   glob.glob(os.path.join(self.veri_klasoru, "*Tablosu*.xlsx"))
+        
+        elif kaynak == 'cover':
+            # Cover içeren dosyalar
+            return [os.path.join(self.veri_klasoru, f) for f in self._excel_dosyalari()
+                    if 'cover' in f.lower()]
+        
+        elif kaynak == 'kapasite':
+            # Kapasite veya Periyod içeren dosyalar
+            return [os.path.join(self.veri_klasoru, f) for f in self._excel_dosyalari()
+                    if 'kapasite' in f.lower() or 'periyod' in f.lower() or 'zet' in f.lower()]
+        
+        elif kaynak == 'siparis':
+            return [os.path.join(self.veri_klasoru, f) for f in self._excel_dosyalari()
+                    if self._siparis_dosyasi_mi(f)]
+        
+        return []
+    
+    @staticmethod
+    def _siparis_dosyasi_mi(f: str) -> bool:
+        # Türkçe karakter normalize fonksiyonu
+        def normalize_turkish(text):
+            replacements = {
+                'ş': 's', 'Ş': 's', 'ı': 'i', 'İ': 'i',
+                'ğ': 'g', 'Ğ': 'g', 'ü': 'u', 'Ü': 'u',
+                'ö': 'o', 'Ö': 'o', 'ç': 'c', 'Ç': 'c'
+            }
+            for tr, en in replacements.items():
+                text = text.replace(tr, en)
+            return text.lower()
+        
+        f_lower = f.lower()
+        f_normalized = normalize_turkish(f)
+        
+        # GENIŞ PATTERN: siparis, takip, satin, yerle, order, purchase
+        # Hem orijinal hem normalize edilmiş versiyonda ara
+        return (
+            'siparis' in f_lower or
+            'sipariş' in f_lower or
+            'siparis' in f_normalized or
+            'takip' in f_lower or
+            'takip' in f_normalized or
+            'satin' in f_lower or
+            'satın' in f_lower or
+            'satin' in f_normalized or
+            'yerle' in f_lower or
+            'order' in f_lower or
+            'purchase' in f_lower or
+            'po_' in f_lower or
+            'po ' in f_lower or
+            f_lower == 'siparis.xlsx' or
+            f_lower.startswith('siparis') or
+            f_normalized.startswith('siparis')
+        )
+    
+    def _kaynak_oku(self, kaynak: str):
+        """Kaynağın dosyalarını bul, parmak izini kaydet ve yükle"""
+        dosyalar = self._kaynak_dosyalari(kaynak)
+        self._parmak_izleri[kaynak] = self._dosya_imzasi(dosyalar)
+        
+        if kaynak == 'stok_satis':
+            self._yukle_stok_satis(dosyalar)
+        elif kaynak in self.MASTER_DOSYALARI:
+            self._yukle_master(kaynak, dosyalar)
+        elif kaynak == 'trading':
+            self._yukle_trading(dosyalar)
+        elif kaynak == 'sc':
+            self._yukle_sc(dosyalar)
+        elif kaynak == 'cover':
+            self._yukle_cover(dosyalar)
+        elif kaynak == 'kapasite':
+            self._yukle_kapasite(dosyalar)
+        elif kaynak == 'siparis':
+            self._yukle_siparis(dosyalar)
+    
+    # =====================================================================
+    # 1. ANLIK STOK SATIŞ (CSV - parçalı dosyalar)
+    # =====================================================================
+    def _yukle_stok_satis(self, stok_satis_files: List[str]):
+        self._stok_zenginlestirildi = False
         if stok_satis_files:
+            toplam_boyut = sum(os.path.getsize(f) for f in stok_satis_files)
+            if STOK_AKIS_ESIGI_MB >= 0 and toplam_boyut >= STOK_AKIS_ESIGI_MB * 1024 * 1024:
+                self._stok_satis_akis(stok_satis_files, toplam_boyut)
+                return
             dfs = []
             for f in stok_satis_files:
                 try:
@@ -61,204 +1157,232 @@ class KupVeri:
             self.stok_satis = pd.concat(dfs, ignore_index=True)
         else:
             self.stok_satis = pd.DataFrame()
+    
+    def _stok_satis_akis(self, stok_satis_files: List[str], toplam_boyut: int):
+        """Parçaları chunk chunk oku, master'larla zenginleştir, kolon tamponuna yaz"""
+        baslangic = time.time()
+        tampon = _KolonTamponu(sum(csv_satir_tahmini(f) for f in stok_satis_files))
+        ham_kolonlar = []       # pd.concat'teki kolon sırası
+        eklenen_kolonlar = []   # master'lardan gelenler (merge'deki gibi sona)
+        tablolar = None
+        for f in stok_satis_files:
+            parca_basi = tampon.n
+            for encoding in ('utf-8', 'latin-1'):
+                try:
+                    sep = csv_ayirici_bul(f, encoding)
+                    for chunk in pd.read_csv(f, encoding=encoding, sep=sep, chunksize=STOK_AKIS_CHUNK):
+                        chunk.columns = chunk.columns.str.replace('\ufeff', '').str.lower().str.strip()
+                        ham_kolonlar.extend(k for k in chunk.columns if k not in ham_kolonlar)
+                        if tablolar is None:
+                            tablolar = self._zenginlestirme_tablolari(chunk.columns)
+                        chunk, eklenenler = self._master_zenginlestir(chunk, tablolar)
+                        eklenen_kolonlar.extend(k for k in eklenenler if k not in eklenen_kolonlar)
+                        tampon.ekle(chunk)
+                    break
+                except UnicodeDecodeError:
+                    # Yarım okunan parça atılır, latin-1 ile baştan okunur
+                    tampon.n = parca_basi
+        
+        sira = [k for k in tampon.diziler if k not in eklenen_kolonlar] + eklenen_kolonlar
+        self.stok_satis = tampon.tablo(sira)
+        self._ham_stok_kolonlari = ham_kolonlar
+        self._ham_stok_satir = len(self.stok_satis)
+        self._stok_zenginlestirildi = True
+        print(f"   🌊 Akış modu: {len(stok_satis_files)} parça, {toplam_boyut / 1024 / 1024:,.0f} MB → "
+              f"{len(self.stok_satis):,} satır ({time.time() - baslangic:.1f} sn)")
+    
+    @staticmethod
+    def _anahtar_tamsayi(seri: pd.Series) -> pd.Series:
+        """Join anahtarı tamsayı (boşlar 0) - zaten int ise kopyalanmaz"""
+        if pd.api.types.is_integer_dtype(seri.dtype):
+            return seri
+        return pd.to_numeric(seri, errors='coerce').fillna(0).astype('int64')
+    
+    def _zenginlestirme_tablolari(self, kolonlar) -> list:
+        """
+        Master lookup'ları: [(anahtar, tablo)] - tablolar tamsayı anahtar index'li ve tekil
         
-        
-        # =====================================================================
-        # 2. MASTER TABLOLAR (CSV)
-        # =====================================================================
-        urun_path = os.path.join(self.veri_klasoru, "urun_master.csv")
-        if os.path.exists(urun_path):
-            try:
-                self.urun_master = pd.read_csv(urun_path, encoding='utf-8', sep=None, engine='python')
-            except:
-                self.urun_master = pd.read_csv(urun_path, encoding='latin-1', sep=None, engine='python')
-        else:
-            self.urun_master = pd.DataFrame()
-        
-        magaza_path = os.path.join(self.veri_klasoru, "magaza_master.csv")
-        if os.path.exists(magaza_path):
-            try:
-                self.magaza_master = pd.read_csv(magaza_path, encoding='utf-8', sep=None, engine='python')
-            except:
-                self.magaza_master = pd.read_csv(magaza_path, encoding='latin-1', sep=None, engine='python')
-        else:
-            self.magaza_master = pd.DataFrame()
-        
-        depo_path = os.path.join(self.veri_klasoru, "depo_stok.csv")
-        if os.path.exists(depo_path):
-            try:
-                self.depo_stok = pd.read_csv(depo_path, encoding='utf-8', sep=None, engine='python')
-            except:
-                self.depo_stok = pd.read_csv(depo_path, encoding='latin-1', sep=None, engine='python')
-        else:
-            self.depo_stok = pd.DataFrame()
-        
-        kpi_path = os.path.join(self.veri_klasoru, "kpi.csv")
-        if os.path.exists(kpi_path):
+        Tekrarlayan anahtarda ilk kayıt kullanılır (merge gibi satır çoğaltılmaz).
+        """
+        kolonlar = set(kolonlar)
+        tablolar = []
+        for master, anahtar, ekler in (
+            (self.urun_master, 'urun_kod', ['kategori_kod', 'umg', 'mg', 'marka_kod', 'nitelik', 'durum']),
+            (self.magaza_master, 'magaza_kod', ['il', 'bolge', 'tip', 'depo_kod']),
+            (self.kpi, 'mg', None),
+        ):
+            if len(master) == 0 or anahtar not in kolonlar:
+                continue
+            master = kup_kopya(master)
+            master.columns = master.columns.str.replace('\ufeff', '').str.lower().str.strip()
+            if ekler is None:
+                master = master.rename(columns={'mg_id': 'mg'})
+                ekler = [k for k in master.columns if k != 'mg']
+            if anahtar not in master.columns:
+                continue
+            ekler = [k for k in ekler if k in master.columns]
+            tablo = master[ekler].set_axis(pd.Index(self._anahtar_tamsayi(master[anahtar])))
+            if not tablo.index.is_unique:
+                print(f"   ⚠️ {anahtar}: master'da tekrar eden anahtarlar - ilk kayıt kullanılıyor")
+                tablo = tablo[~tablo.index.duplicated()]
+            tablolar.append((anahtar, tablo))
+            for kol in ekler:
+                if kol in kolonlar:
+                    kolonlar.discard(kol)
+                    kolonlar.update([f'{kol}_x', f'{kol}_y'])
+                else:
+                    kolonlar.add(kol)
+        return tablolar
+    
+    @classmethod
+    def _master_zenginlestir(cls, chunk: pd.DataFrame, tablolar: list):
+        """Master kolonlarını index eşlemesiyle (get_indexer + take) yerinde ekle"""
+        eklenenler = []
+        for anahtar, tablo in tablolar:
+            if anahtar not in chunk.columns:
+                chunk[anahtar] = np.nan
+            chunk[anahtar] = cls._anahtar_tamsayi(chunk[anahtar])
+            konum = tablo.index.get_indexer(chunk[anahtar])
+            for kol in tablo.columns:
+                hedef = kol
+                if kol in chunk.columns:
+                    # merge ile aynı: çakışan kolonlar _x / _y
+                    chunk = chunk.rename(columns={kol: f'{kol}_x'})
+                    hedef = f'{kol}_y'
+                chunk[hedef] = tablo[kol].array.take(konum, allow_fill=True)
+                eklenenler.append(hedef)
+        return chunk, eklenenler
+    
+    # =====================================================================
+    # 2. MASTER TABLOLAR (CSV) - urun_master, magaza_master, depo_stok, kpi
+    # =====================================================================
+    def _yukle_master(self, kaynak: str, dosyalar: List[str]):
+        if dosyalar:
             try:
-                self.kpi = pd.read_csv(kpi_path, encoding='utf-8', sep=None, engine='python')
+                df = pd.read_csv(dosyalar[0], encoding='utf-8', sep=None, engine='python')
             except:
-                self.kpi = pd.read_csv(kpi_path, encoding='latin-1', sep=None, engine='python')
+                df = pd.read_csv(dosyalar[0], encoding='latin-1', sep=None, engine='python')
         else:
-            self.kpi = pd.DataFrame()
-        
-        # =====================================================================
-        # 3. TRADING RAPORU (Excel) - trading.xlsx veya *CUBE* dosyası
-        # =====================================================================
+            df = pd.DataFrame()
+        setattr(self, kaynak, df)
+    
+    # =====================================================================
+    # 3. TRADING RAPORU (Excel) - trading.xlsx veya *CUBE* dosyası
+    # =====================================================================
+    def _yukle_trading(self, dosyalar: List[str]):
         self.trading = pd.DataFrame()
         self.trading_detay = pd.DataFrame()
         self.online_offline = pd.DataFrame()
 
-        # Dosya bul: önce trading.xlsx, sonra *CUBE* pattern
-        trading_path = os.path.join(self.veri_klasoru, "trading.xlsx")
-        if not os.path.exists(trading_path):
-            cube_files = glob.glob(os.path.join(self.veri_klasoru, "*CUBE*.xlsx")) + \
-                         glob.glob(os.path.join(self.veri_klasoru, "*cube*.xlsx")) + \
-                         glob.glob(os.path.join(self.veri_klasoru, "*Cube*.xlsx"))
-            if cube_files:
-                trading_path = cube_files[0]
-                print(f"   📂 CUBE dosyası bulundu: {os.path.basename(trading_path)}")
-            else:
-                trading_path = None
+        trading_path = dosyalar[0] if dosyalar else None
+        if trading_path and os.path.basename(trading_path) != "trading.xlsx":
+            print(f"   📂 CUBE dosyası bulundu: {os.path.basename(trading_path)}")
 
         if trading_path and os.path.exists(trading_path):
             try:
-                xl = pd.ExcelFile(trading_path)
-                sheet_names = xl.sheet_names
-                print(f"   📋 Trading sheet'leri: {sheet_names}")
-
-                # --- Ana trading verisi (Trading > Trading Sunum > mtd > ilk sheet) ---
-                # Trading sheet Grand Total ve ...Total satirlari icerir
-                trading_sheet = None
-                for candidate in ['Trading', 'Trading Sunum', 'mtd']:
-                    if candidate in sheet_names:
-                        trading_sheet = candidate
-                        break
-                if trading_sheet is None:
-                    trading_sheet = sheet_names[0]
-
-                self.trading = self._excel_oto_header(xl, trading_sheet)
-                print(f"   ✅ Trading yüklendi ({trading_sheet}): {len(self.trading)} satır, kolonlar: {list(self.trading.columns)[:8]}")
-
-                # --- Trading detay (Trading Sunum sheet - CategoryLeader/TribeLeader bilgisi) ---
-                if 'Trading Sunum' in sheet_names and trading_sheet != 'Trading Sunum':
-                    self.trading_detay = self._excel_oto_header(xl, 'Trading Sunum')
-                    print(f"   ✅ Trading Sunum yüklendi: {len(self.trading_detay)} satır")
-
-                # --- Online vs Offline ---
-                for candidate in ['offline vs online', 'Offline vs Online', 'offline_online']:
-                    if candidate in sheet_names:
-                        self.online_offline = self._excel_oto_header(xl, candidate)
-                        print(f"   ✅ Online/Offline yüklendi ({candidate}): {len(self.online_offline)} satır")
-                        break
+                with ExcelOkuyucu(trading_path) as xl:
+                    sheet_names = xl.sayfalar
+                    print(f"   📋 Trading sheet'leri: {sheet_names}")
+
+                    # --- Ana trading verisi (Trading > Trading Sunum > mtd > ilk sheet) ---
+                    # Trading sheet Grand Total ve ...Total satirlari icerir
+                    trading_sheet = None
+                    for candidate in ['Trading', 'Trading Sunum', 'mtd']:
+                        if candidate in sheet_names:
+                            trading_sheet = candidate
+                            break
+                    if trading_sheet is None:
+                        trading_sheet = sheet_names[0]
+
+                    self.trading = self._excel_oto_header(xl, trading_sheet)
+                    print(f"   ✅ Trading yüklendi ({trading_sheet}): {len(self.trading)} satır, kolonlar: {list(self.trading.columns)[:8]}")
+
+                    # --- Trading detay (Trading Sunum sheet - CategoryLeader/TribeLeader bilgisi) ---
+                    if 'Trading Sunum' in sheet_names and trading_sheet != 'Trading Sunum':
+                        self.trading_detay = self._excel_oto_header(xl, 'Trading Sunum')
+                        print(f"   ✅ Trading Sunum yüklendi: {len(self.trading_detay)} satır")
+
+                    # --- Online vs Offline ---
+                    for candidate in ['offline vs online', 'Offline vs Online', 'offline_online']:
+                        if candidate in sheet_names:
+                            self.online_offline = self._excel_oto_header(xl, candidate)
+                            print(f"   ✅ Online/Offline yüklendi ({candidate}): {len(self.online_offline)} satır")
+                            break
 
             except Exception as e:
                 print(f"   ⚠️ Trading dosyası okunamadı: {e}")
                 self.trading = pd.DataFrame()
-        
-        # =====================================================================
-        # 4. SC TABLOSU (Excel - birden fazla sayfa)
-        # =====================================================================
-        sc_files = glob.glob(os.path.join(self.veri_klasoru, "*SC*.xlsx")) + \
-                   glob.glob(os.path.join(self.veri_klasoru, "*sc*.xlsx")) + \
-                   glob.glob(os.path.join(self.veri_klasoru, "*Tablosu*.xlsx"))
-        
+    
+    # =====================================================================
+    # 4. SC TABLOSU (Excel - birden fazla sayfa)
+    # =====================================================================
+    def _yukle_sc(self, sc_files: List[str]):
         self.sc_sayfalari = {}
         if sc_files:
             sc_path = sc_files[0]  # İlk bulunan SC dosyası
             try:
-                xl = pd.ExcelFile(sc_path)
-                for sheet_name in xl.sheet_names:
-                    try:
-                        self.sc_sayfalari[sheet_name] = pd.read_excel(xl, sheet_name=sheet_name)
-                    except:
-                        pass
+                with ExcelOkuyucu(sc_path) as xl:
+                    for sheet_name in xl.sayfalar:
+                        try:
+                            self.sc_sayfalari[sheet_name] = xl.oku(sheet_name)
+                        except:
+                            pass
             except Exception as e:
                 print(f"SC dosyası okunamadı: {e}")
-        
-        # =====================================================================
-        # 5. COVER DİAGRAM (Excel) - Mağaza×AltGrup cover analizi
-        # =====================================================================
-        cover_files = []
-        
-        # Tüm xlsx dosyalarını tara
-        for f in os.listdir(self.veri_klasoru):
-            if not f.endswith('.xlsx') and not f.endswith('.xls'):
-                continue
-            f_lower = f.lower()
-            # Cover içeren dosyalar
-            if 'cover' in f_lower:
-                full_path = os.path.join(self.veri_klasoru, f)
-                cover_files.append(full_path)
-                print(f"   📂 Cover dosyası bulundu: {f}")
+    
+    # =====================================================================
+    # 5. COVER DİAGRAM (Excel) - Mağaza×AltGrup cover analizi
+    # =====================================================================
+    def _yukle_cover(self, cover_files: List[str]):
+        for f in cover_files:
+            print(f"   📂 Cover dosyası bulundu: {os.path.basename(f)}")
         
         self.cover_diagram = pd.DataFrame()
         if cover_files:
             try:
                 print(f"   📖 Cover okunuyor: {cover_files[0]}")
-                self.cover_diagram = pd.read_excel(cover_files[0], sheet_name=0)
+                with ExcelOkuyucu(cover_files[0]) as xl:
+                    self.cover_diagram = xl.oku(0)
                 print(f"   ✅ Cover Diagram yüklendi: {len(self.cover_diagram)} satır, {len(self.cover_diagram.columns)} kolon")
             except Exception as e:
                 print(f"   ⚠️ Cover Diagram okunamadı: {e}")
         else:
             print(f"   ⚠️ Cover dosyası bulunamadı")
-        
-        # =====================================================================
-        # 6. KAPASİTE-PERFORMANS (Excel) - Mağaza doluluk analizi
-        # =====================================================================
-        kapasite_files = []
-        
-        # Tüm xlsx dosyalarını tara
-        for f in os.listdir(self.veri_klasoru):
-            if not f.endswith('.xlsx') and not f.endswith('.xls'):
-                continue
-            f_lower = f.lower()
-            # Kapasite veya Periyod içeren dosyalar
-            if 'kapasite' in f_lower or 'periyod' in f_lower or 'zet' in f_lower:
-                full_path = os.path.join(self.veri_klasoru, f)
-                kapasite_files.append(full_path)
-                print(f"   📂 Kapasite dosyası bulundu: {f}")
+    
+    # =====================================================================
+    # 6. KAPASİTE-PERFORMANS (Excel) - Mağaza doluluk analizi
+    # =====================================================================
+    def _yukle_kapasite(self, kapasite_files: List[str]):
+        for f in kapasite_files:
+            print(f"   📂 Kapasite dosyası bulundu: {os.path.basename(f)}")
         
         self.kapasite = pd.DataFrame()
         if kapasite_files:
             try:
                 kap_path = kapasite_files[0]
                 print(f"   📖 Kapasite okunuyor: {kap_path}")
-                kap_xl = pd.ExcelFile(kap_path)
-                kap_sheets = kap_xl.sheet_names
-                print(f"   📋 Kapasite sheet'leri: {kap_sheets}")
-
-                # Öncelik: son1hafta > son 1 hafta > ilk sheet
-                kap_sheet = None
-                for candidate in kap_sheets:
-                    c_lower = candidate.lower().replace(' ', '')
-                    if 'son1hafta' in c_lower or 'son1 hafta' in c_lower:
-                        kap_sheet = candidate
-                        break
-                if kap_sheet is None:
-                    kap_sheet = kap_sheets[0]
-
-                # Header satırını otomatik bul: StoreName, Store Capacity, Fiili Doluluk gibi keyword'ler
-                KAP_KEYWORDS = [
-                    'storename', 'store capacity', 'fiili doluluk', 'store cover',
-                    'eop ty store stock', 'avg store stock', 'sales unit',
-                    'store stock unit', 'karlı', 'karli', 'capacity dm3',
-                ]
-                raw = pd.read_excel(kap_xl, sheet_name=kap_sheet, header=None, nrows=15)
-                kap_header_row = None
-                best = 0
-                for idx, row in raw.iterrows():
-                    row_text = ' '.join(str(v).lower() for v in row.values if pd.notna(v))
-                    matches = sum(1 for kw in KAP_KEYWORDS if kw in row_text)
-                    if matches > best and matches >= 2:
-                        best = matches
-                        kap_header_row = idx
-
-                if kap_header_row is not None:
-                    print(f"   📍 Kapasite header satırı: {kap_header_row} ({best} eşleşme)")
-                    self.kapasite = pd.read_excel(kap_xl, sheet_name=kap_sheet, header=kap_header_row)
-                else:
-                    self.kapasite = pd.read_excel(kap_xl, sheet_name=kap_sheet, header=0)
+                with ExcelOkuyucu(kap_path) as kap_xl:
+                    kap_sheets = kap_xl.sayfalar
+                    print(f"   📋 Kapasite sheet'leri: {kap_sheets}")
+
+                    # Öncelik: son1hafta > son 1 hafta > ilk sheet
+                    kap_sheet = None
+                    for candidate in kap_sheets:
+                        c_lower = candidate.lower().replace(' ', '')
+                        if 'son1hafta' in c_lower or 'son1 hafta' in c_lower:
+                            kap_sheet = candidate
+                            break
+                    if kap_sheet is None:
+                        kap_sheet = kap_sheets[0]
+
+                    # Header satırını otomatik bul: StoreName, Store Capacity, Fiili Doluluk gibi keyword'ler
+                    # (sayfa tek geçişte okunur, header ilk 15 satırdan bulunur)
+                    KAP_KEYWORDS = [
+                        'storename', 'store capacity', 'fiili doluluk', 'store cover',
+                        'eop ty store stock', 'avg store stock', 'sales unit',
+                        'store stock unit', 'karlı', 'karli', 'capacity dm3',
+                    ]
+                    self.kapasite = kap_xl.oku(kap_sheet, anahtarlar=KAP_KEYWORDS, tarama=15)
 
                 # Kolon temizliği
                 self.kapasite.columns = [str(c).strip() if pd.notna(c) else f'col_{i}' for i, c in enumerate(self.kapasite.columns)]
@@ -267,77 +1391,29 @@ class KupVeri:
                 self.kapasite = self.kapasite.dropna(how='all')
 
                 print(f"   ✅ Kapasite yüklendi ({kap_sheet}): {len(self.kapasite)} satır, {len(self.kapasite.columns)} kolon")
-                print(f"   📋 Kolonlar: {list(self.kapasite.columns)[:10]}...")
-            except Exception as e:
-                print(f"   ⚠️ Kapasite okunamadı: {e}")
-        else:
-            print(f"   ⚠️ Kapasite dosyası bulunamadı")
-        
-        # =====================================================================
-        # 7. SİPARİŞ TAKİP (Excel) - Satınalma ve sipariş durumu
-        # =====================================================================
-        siparis_files = []
-
-        print(f"\n   🔍 SİPARİŞ DOSYASI ARANIYOR...")
-        all_xlsx = [f for f in os.listdir(self.veri_klasoru) if f.endswith('.xlsx') or f.endswith('.xls')]
-        print(f"   📄 Klasördeki Excel dosyaları ({len(all_xlsx)} adet):")
-
-        # Türkçe karakter normalize fonksiyonu
-        def normalize_turkish(text):
-            replacements = {
-                'ş': 's', 'Ş': 's', 'ı': 'i', 'İ': 'i',
-                'ğ': 'g', 'Ğ': 'g', 'ü': 'u', 'Ü': 'u',
-                'ö': 'o', 'Ö': 'o', 'ç': 'c', 'Ç': 'c'
-            }
-            for tr, en in replacements.items():
-                text = text.replace(tr, en)
-            return text.lower()
-
-        for f in all_xlsx:
-            print(f"      - {f}")
-            f_lower = f.lower()
-            f_normalized = normalize_turkish(f)
-
-            # GENIŞ PATTERN: siparis, takip, satin, yerle, order, purchase
-            # Hem orijinal hem normalize edilmiş versiyonda ara
-            is_siparis = (
-                'siparis' in f_lower or
-                'sipariş' in f_lower or
-                'siparis' in f_normalized or
-                'takip' in f_lower or
-                'takip' in f_normalized or
-                'satin' in f_lower or
-                'satın' in f_lower or
-                'satin' in f_normalized or
-                'yerle' in f_lower or
-                'order' in f_lower or
-                'purchase' in f_lower or
-                'po_' in f_lower or
-                'po ' in f_lower or
-                f_lower == 'siparis.xlsx' or
-                f_lower.startswith('siparis') or
-                f_normalized.startswith('siparis')
-            )
-
-            if is_siparis:
-                full_path = os.path.join(self.veri_klasoru, f)
-                siparis_files.append(full_path)
-                print(f"   ✅ Sipariş dosyası BULUNDU: {f}")
+                print(f"   📋 Kolonlar: {list(self.kapasite.columns)[:10]}...")
+            except Exception as e:
+                print(f"   ⚠️ Kapasite okunamadı: {e}")
+        else:
+            print(f"   ⚠️ Kapasite dosyası bulunamadı")
+    
+    # =====================================================================
+    # 7. SİPARİŞ TAKİP (Excel) - Satınalma ve sipariş durumu
+    # =====================================================================
+    def _yukle_siparis(self, siparis_files: List[str]):
+        print(f"\n   🔍 SİPARİŞ DOSYASI ARANIYOR...")
+        for f in siparis_files:
+            print(f"   ✅ Sipariş dosyası BULUNDU: {os.path.basename(f)}")
 
         self.siparis_takip = pd.DataFrame()
         if siparis_files:
             for sip_file in siparis_files:
                 try:
                     print(f"   📖 Sipariş okunuyor: {sip_file}")
-                    # Önce sheet isimlerini kontrol et
-                    import openpyxl
-                    wb = openpyxl.load_workbook(sip_file, read_only=True)
-                    sheet_names = wb.sheetnames
-                    print(f"   📋 Sheet'ler: {sheet_names}")
-                    wb.close()
-
-                    # İlk sheet'i oku
-                    self.siparis_takip = pd.read_excel(sip_file, sheet_name=0)
+                    # Sheet isimleri ve ilk sheet aynı açılışta okunur
+                    with ExcelOkuyucu(sip_file) as xl:
+                        print(f"   📋 Sheet'ler: {xl.sayfalar}")
+                        self.siparis_takip = xl.oku(0)
                     print(f"   ✅ Sipariş Takip yüklendi: {len(self.siparis_takip)} satır, {len(self.siparis_takip.columns)} kolon")
                     print(f"   📋 Kolonlar: {list(self.siparis_takip.columns)[:8]}")
                     break  # İlk başarılı okumada dur
@@ -348,7 +1424,8 @@ class KupVeri:
         else:
             print(f"   ⚠️ Sipariş dosyası bulunamadı - Aranan pattern'lar:")
             print(f"      siparis, sipariş, takip, satın, yerle, order, purchase, po_")
-        
+    
+    def _yukleme_ozeti(self):
         # =====================================================================
         # LOG
         # =====================================================================
@@ -366,6 +1443,77 @@ class KupVeri:
         print(f"   - Kapasite: {len(self.kapasite):,} satır")
         print(f"   - Sipariş Takip: {len(self.siparis_takip):,} satır")
     
+    def yenile(self, ilerleme: Optional[Callable[[int, str], None]] = None) -> 'KupVeri':
+        """
+        Yalnızca dosyası değişen kaynakları yeniden okuyarak güncel küpü döndür
+        
+        Bu küp değiştirilmez (oturumlar arasında paylaşılan küp salt-okunurdur):
+        değişmeyen tablolar yeni küple paylaşılır. Stok, master veya KPI
+        değiştiyse _hazirla join'leri yeniden çalışır; yalnızca Excel raporları
+        değiştiyse hazırlık adımı atlanır. Hiçbir şey değişmediyse kendisi döner.
+        """
+        # Henüz yüklenmemiş gruplar yeni küpte de tembel kalır (bu versiyonun dosyalarına sabitlenir)
+        yuklu = set(self._yuklenen_gruplar)
+        degisenler = [
+            kaynak for kaynak, _, _ in self.KAYNAKLAR
+            if self._kaynak_grubu(kaynak) in yuklu
+            and self._dosya_imzasi(self._kaynak_dosyalari(kaynak)) != self._parmak_izleri.get(kaynak)
+        ]
+        versiyon = veri_versiyonu_hesapla(self.veri_klasoru)
+        if not degisenler and versiyon == self.veri_versiyonu:
+            return self
+        
+        baslangic = time.time()
+        yeni = copy.copy(self)
+        yeni._parmak_izleri = {k: v for k, v in self._parmak_izleri.items() if self._kaynak_grubu(k) in yuklu}
+        yeni._ilerleme = ilerleme
+        yeni.veri_versiyonu = versiyon
+        yeni._tembel_durum_olustur(yuklu)
+        yeni._imzalari_sabitle([grup for grup in self.VERI_GRUPLARI if grup not in yuklu])
+        for ad, alan in vars(KupVeri).items():
+            # Yüklemesi sürmekte olan grupların yarım tablolarını taşıma
+            if isinstance(alan, _TembelVeri) and alan.grup not in yuklu:
+                yeni.__dict__.pop(ad, None)
+        if yeni._arka_plan and len(yuklu) < len(self.VERI_GRUPLARI):
+            yeni._arka_planda_yukle()
+        if not degisenler:
+            # Kaynaklara ait olmayan bir dosya değişti - tablolar aynen paylaşılır
+            return yeni
+        
+        print(f"🔄 Artımlı yenileme - değişen kaynaklar: {degisenler}")
+        
+        hazirla = bool(self.HAZIRLIK_KAYNAKLARI.intersection(degisenler))
+        if hazirla and 'stok_satis' not in degisenler and not yeni._ham_stok_geri_al():
+            # Ham kolonlar geri alınamadı (join satır çoğalttı vb.) - stok dosyaları da okunur
+            # (master'lardan sonra: akış modu yeni master'larla zenginleştirir)
+            degisenler.append('stok_satis')
+        
+        for i, kaynak in enumerate(degisenler):
+            yeni._ilerleme_bildir(5 + 80 * i // len(degisenler), f"{kaynak} yeniden okunuyor")
+            yeni._kaynak_oku(kaynak)
+        
+        if hazirla:
+            yeni._ilerleme_bildir(90, "Veri zenginleştiriliyor")
+            yeni._hazirla()
+        elif 'depo_stok' in degisenler and len(yeni.stok_satis) > 0 and len(yeni.depo_stok) > 0:
+            # Depo stok join'e girmiyor - sadece kolon temizliği
+            yeni.depo_stok = kup_kopya(yeni.depo_stok)
+            yeni.depo_stok.columns = yeni.depo_stok.columns.str.replace('\ufeff', '').str.lower().str.strip()
+        
+        print(f"✅ Artımlı yenileme tamamlandı: {len(degisenler)} kaynak, {time.time() - baslangic:.1f} sn")
+        return yeni
+    
+    def _ham_stok_geri_al(self) -> bool:
+        """Hazırlanmış stok_satis'ten join öncesi ham kolonları geri al (yeniden okumadan)"""
+        kolonlar = getattr(self, '_ham_stok_kolonlari', None)
+        if not kolonlar or len(self.stok_satis) != getattr(self, '_ham_stok_satir', -1):
+            return False
+        if not set(kolonlar).issubset(self.stok_satis.columns):
+            return False
+        self.stok_satis = self.stok_satis[kolonlar]
+        self._stok_zenginlestirildi = False
+        return True
+    
     def _excel_oto_header(self, xl, sheet_name):
         """Excel sheet'inde otomatik header satırı bul ve yükle.
 
@@ -383,28 +1531,12 @@ class KupVeri:
             'ty unit sales price', 'maingroupdesc',
         ]
 
-        # Önce header=None ile oku (ilk 30 satır yeterli tarama için)
+        # Sayfa tek geçişte okunur; header ilk 30 satırdan bulunur, yoksa ilk satır
         try:
-            raw = pd.read_excel(xl, sheet_name=sheet_name, header=None, nrows=30)
+            df = xl.oku(sheet_name, anahtarlar=HEADER_KEYWORDS, tarama=30)
         except:
             return pd.DataFrame()
 
-        header_row = None
-        best_match = 0
-        for idx, row in raw.iterrows():
-            row_text = ' '.join(str(v).lower() for v in row.values if pd.notna(v))
-            matches = sum(1 for kw in HEADER_KEYWORDS if kw in row_text)
-            if matches > best_match and matches >= 2:
-                best_match = matches
-                header_row = idx
-
-        if header_row is not None:
-            print(f"      Header satırı: {header_row} ({best_match} eşleşme)")
-            df = pd.read_excel(xl, sheet_name=sheet_name, header=header_row)
-        else:
-            # Fallback: header=0 ile oku
-            df = pd.read_excel(xl, sheet_name=sheet_name, header=0)
-
         # NaN kolon isimlerini temizle
         df.columns = [str(c).strip() if pd.notna(c) else f'col_{i}' for i, c in enumerate(df.columns)]
         # Unnamed kolonları temizle
@@ -412,6 +1544,25 @@ class KupVeri:
 
         return df
 
+    def _master_joinleri(self):
+        """
+        Ürün, mağaza ve KPI master kolonlarını stok_satis'e ekle
+        
+        merge yerine tamsayı anahtarla get_indexer + take: her join için tam tablo
+        kopyası ve anahtarların string'e çevrilmesi yok, kolonlar yerinde eklenir.
+        """
+        print(f"\n🔍 JOIN ÖNCESİ KONTROL:")
+        print(f"   Stok/Satış kolonları: {list(self.stok_satis.columns)}")
+        print(f"   Ürün Master kolonları: {list(self.urun_master.columns) if len(self.urun_master) > 0 else 'BOŞ'}")
+        print(f"   Mağaza Master kolonları: {list(self.magaza_master.columns) if len(self.magaza_master) > 0 else 'BOŞ'}")
+        
+        tablolar = self._zenginlestirme_tablolari(self.stok_satis.columns)
+        self.stok_satis, eklenenler = self._master_zenginlestir(self.stok_satis, tablolar)
+        print(f"   ✅ Master join: {[anahtar for anahtar, _ in tablolar]} → eklenen kolonlar: {eklenenler}")
+        for kol in ('kategori_kod', 'bolge'):
+            if kol in eklenenler:
+                print(f"   {kol} dolu: {self.stok_satis[kol].notna().sum():,} / {len(self.stok_satis):,}")
+    
     def _hazirla(self):
         """Veriyi zenginleştir ve hesaplamalar yap"""
         
@@ -419,11 +1570,17 @@ class KupVeri:
             return
         
         # BOM karakterini temizle ve kolon isimlerini normalize et
+        # (kopya üzerinde - yenile() sonrası tablolar önceki küple paylaşılıyor olabilir)
         def temizle_kolonlar(df):
+            df = kup_kopya(df)
             df.columns = df.columns.str.replace('\ufeff', '').str.lower().str.strip()
             return df
         
         self.stok_satis = temizle_kolonlar(self.stok_satis)
+        if not getattr(self, '_stok_zenginlestirildi', False):
+            # Ham kolonlar: master/KPI değişince join'ler bu kolonlardan yeniden kurulur
+            self._ham_stok_kolonlari = list(self.stok_satis.columns)
+            self._ham_stok_satir = len(self.stok_satis)
         if len(self.urun_master) > 0:
             self.urun_master = temizle_kolonlar(self.urun_master)
         if len(self.magaza_master) > 0:
@@ -433,86 +1590,16 @@ class KupVeri:
         if len(self.kpi) > 0:
             self.kpi = temizle_kolonlar(self.kpi)
         
-        print(f"\n🔍 JOIN ÖNCESİ KONTROL:")
-        print(f"   Stok/Satış kolonları: {list(self.stok_satis.columns)}")
-        print(f"   Ürün Master kolonları: {list(self.urun_master.columns) if len(self.urun_master) > 0 else 'BOŞ'}")
-        print(f"   Mağaza Master kolonları: {list(self.magaza_master.columns) if len(self.magaza_master) > 0 else 'BOŞ'}")
+        # Master anahtarları stok_satis'teki gibi tamsayı
+        for master, anahtar in (('urun_master', 'urun_kod'), ('magaza_master', 'magaza_kod')):
+            df = getattr(self, master)
+            if len(df) > 0 and anahtar in df.columns:
+                df[anahtar] = self._anahtar_tamsayi(df[anahtar])
         
-        # Ürün master ile join
-        if len(self.urun_master) > 0 and 'urun_kod' in self.stok_satis.columns and 'urun_kod' in self.urun_master.columns:
-            # Veri tiplerini eşitle (integer olarak tut, sonra string yap)
-            self.stok_satis['urun_kod'] = pd.to_numeric(self.stok_satis['urun_kod'], errors='coerce').fillna(0).astype(int).astype(str)
-            self.urun_master['urun_kod'] = pd.to_numeric(self.urun_master['urun_kod'], errors='coerce').fillna(0).astype(int).astype(str)
-            
-            urun_kolonlar = ['urun_kod']
-            for kol in ['kategori_kod', 'umg', 'mg', 'marka_kod', 'nitelik', 'durum']:
-                if kol in self.urun_master.columns:
-                    urun_kolonlar.append(kol)
-            
-            print(f"   Ürün join kolonları: {urun_kolonlar}")
-            print(f"   Stok urun_kod örnek: {self.stok_satis['urun_kod'].head(3).tolist()}")
-            print(f"   Master urun_kod örnek: {self.urun_master['urun_kod'].head(3).tolist()}")
-            
-            if len(urun_kolonlar) > 1:
-                before_len = len(self.stok_satis)
-                self.stok_satis = self.stok_satis.merge(
-                    self.urun_master[urun_kolonlar],
-                    on='urun_kod',
-                    how='left'
-                )
-                print(f"   ✅ Ürün join: {before_len} → {len(self.stok_satis)} satır")
-                
-                # Join sonrası kontrol
-                if 'kategori_kod' in self.stok_satis.columns:
-                    non_null = self.stok_satis['kategori_kod'].notna().sum()
-                    print(f"   kategori_kod dolu: {non_null:,} / {len(self.stok_satis):,}")
-        
-        # Mağaza master ile join
-        if len(self.magaza_master) > 0 and 'magaza_kod' in self.stok_satis.columns and 'magaza_kod' in self.magaza_master.columns:
-            # Veri tiplerini eşitle
-            self.stok_satis['magaza_kod'] = pd.to_numeric(self.stok_satis['magaza_kod'], errors='coerce').fillna(0).astype(int).astype(str)
-            self.magaza_master['magaza_kod'] = pd.to_numeric(self.magaza_master['magaza_kod'], errors='coerce').fillna(0).astype(int).astype(str)
-            
-            mag_kolonlar = ['magaza_kod']
-            for kol in ['il', 'bolge', 'tip', 'depo_kod']:
-                if kol in self.magaza_master.columns:
-                    mag_kolonlar.append(kol)
-            
-            print(f"   Mağaza join kolonları: {mag_kolonlar}")
-            print(f"   Stok magaza_kod örnek: {self.stok_satis['magaza_kod'].head(3).tolist()}")
-            print(f"   Master magaza_kod örnek: {self.magaza_master['magaza_kod'].head(3).tolist()}")
-            
-            if len(mag_kolonlar) > 1:
-                before_len = len(self.stok_satis)
-                self.stok_satis = self.stok_satis.merge(
-                    self.magaza_master[mag_kolonlar],
-                    on='magaza_kod',
-                    how='left'
-                )
-                print(f"   ✅ Mağaza join: {before_len} → {len(self.stok_satis)} satır")
-                
-                # Join sonrası kontrol
-                if 'bolge' in self.stok_satis.columns:
-                    non_null = self.stok_satis['bolge'].notna().sum()
-                    print(f"   bolge dolu: {non_null:,} / {len(self.stok_satis):,}")
-        
-        # KPI ile join (mg bazlı)
-        if len(self.kpi) > 0 and 'mg' in self.stok_satis.columns:
-            kpi_df = self.kpi.copy()
-            if 'mg_id' in kpi_df.columns:
-                kpi_df = kpi_df.rename(columns={'mg_id': 'mg'})
-            
-            if 'mg' in kpi_df.columns:
-                # Veri tiplerini eşitle
-                self.stok_satis['mg'] = pd.to_numeric(self.stok_satis['mg'], errors='coerce').fillna(0).astype(int).astype(str)
-                kpi_df['mg'] = pd.to_numeric(kpi_df['mg'], errors='coerce').fillna(0).astype(int).astype(str)
-                
-                self.stok_satis = self.stok_satis.merge(
-                    kpi_df,
-                    on='mg',
-                    how='left'
-                )
-                print(f"   ✅ KPI join tamamlandı")
+        if getattr(self, '_stok_zenginlestirildi', False):
+            print(f"   ⚡ Master join'leri akış sırasında yapıldı")
+        else:
+            self._master_joinleri()
         
         # Kar hesapla (kolonlar varsa)
         if 'ciro' in self.stok_satis.columns and 'smm' in self.stok_satis.columns:
@@ -549,8 +1636,6 @@ class KupVeri:
             self.stok_satis['stok'] = 0
         
         # Stok durumu değerlendirme
-        self.stok_satis['stok_durum'] = 'NORMAL'
-        
         # min_deger ve max_deger kolonları yoksa varsayılan değer kullan
         if 'min_deger' not in self.stok_satis.columns:
             self.stok_satis['min_deger'] = 3
@@ -561,15 +1646,22 @@ class KupVeri:
         
         # Min altı = SEVKİYAT GEREKLİ
         mask_min = self.stok_satis['stok'] < self.stok_satis['min_deger'].fillna(3)
-        self.stok_satis.loc[mask_min, 'stok_durum'] = 'SEVK_GEREKLI'
         
-        # Max üstü = FAZLA STOK
+        # Max üstü = FAZLA STOK (min altını ezer)
         mask_max = self.stok_satis['stok'] > self.stok_satis['max_deger'].fillna(20)
-        self.stok_satis.loc[mask_max, 'stok_durum'] = 'FAZLA_STOK'
         
-        # Cover hedefin üstünde = YAVAS
+        # Cover hedefin üstünde = YAVAS (yalnızca diğerleri NORMAL ise)
         mask_cover = self.stok_satis['cover'] > self.stok_satis['forward_cover'].fillna(4) * 3
-        self.stok_satis.loc[mask_cover & (self.stok_satis['stok_durum'] == 'NORMAL'), 'stok_durum'] = 'YAVAS'
+        
+        # Küçük tamsayı kodlu categorical - kodlar STOK_DURUMLARI sırası
+        kodlar = np.select(
+            [mask_max.to_numpy(), mask_min.to_numpy(), mask_cover.to_numpy()],
+            [STOK_DURUMLARI.index('FAZLA_STOK'), STOK_DURUMLARI.index('SEVK_GEREKLI'), STOK_DURUMLARI.index('YAVAS')],
+            default=STOK_DURUMLARI.index('NORMAL')
+        ).astype(np.int8)
+        self.stok_satis['stok_durum'] = pd.Categorical.from_codes(kodlar, categories=STOK_DURUMLARI)
+        self._durum_tablolari = self._durum_tablolari_olustur()
+        self._toplam_kupu = ToplamKupu(self.stok_satis)
         
         # Detaylı debug bilgisi
         print(f"\n📊 VERİ DURUMU:")
@@ -584,6 +1676,265 @@ class KupVeri:
                 print(f"   ✅ {kol}: {non_null:,} dolu, örnek değerler: {list(unique_vals)}")
             else:
                 print(f"   ❌ {kol}: KOLON YOK")
+    
+    # =========================================================================
+    # STOK DURUMU SAYILARI - yükleme anında (boyut × durum) tabloları
+    # =========================================================================
+    DURUM_BOYUTLARI = ['kategori_kod', 'magaza_kod', 'urun_kod', 'bolge']
+    
+    def _durum_tablolari_olustur(self) -> dict:
+        """Her boyut için (değer × durum) satır sayıları; None anahtarı tüm veri"""
+        df = self.stok_satis
+        k = len(STOK_DURUMLARI)
+        if 'stok_durum' not in df.columns:
+            return {None: pd.Series(0, index=STOK_DURUMLARI)}
+        durum = df['stok_durum']
+        if not isinstance(durum.dtype, pd.CategoricalDtype) or list(durum.cat.categories) != STOK_DURUMLARI:
+            durum = pd.Categorical(durum, categories=STOK_DURUMLARI)
+        kodlar = np.asarray(durum.codes if isinstance(durum, pd.Categorical) else durum.cat.codes)
+        gecerli = kodlar >= 0
+        
+        tablolar = {None: pd.Series(np.bincount(kodlar[gecerli], minlength=k), index=STOK_DURUMLARI)}
+        for boyut in self.DURUM_BOYUTLARI:
+            if boyut not in df.columns:
+                continue
+            boyut_kod, degerler = pd.factorize(df[boyut])
+            sec = gecerli & (boyut_kod >= 0)
+            sayilar = np.bincount(boyut_kod[sec] * k + kodlar[sec], minlength=len(degerler) * k)
+            # Araçlar boyutu astype(str) == str(deger) ile filtreliyor - index de string
+            tablo = pd.DataFrame(sayilar.reshape(-1, k), index=pd.Index(degerler.astype(str)), columns=STOK_DURUMLARI)
+            if not tablo.index.is_unique:
+                tablo = tablo.groupby(level=0).sum()
+            tablolar[boyut] = tablo
+        return tablolar
+    
+    def durum_sayilari(self, boyut: str = None, deger=None):
+        """
+        Stok durumu satır sayıları - filtreleme yapmadan tablodan okunur
+        
+        durum_sayilari()                        → tüm veri (Series, durum → satır)
+        durum_sayilari('magaza_kod', '1042')    → o mağazanın dağılımı (Series)
+        durum_sayilari('bolge')                 → boyutun tüm tablosu (DataFrame)
+        """
+        tablolar = getattr(self, '_durum_tablolari', None)
+        if tablolar is None:
+            # Paylaşımlı depodan bağlanan küpte _hazirla çalışmaz - ilk kullanımda hesaplanır
+            tablolar = self._durum_tablolari = self._durum_tablolari_olustur()
+        if boyut is None:
+            return tablolar[None]
+        tablo = tablolar[boyut]
+        if deger is None:
+            return tablo
+        deger = str(deger)
+        if deger in tablo.index:
+            return tablo.loc[deger]
+        return pd.Series(0, index=STOK_DURUMLARI, name=deger)
+    
+    def toplamlar(self) -> ToplamKupu:
+        """Önceden hesaplanmış toplam küpü (özet araçlar satır taramadan buradan toplar)"""
+        toplam_kupu = getattr(self, '_toplam_kupu', None)
+        if toplam_kupu is None:
+            # Paylaşımlı depodan bağlanan küpte _hazirla çalışmaz - ilk kullanımda hesaplanır
+            toplam_kupu = self._toplam_kupu = ToplamKupu(self.stok_satis)
+        return toplam_kupu
+    
+    def depo_gorunumu(self) -> DepoStoku:
+        """depo_stok'un tipli, tekil görünümü (depo_stok tablosu değişene kadar önbellekte)"""
+        depo = self.depo_stok
+        onbellek = getattr(self, '_depo_gorunumu', None)
+        if onbellek is None or onbellek[0] is not depo:
+            onbellek = self._depo_gorunumu = (depo, DepoStoku(depo))
+        return onbellek[1]
+    
+    def cover_gorunumu(self) -> CoverDiyagrami:
+        """cover_diagram'ın ayrıştırılmış görünümü + toplamları (tablo değişene kadar önbellekte)"""
+        cover = self.cover_diagram
+        onbellek = getattr(self, '_cover_gorunumu', None)
+        if onbellek is None or onbellek[0] is not cover:
+            onbellek = self._cover_gorunumu = (cover, CoverDiyagrami(cover))
+        return onbellek[1]
+    
+    def ihtiyac_tablosu(self) -> pd.DataFrame:
+        """
+        Ürün bazında sevk ihtiyacı tablosu (veri versiyonu başına bir kez hesaplanır)
+
+        SEVK_GEREKLI satırlarının toplam küpünün ürün seviyesinden tek gruplamayla:
+            urun_kod (str), magaza_sayisi, toplam_stok, toplam_satis, min_deger,
+            eksik = magaza_sayisi × min_deger (yoksa 3) - toplam_stok,
+            ihtiyac = max(eksik, 0), depo_stok, karsilama (TAM / KISMİ / YOK)
+        ihtiyac_hesapla ve sevkiyat_plani bu tablonun dilimleridir. Satırlar
+        urun_kod sırasında; sevk gereken ürün yoksa boş tablo.
+        """
+        onbellek = getattr(self, '_ihtiyac_tablosu', None)
+        if onbellek is not None and onbellek[0] == self.veri_versiyonu:
+            return onbellek[1]
+
+        toplamlar = self.toplamlar()
+        urun = toplamlar.topla(['urun_kod'], durumlar=['SEVK_GEREKLI'])
+        tablo = pd.DataFrame({
+            'urun_kod': urun.index.astype(str),
+            'magaza_sayisi': urun['satir'].to_numpy(),
+            'toplam_stok': urun['stok'].to_numpy() if 'stok' in urun.columns else 0,
+        })
+        if 'satis' in urun.columns:
+            tablo['toplam_satis'] = urun['satis'].to_numpy()
+        if 'min_deger' in urun.columns:
+            tablo['min_deger'] = urun['min_deger'].to_numpy()
+            tablo['eksik'] = tablo['magaza_sayisi'] * tablo['min_deger'].fillna(3) - tablo['toplam_stok']
+        else:
+            tablo['eksik'] = 0
+        tablo['ihtiyac'] = tablo['eksik'].clip(lower=0)
+
+        tablo['depo_stok'] = self.depo_gorunumu().urun_stok(urun.index)
+        tablo['karsilama'] = np.where(
+            tablo['depo_stok'] >= tablo['ihtiyac'], 'TAM',
+            np.where(tablo['depo_stok'] > 0, 'KISMİ', 'YOK')
+        )
+        self._ihtiyac_tablosu = (self.veri_versiyonu, tablo)
+        return tablo
+
+
+# =============================================================================
+# YAPILANDIRILMIŞ ARAÇ ÇIKTISI + TOKEN BÜTÇESİ
+# =============================================================================
+
+# Bölüm öncelikleri - sıkıştırmada büyük sayı önce atılır
+ONCELIK_KRITIK = 0   # Asla atılmaz (özet metrikler, ana değerlendirme)
+ONCELIK_YUKSEK = 1   # Ana tablolar
+ONCELIK_NORMAL = 2   # Yardımcı analizler (SWOT, top-N detay)
+ONCELIK_DUSUK = 3    # İpuçları, filtre listeleri
+
+# Tek bir tool_result için token bütçesi (eski 8000 karakter sınırına denk)
+ARAC_TOKEN_BUTCESI = 2500
+
+
+def token_tahmini(metin: str) -> int:
+    """Kaba token tahmini - Türkçe + emoji ağırlıklı metinde ~3 karakter/token"""
+    return len(metin) // 3 + 1
+
+
+class AracCiktisi:
+    """
+    Öncelikli bölümlerden oluşan araç çıktısı
+    
+    Araçlar satırları tek listeye yazmak yerine bölüm bölüm yazar:
+        sonuc = cikti.bolum(ONCELIK_KRITIK)
+        sonuc.append("...")
+    Tablolar satır/kolon olarak tutulur ve boşluk dolgusu yerine pipe (|)
+    ayraçla kompakt kodlanır. str() tam metni, sikistir() bütçeye
+    sığdırılmış metni döndürür.
+    """
+    
+    def __init__(self):
+        self.bolumler = []
+    
+    def bolum(self, oncelik: int = ONCELIK_NORMAL) -> list:
+        """Yeni metin bölümü aç, satırların ekleneceği listeyi döndür"""
+        satirlar = []
+        self.bolumler.append({'oncelik': oncelik, 'satirlar': satirlar, 'tablo': None})
+        return satirlar
+    
+    def tablo(self, kolonlar: list, satirlar: list, oncelik: int = ONCELIK_YUKSEK,
+              baslik: list = None, min_satir: int = 5):
+        """
+        Tablo bölümü ekle
+        
+        kolonlar: Kolon başlıkları
+        satirlar: Hücre listeleri (önceden formatlanmış değerler)
+        min_satir: Sıkıştırmada tablonun kısaltılabileceği en az satır sayısı
+        """
+        self.bolumler.append({
+            'oncelik': oncelik,
+            'satirlar': list(baslik or []),
+            'tablo': {'kolonlar': kolonlar, 'satirlar': satirlar, 'min_satir': min_satir}
+        })
+    
+    @staticmethod
+    def _bolum_metni(bolum: dict, satir_limiti: int = None) -> str:
+        satirlar = list(bolum['satirlar'])
+        tablo = bolum['tablo']
+        if tablo:
+            satirlar.append("|".join(str(k) for k in tablo['kolonlar']))
+            govde = tablo['satirlar']
+            if satir_limiti is not None and len(govde) > satir_limiti:
+                kalan = len(govde) - satir_limiti
+                govde = govde[:satir_limiti]
+                satirlar.extend("|".join(str(h) for h in s) for s in govde)
+                satirlar.append(f"... (+{kalan} satır)")
+            else:
+                satirlar.extend("|".join(str(h) for h in s) for s in govde)
+        return "\n".join(satirlar)
+    
+    def __str__(self) -> str:
+        return "\n".join(self._bolum_metni(b) for b in self.bolumler)
+    
+    def sikistir(self, token_butcesi: int = ARAC_TOKEN_BUTCESI) -> str:
+        """
+        Çıktıyı token bütçesine sığdır
+        
+        Sıra: düşük öncelikten başlayarak önce o önceliğin tablolarını
+        min_satir'a indir, yetmezse o önceliğin bölümlerini sondan başa at.
+        KRİTİK bölümler hiç atılmaz; yine de sığmazsa satır sınırında kesilir.
+        """
+        aktif = list(range(len(self.bolumler)))
+        limitler = {}
+        
+        def metin():
+            return "\n".join(self._bolum_metni(self.bolumler[i], limitler.get(i)) for i in aktif)
+        
+        sonuc = metin()
+        if token_tahmini(sonuc) <= token_butcesi:
+            return sonuc
+        
+        atilan = 0
+        for oncelik in (ONCELIK_DUSUK, ONCELIK_NORMAL, ONCELIK_YUKSEK, ONCELIK_KRITIK):
+            # 1) Bu önceliğin tablolarını kısalt
+            for i in aktif:
+                b = self.bolumler[i]
+                if b['oncelik'] == oncelik and b['tablo']:
+                    limitler[i] = b['tablo']['min_satir']
+            sonuc = metin()
+            if token_tahmini(sonuc) <= token_butcesi:
+                break
+            if oncelik == ONCELIK_KRITIK:
+                break
+            # 2) Bu önceliğin bölümlerini sondan başa at
+            for i in reversed([i for i in aktif if self.bolumler[i]['oncelik'] == oncelik]):
+                aktif.remove(i)
+                atilan += 1
+                sonuc = metin()
+                if token_tahmini(sonuc) <= token_butcesi:
+                    break
+            if token_tahmini(sonuc) <= token_butcesi:
+                break
+        
+        if token_tahmini(sonuc) > token_butcesi:
+            sonuc = _satir_sinirinda_kes(sonuc, token_butcesi)
+        if atilan:
+            sonuc += f"\n\nℹ️ Bütçe nedeniyle {atilan} düşük öncelikli bölüm çıkarıldı (detay için filtreli çağır)"
+        return sonuc
+
+
+def _satir_sinirinda_kes(metin: str, token_butcesi: int) -> str:
+    """Metni satır ortasından bölmeden bütçeye göre kes"""
+    limit = token_butcesi * 3
+    if len(metin) <= limit:
+        return metin
+    kesik = metin[:limit]
+    son_satir = kesik.rfind("\n")
+    if son_satir > 0:
+        kesik = kesik[:son_satir]
+    return kesik + "\n... (kısaltıldı)"
+
+
+def arac_sonucu_sikistir(sonuc, token_butcesi: int = ARAC_TOKEN_BUTCESI) -> str:
+    """Araç sonucunu (AracCiktisi veya düz metin) modele gönderilecek metne çevir"""
+    if isinstance(sonuc, AracCiktisi):
+        return sonuc.sikistir(token_butcesi)
+    sonuc = str(sonuc)
+    if token_tahmini(sonuc) <= token_butcesi:
+        return sonuc
+    return _satir_sinirinda_kes(sonuc, token_butcesi)
 
 
 # =============================================================================
@@ -598,7 +1949,7 @@ CEO Talepleri:
 3. Sezon dışı grupları gösterme (Plaj Havlusu, Ev Giysisi vb.)
 """
 
-def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) -> str:
+def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) -> Union[str, AracCiktisi]:
     """
     Trading raporu analizi - 3 Seviyeli Hiyerarşi
     
@@ -616,6 +1967,8 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
     - trading_analiz() → Şirket özeti + Ana Gruplar
     - trading_analiz(ana_grup="RENKLİ KOZMETİK") → Ara Grup detayı
     - trading_analiz(ana_grup="RENKLİ KOZMETİK", ara_grup="GÖZ ÜRÜNLERİ") → Alt Grup detayı
+    
+    Dönüş: Öncelikli bölümlerden oluşan AracCiktisi (hata durumunda str)
     """
     
     if len(kup.trading) == 0:
@@ -630,8 +1983,8 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         'BEACH', 'TOWEL', 'HOME WEAR'
     ]
     
-    sonuc = []
-    df = kup.trading.copy()
+    cikti = AracCiktisi()
+    df = kup_kopya(kup.trading)
     
     # Kolon isimlerini normalize et
     df.columns = [str(c).strip() for c in df.columns]
@@ -1006,6 +2359,7 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         # ===================================================================
         # 1. GRAND TOTAL - ŞİRKET TOPLAMI
         # ===================================================================
+        sonuc = cikti.bolum(ONCELIK_KRITIK)
         sonuc.append("=" * 60)
         sonuc.append("📊 GRAND TOTAL - ŞİRKET TOPLAMI")
         sonuc.append("=" * 60 + "\n")
@@ -1059,27 +2413,26 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         # ===================================================================
         # 2. ANA GRUPLAR TABLOSU
         # ===================================================================
-        sonuc.append("\n" + "=" * 60)
-        sonuc.append("🏆 ANA GRUPLAR PERFORMANSI")
+        baslik = ["\n" + "=" * 60, "🏆 ANA GRUPLAR PERFORMANSI"]
         if filtrelenen_gruplar:
-            sonuc.append(f"(🚫 {len(filtrelenen_gruplar)} grup filtrelendi: LFL<%5, Sezon disi vb.)")
-        sonuc.append("=" * 60 + "\n")
-
-        sonuc.append(f"{'Ana Grup':<22} {'Bütçe%':>7} {'LFL Stok':>9} {'LFL Adet':>9} {'LFL Ciro':>9} {'Cover':>6}")
-        sonuc.append("-" * 75)
-
-        for ag in ana_gruplar:
-            ad = ag['ad'][:21]
-            butce_str = f"{ag['ciro_achieved']:+.0f}%"
-            lfl_stok_str = f"{ag['lfl_stok']:+.0f}%"
-            lfl_adet_str = f"{ag['lfl_adet']:+.0f}%"
-            lfl_ciro_str = f"{ag['lfl_ciro']:+.0f}%" if ag['lfl_ciro'] != 0 else "-"
-            cover_str = f"{ag['ty_cover']:.1f}"
-            sonuc.append(f"{ad:<22} {butce_str:>7} {lfl_stok_str:>9} {lfl_adet_str:>9} {lfl_ciro_str:>9} {cover_str:>6}")
+            baslik.append(f"(🚫 {len(filtrelenen_gruplar)} grup filtrelendi: LFL<%5, Sezon disi vb.)")
+        baslik.append("=" * 60)
+
+        cikti.tablo(
+            ['Ana Grup', 'Bütçe%', 'LFL Stok%', 'LFL Adet%', 'LFL Ciro%', 'Cover'],
+            [[ag['ad'][:21],
+              f"{ag['ciro_achieved']:+.0f}",
+              f"{ag['lfl_stok']:+.0f}",
+              f"{ag['lfl_adet']:+.0f}",
+              f"{ag['lfl_ciro']:+.0f}" if ag['lfl_ciro'] != 0 else "-",
+              f"{ag['ty_cover']:.1f}"] for ag in ana_gruplar],
+            oncelik=ONCELIK_YUKSEK, baslik=baslik, min_satir=8
+        )
 
         # ===================================================================
         # 3. DETAYLI ANA GRUP DEĞERLENDİRMESİ
         # ===================================================================
+        sonuc = cikti.bolum(ONCELIK_KRITIK)
         sonuc.append("\n" + "=" * 60)
         sonuc.append("📊 DETAYLI ANA GRUP DEĞERLENDİRMESİ")
         sonuc.append("=" * 60)
@@ -1136,6 +2489,7 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         # ===================================================================
         # SWOT ANALİZİ
         # ===================================================================
+        sonuc = cikti.bolum(ONCELIK_NORMAL)
         sonuc.append("\n" + "=" * 60)
         sonuc.append("📋 SWOT ANALİZİ")
         sonuc.append("=" * 60)
@@ -1239,6 +2593,7 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         # ===================================================================
         if len(ana_gruplar) >= 1:
             top3 = ana_gruplar[:3]  # Zaten ciro_pay'e gore sirali
+            sonuc = cikti.bolum(ONCELIK_NORMAL)
             sonuc.append("\n" + "=" * 60)
             sonuc.append("🔍 EN YUKSEK CİROLU 3 ANA GRUP DETAYI")
             sonuc.append("=" * 60)
@@ -1298,6 +2653,7 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
                         sonuc.append(f"         Haftalik Ciro: %{sg['haftalik_ciro']:+.1f}")
         
         # Filtrelenen grupları göster (delist hariç - bahsetme!)
+        sonuc = cikti.bolum(ONCELIK_DUSUK)
         if filtrelenen_gruplar:
             gosterilecek = [(g, s) for g, s in filtrelenen_gruplar if 'delist' not in g.lower() and 'delist' not in s.lower()]
             if gosterilecek:
@@ -1352,43 +2708,40 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
             if ara_gruplar:
                 ara_gruplar.sort(key=lambda x: x['ciro_pay'], reverse=True)
                 
-                sonuc.append("=" * 60)
-                sonuc.append(f"📊 {ana_grup_upper} - ALT GRUP DETAYI")
+                baslik = ["=" * 60, f"📊 {ana_grup_upper} - ALT GRUP DETAYI"]
                 if filtrelenen_gruplar:
-                    sonuc.append(f"(🚫 {len(filtrelenen_gruplar)} alt grup filtrelendi)")
-                sonuc.append("=" * 60 + "\n")
-                
-                sonuc.append(f"{'Alt Grup':<28} {'Ciro%':>6} {'Adet%':>6} {'Stok%':>6} {'Kar%':>6} {'Cover':>6} {'LFL':>7}")
-                sonuc.append("-" * 75)
+                    baslik.append(f"(🚫 {len(filtrelenen_gruplar)} alt grup filtrelendi)")
+                baslik.append("=" * 60)
                 
-                for ag in ara_gruplar[:15]:
-                    ad = ag['ad'][:27]
-                    cover_str = f"{ag['ty_cover']:.1f}"
-                    lfl_str = f"{ag['lfl_ciro']:+.0f}%"
-                    sonuc.append(f"{ad:<28} {ag['ciro_pay']:>5.1f}% {ag['adet_pay']:>5.1f}% {ag['stok_pay']:>5.1f}% {ag['kar_pay']:>5.1f}% {cover_str:>6} {lfl_str:>7}")
+                cikti.tablo(
+                    ['Alt Grup', 'Ciro%', 'Adet%', 'Stok%', 'Kar%', 'Cover', 'LFL%'],
+                    [[ag['ad'][:27], f"{ag['ciro_pay']:.1f}", f"{ag['adet_pay']:.1f}", f"{ag['stok_pay']:.1f}",
+                      f"{ag['kar_pay']:.1f}", f"{ag['ty_cover']:.1f}", f"{ag['lfl_ciro']:+.0f}"]
+                     for ag in ara_gruplar[:15]],
+                    oncelik=ONCELIK_KRITIK, baslik=baslik
+                )
                 
-                return "\n".join(sonuc)
+                return cikti
             
             return f"❌ '{ana_grup}' ana grubu bulunamadı."
         
         ara_gruplar.sort(key=lambda x: x['ciro_pay'], reverse=True)
         
-        sonuc.append("=" * 60)
-        sonuc.append(f"📊 {ana_grup_upper} - ARA GRUP DETAYI")
+        baslik = ["=" * 60, f"📊 {ana_grup_upper} - ARA GRUP DETAYI"]
         if filtrelenen_gruplar:
-            sonuc.append(f"(🚫 {len(filtrelenen_gruplar)} ara grup filtrelendi)")
-        sonuc.append("=" * 60 + "\n")
-        
-        sonuc.append(f"{'Ara Grup':<28} {'Ciro%':>6} {'Adet%':>6} {'Stok%':>6} {'Kar%':>6} {'Cover':>6} {'LFL':>7}")
-        sonuc.append("-" * 75)
-        
-        for ag in ara_gruplar:
-            ad = ag['ad'][:27]
-            cover_str = f"{ag['ty_cover']:.1f}"
-            lfl_str = f"{ag['lfl_ciro']:+.0f}%"
-            sonuc.append(f"{ad:<28} {ag['ciro_pay']:>5.1f}% {ag['adet_pay']:>5.1f}% {ag['stok_pay']:>5.1f}% {ag['kar_pay']:>5.1f}% {cover_str:>6} {lfl_str:>7}")
+            baslik.append(f"(🚫 {len(filtrelenen_gruplar)} ara grup filtrelendi)")
+        baslik.append("=" * 60)
+        
+        cikti.tablo(
+            ['Ara Grup', 'Ciro%', 'Adet%', 'Stok%', 'Kar%', 'Cover', 'LFL%'],
+            [[ag['ad'][:27], f"{ag['ciro_pay']:.1f}", f"{ag['adet_pay']:.1f}", f"{ag['stok_pay']:.1f}",
+              f"{ag['kar_pay']:.1f}", f"{ag['ty_cover']:.1f}", f"{ag['lfl_ciro']:+.0f}"]
+             for ag in ara_gruplar],
+            oncelik=ONCELIK_YUKSEK, baslik=baslik, min_satir=10
+        )
         
         # Stok/Ciro dengesizliği
+        sonuc = cikti.bolum(ONCELIK_KRITIK)
         sonuc.append("\n" + "-" * 60)
         for ag in ara_gruplar:
             if ag['ciro_pay'] > 0:
@@ -1398,6 +2751,7 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
                 elif oran < 0.7:
                     sonuc.append(f"⚠️ {ag['ad']}: Stok az (stok/ciro: {oran:.1f}x) → SEVKİYAT")
         
+        sonuc = cikti.bolum(ONCELIK_DUSUK)
         sonuc.append(f"\n💡 Detay için: trading_analiz(ana_grup='{ana_grup}', ara_grup='ARA_GRUP_ADI')")
         
     else:
@@ -1426,30 +2780,28 @@ def trading_analiz(kup: KupVeri, ana_grup: str = None, ara_grup: str = None) ->
         
         alt_gruplar.sort(key=lambda x: x['ciro_pay'], reverse=True)
         
-        sonuc.append("=" * 60)
-        sonuc.append(f"📊 {ana_grup_upper} > {ara_grup_upper} - MAL GRUBU DETAYI")
+        baslik = ["=" * 60, f"📊 {ana_grup_upper} > {ara_grup_upper} - MAL GRUBU DETAYI"]
         if filtrelenen_gruplar:
-            sonuc.append(f"(🚫 {len(filtrelenen_gruplar)} mal grubu filtrelendi)")
-        sonuc.append("=" * 60 + "\n")
-        
-        sonuc.append(f"{'Mal Grubu':<24} {'Ciro%':>6} {'Adet%':>6} {'Stok%':>6} {'Cover':>6} {'LFL':>7} {'Bütçe':>7}")
-        sonuc.append("-" * 75)
-        
-        for ag in alt_gruplar:
-            ad = ag['ad'][:23]
-            cover_str = f"{ag['ty_cover']:.1f}"
-            lfl_str = f"{ag['lfl_ciro']:+.0f}%"
-            butce_str = f"{ag['ciro_achieved']:+.0f}%"
-            sonuc.append(f"{ad:<24} {ag['ciro_pay']:>5.1f}% {ag['adet_pay']:>5.1f}% {ag['stok_pay']:>5.1f}% {cover_str:>6} {lfl_str:>7} {butce_str:>7}")
+            baslik.append(f"(🚫 {len(filtrelenen_gruplar)} mal grubu filtrelendi)")
+        baslik.append("=" * 60)
+        
+        cikti.tablo(
+            ['Mal Grubu', 'Ciro%', 'Adet%', 'Stok%', 'Cover', 'LFL%', 'Bütçe%'],
+            [[ag['ad'][:23], f"{ag['ciro_pay']:.1f}", f"{ag['adet_pay']:.1f}", f"{ag['stok_pay']:.1f}",
+              f"{ag['ty_cover']:.1f}", f"{ag['lfl_ciro']:+.0f}", f"{ag['ciro_achieved']:+.0f}"]
+             for ag in alt_gruplar],
+            oncelik=ONCELIK_YUKSEK, baslik=baslik, min_satir=10
+        )
         
         # En iyi ve en kötü performans
+        sonuc = cikti.bolum(ONCELIK_KRITIK)
         sonuc.append("\n" + "-" * 60)
         en_iyi = max(alt_gruplar, key=lambda x: x['lfl_ciro'])
         en_kotu = min(alt_gruplar, key=lambda x: x['lfl_ciro'])
         sonuc.append(f"✅ En iyi: {en_iyi['ad']} (LFL: %{en_iyi['lfl_ciro']:+.0f})")
         sonuc.append(f"🔴 En kötü: {en_kotu['ad']} (LFL: %{en_kotu['lfl_ciro']:+.0f})")
     
-    return "\n".join(sonuc)
+    return cikti
     
 def cover_analiz(kup: KupVeri, sayfa: str = None) -> str:
     """SC Tablosu cover grup analizi"""
@@ -1508,7 +2860,7 @@ def cover_analiz(kup: KupVeri, sayfa: str = None) -> str:
     return "\n".join(sonuc)
 
 
-def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None) -> str:
+def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None) -> Union[str, AracCiktisi]:
     """
     Cover Diagram analizi - Mağaza×AltGrup cover analizi
     
@@ -1520,83 +2872,49 @@ def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None)
     if len(kup.cover_diagram) == 0:
         return "❌ Cover Diagram yüklenmemiş."
     
-    df = kup.cover_diagram.copy()
-    kolonlar = list(df.columns)
+    # Ayrıştırılmış tablo + filtresiz toplamlar küp başına bir kez hesaplanır
+    cd = kup.cover_gorunumu()
+    col_alt_grup = cd.kolonlar['alt_grup']
+    col_magaza = cd.kolonlar['magaza']
+    col_ty_cover = cd.kolonlar['ty_cover']
+    col_ly_cover = cd.kolonlar['ly_cover']
+    col_lfl_satis = cd.kolonlar['lfl_satis']
     
-    sonuc = []
+    cikti = AracCiktisi()
+    sonuc = cikti.bolum(ONCELIK_KRITIK)
     sonuc.append("=" * 60)
     sonuc.append("📊 COVER DİAGRAM ANALİZİ")
     sonuc.append("=" * 60 + "\n")
-    
-    # Kolon mapping
-    def find_col(keywords):
-        for kol in kolonlar:
-            kol_lower = str(kol).lower()
-            if all(k in kol_lower for k in keywords):
-                return kol
-        return None
-    
-    col_alt_grup = find_col(['alt', 'grup']) or find_col(['grup'])
-    col_magaza = find_col(['store']) or find_col(['mağaza'])
-
-    # TY ve LY Cover kolonları (Excel'den direkt okunacak, hesaplama YOK)
-    col_ty_cover = find_col(['ty', 'store', 'back', 'cover']) or find_col(['ty', 'back', 'cover']) or find_col(['ty', 'cover'])
-    col_ly_cover = find_col(['ly', 'store', 'back', 'cover']) or find_col(['ly', 'back', 'cover']) or find_col(['ly', 'cover'])
-    col_cover = col_ty_cover  # Ana cover olarak TY kullan
-
-    # Stok kolonları - daha esnek arama
-    col_stok = find_col(['stock', 'unit']) or find_col(['stok', 'adet']) or find_col(['avg', 'stock']) or find_col(['stok'])
 
-    # Satış kolonları
-    col_satis_adet = find_col(['sales', 'unit']) or find_col(['satış', 'adet']) or find_col(['satis', 'adet'])
-    col_satis_tutar = find_col(['sales', 'value']) or find_col(['satış', 'tutar']) or find_col(['sales', 'try'])
-
-    col_siparis = find_col(['sipariş']) or find_col(['toplam', 'sip'])
-    col_lfl_stok = find_col(['lfl', 'stok']) or find_col(['stok', 'değişim'])
-    col_lfl_satis = find_col(['lfl', 'satış']) or find_col(['satış', 'değişim']) or find_col(['lfl', 'sales'])
-    col_magaza_sayisi = find_col(['mağaza', 'sayı']) or find_col(['store', 'count']) or find_col(['mağaza sayısı'])
-
-    print(f"Cover Diagram TÜM kolonlar: {kolonlar}")
-    print(f"Bulunan: ty_cover={col_ty_cover}, ly_cover={col_ly_cover}, stok={col_stok}, satis_adet={col_satis_adet}, satis_tutar={col_satis_tutar}, magaza_sayisi={col_magaza_sayisi}")
+    print(f"Cover Diagram TÜM kolonlar: {cd.kaynak_kolonlar}")
+    print(f"Bulunan: ty_cover={col_ty_cover}, ly_cover={col_ly_cover}, stok={cd.kolonlar['stok']}, satis_adet={cd.kolonlar['satis_adet']}, satis_tutar={cd.kolonlar['satis_tutar']}, magaza_sayisi={cd.kolonlar['magaza_sayisi']}")
     
-    # Filtrele
+    # Filtrele (büyük harfli tekil ad index'i üzerinden)
+    maske = cd.filtre_maskesi(alt_grup, magaza)
+    df = cd.tablo if maske is None else cd.tablo[maske]
     if alt_grup:
-        df = df[df[col_alt_grup].astype(str).str.upper().str.contains(alt_grup.upper())]
         sonuc.append(f"📁 Alt Grup Filtresi: {alt_grup}\n")
-    
     if magaza:
-        df = df[df[col_magaza].astype(str).str.upper().str.contains(magaza.upper())]
         sonuc.append(f"🏪 Mağaza Filtresi: {magaza}\n")
     
     if len(df) == 0:
         return "❌ Filtreye uygun veri bulunamadı."
     
-    # Parse fonksiyonu
-    def parse_val(val):
-        if pd.isna(val):
-            return 0
-        try:
-            return float(str(val).replace('%', '').replace(',', '.').strip())
-        except:
-            return 0
-    
     # ÖZET ANALİZ
     sonuc.append(f"📊 GENEL ÖZET ({len(df)} satır)")
     sonuc.append("-" * 50)
 
     # TY Cover (Bu Yıl) - Excel'den direkt okunuyor
     if col_ty_cover:
-        df['_cover'] = df[col_ty_cover].apply(parse_val)
         avg_ty_cover = df['_cover'].mean()
-        cover_yuksek = len(df[df['_cover'] > 12])
-        cover_dusuk = len(df[df['_cover'] < 4])
+        cover_yuksek = int((df['_cover'] > 12).sum())
+        cover_dusuk = int((df['_cover'] < 4).sum())
         sonuc.append(f"   TY Cover Ortalama: {avg_ty_cover:.1f} hafta")
         sonuc.append(f"   🔴 Cover > 12 hafta: {cover_yuksek} satır")
         sonuc.append(f"   ⚠️ Cover < 4 hafta: {cover_dusuk} satır")
 
     # LY Cover (Geçen Yıl) - karşılaştırma için
     if col_ly_cover:
-        df['_ly_cover'] = df[col_ly_cover].apply(parse_val)
         avg_ly_cover = df['_ly_cover'].mean()
         if col_ty_cover:
             cover_degisim = avg_ty_cover - avg_ly_cover
@@ -1608,30 +2926,14 @@ def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None)
                 sonuc.append(f"   LY Cover: {avg_ly_cover:.1f} hf (stabil)")
     
     if col_lfl_satis:
-        df['_lfl_satis'] = df[col_lfl_satis].apply(parse_val)
         avg_lfl = df['_lfl_satis'].mean()
-        lfl_neg = len(df[df['_lfl_satis'] < -20])
+        lfl_neg = int((df['_lfl_satis'] < -20).sum())
         sonuc.append(f"   LFL Satış Ort: %{avg_lfl:+.1f}")
         sonuc.append(f"   🔴 LFL < -%20: {lfl_neg} satır")
-    
-    # Satış ve stok kolonlarını parse et
-    if col_stok:
-        df['_avg_stok'] = df[col_stok].apply(parse_val)
-    if col_satis_adet:
-        df['_satis_adet'] = df[col_satis_adet].apply(parse_val)
-    if col_satis_tutar:
-        df['_satis_tutar'] = df[col_satis_tutar].apply(parse_val)
-    if col_magaza_sayisi:
-        df['_magaza_sayisi'] = df[col_magaza_sayisi].apply(parse_val)
-
-    # Toplam stok = Ortalama stok × Mağaza sayısı (eğer avg stok kolonuysa)
-    if '_avg_stok' in df.columns:
-        if '_magaza_sayisi' in df.columns:
-            df['_stok'] = df['_avg_stok'] * df['_magaza_sayisi']
-            print(f"Toplam stok hesaplandı: avg_stok * magaza_sayisi")
-        else:
-            df['_stok'] = df['_avg_stok']
-            print(f"Stok direkt kullanıldı (mağaza sayısı yok)")
+
+    # Alt grup toplamları: mağaza filtresi yoksa önbellekteki filtresiz toplam
+    if col_alt_grup and not alt_grup:
+        alt_grup_ozet = cd.alt_grup_ozet if not magaza else CoverDiyagrami.alt_grup_topla(df)
 
     # =========================================
     # KRİTİK ALT GRUPLAR (Cover > 30 hafta)
@@ -1640,34 +2942,22 @@ def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None)
         # Önce toplam ciroyu hesapla
         toplam_ciro = df['_satis_tutar'].sum() if '_satis_tutar' in df.columns else 1
 
-        # Alt grup bazında grupla
-        agg_dict = {'_cover': 'mean'}
-        if '_stok' in df.columns:
-            agg_dict['_stok'] = 'sum'
-        if '_satis_adet' in df.columns:
-            agg_dict['_satis_adet'] = 'sum'
-        if '_satis_tutar' in df.columns:
-            agg_dict['_satis_tutar'] = 'sum'
-
-        grup_ozet = df.groupby(col_alt_grup).agg(agg_dict)
+        # Alt grup bazında toplam (önbellekteki tablo değiştirilmez)
+        grup_ozet = alt_grup_ozet
 
         # Ciro payı hesapla
         if '_satis_tutar' in grup_ozet.columns:
-            grup_ozet['_ciro_pay'] = grup_ozet['_satis_tutar'] / toplam_ciro * 100
+            grup_ozet = grup_ozet.assign(_ciro_pay=grup_ozet['_satis_tutar'] / toplam_ciro * 100)
 
         # Cover > 30 ve ciro payı > %0.1 olanları filtrele
         kritik_gruplar = grup_ozet[
             (grup_ozet['_cover'] > 30) &
             (grup_ozet.get('_ciro_pay', pd.Series([100]*len(grup_ozet))) > 0.1)
-        ].sort_values('_cover', ascending=False)
+        ]
 
         if len(kritik_gruplar) > 0:
-            sonuc.append(f"\n🚨 KRİTİK ALT GRUPLAR (Cover > 30 hafta, Ciro Payı > %0.1)")
-            sonuc.append("-" * 90)
-            sonuc.append(f"{'Alt Grup':<25} {'Cover(hf)':>10} {'Stok Adet':>12} {'Satış Adet':>12} {'Ciro Payı':>10} {'Aksiyon':<15}")
-            sonuc.append("-" * 90)
-
-            for idx, row in kritik_gruplar.head(10).iterrows():
+            tablo_satirlari = []
+            for idx, row in en_buyuk_n(kritik_gruplar, 10, '_cover').iterrows():
                 grup_adi = str(idx)[:24]
                 cover = row['_cover']
                 stok = row.get('_stok', 0)
@@ -1682,36 +2972,23 @@ def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None)
                 else:
                     aksiyon = "%20 indirim"
 
-                sonuc.append(f"{grup_adi:<25} {cover:>8.0f}hf {stok:>11,.0f} {satis:>11,.0f} {ciro_pay:>8.1f}% {aksiyon:<15}")
+                tablo_satirlari.append([grup_adi, f"{cover:.0f}", f"{stok:,.0f}", f"{satis:,.0f}", f"{ciro_pay:.1f}", aksiyon])
 
+            cikti.tablo(
+                ['Alt Grup', 'Cover(hf)', 'Stok Adet', 'Satış Adet', 'Ciro Payı%', 'Aksiyon'],
+                tablo_satirlari, oncelik=ONCELIK_YUKSEK,
+                baslik=[f"\n🚨 KRİTİK ALT GRUPLAR (Cover > 30 hafta, Ciro Payı > %0.1)"]
+            )
+            sonuc = cikti.bolum(ONCELIK_KRITIK)
             sonuc.append(f"\n⚡ Bu {len(kritik_gruplar)} alt grup toplam stoğun önemli bir kısmını bağlıyor - indirim kampanyası planla!")
         else:
             sonuc.append(f"\n✅ Cover > 30 hafta olan kritik alt grup yok.")
 
     # ALT GRUP BAZINDA ÖZET (Tümü)
     if col_alt_grup and not alt_grup:
-        sonuc.append(f"\n📁 TÜM ALT GRUPLAR - COVER SIRALI (Top 15)")
-        sonuc.append("-" * 90)
-
-        # Aggregation dictionary - tüm metrikleri topla
-        agg_dict_all = {}
-        if '_cover' in df.columns:
-            agg_dict_all['_cover'] = 'mean'
-        if '_stok' in df.columns:
-            agg_dict_all['_stok'] = 'sum'
-        if '_satis_adet' in df.columns:
-            agg_dict_all['_satis_adet'] = 'sum'
-        if '_satis_tutar' in df.columns:
-            agg_dict_all['_satis_tutar'] = 'sum'
+        grup_ozet_all = en_buyuk_n(alt_grup_ozet, 15, '_cover')
 
-        # Eğer hiçbir kolon yoksa, count yap
-        if not agg_dict_all:
-            agg_dict_all['_cover'] = 'count'
-
-        grup_ozet_all = df.groupby(col_alt_grup).agg(agg_dict_all).sort_values('_cover', ascending=False).head(15)
-
-        sonuc.append(f"{'Alt Grup':<28} {'Cover(hf)':>10} {'Stok Adet':>12} {'Satış Adet':>12} {'Aksiyon':<15}")
-        sonuc.append("-" * 90)
+        tablo_satirlari = []
         for idx, row in grup_ozet_all.iterrows():
             cover = row.get('_cover', 0)
             stok = row.get('_stok', 0)
@@ -1728,25 +3005,31 @@ def cover_diagram_analiz(kup: KupVeri, alt_grup: str = None, magaza: str = None)
                 aksiyon = "Normal"
 
             cover_emoji = "🔴" if cover > 30 else ("⚠️" if cover > 12 else "")
-            sonuc.append(f"{str(idx)[:27]:<28} {cover:>8.1f}hf {stok:>11,.0f} {satis:>11,.0f} {aksiyon:<15} {cover_emoji}")
+            tablo_satirlari.append([str(idx)[:27], f"{cover:.1f}", f"{stok:,.0f}", f"{satis:,.0f}", f"{aksiyon} {cover_emoji}".strip()])
+
+        cikti.tablo(
+            ['Alt Grup', 'Cover(hf)', 'Stok Adet', 'Satış Adet', 'Aksiyon'],
+            tablo_satirlari, oncelik=ONCELIK_NORMAL,
+            baslik=[f"\n📁 TÜM ALT GRUPLAR - COVER SIRALI (Top 15)"]
+        )
     
     # MAĞAZA BAZINDA ÖZET
-    if col_magaza and not magaza:
+    if col_magaza and not magaza and '_cover' in df.columns:
+        sonuc = cikti.bolum(ONCELIK_NORMAL)
         sonuc.append(f"\n🏪 MAĞAZA BAZINDA COVER (En Yüksek 10)")
         sonuc.append("-" * 50)
         
-        mag_ozet = df.groupby(col_magaza).agg({
-            '_cover': 'mean'
-        }).sort_values('_cover', ascending=False).head(10)
+        # Alt grup filtresi yoksa önbellekteki filtresiz mağaza toplamı
+        mag_ozet = en_buyuk_n(cd.magaza_ozet if not alt_grup else CoverDiyagrami.magaza_topla(df), 10, '_cover')
         
         for idx, row in mag_ozet.iterrows():
             cover_emoji = "🔴" if row['_cover'] > 12 else ""
             sonuc.append(f"   {str(idx)[:30]}: {row['_cover']:.1f}hf {cover_emoji}")
     
-    return "\n".join(sonuc)
+    return cikti
 
 
-def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
+def kapasite_analiz(kup: KupVeri, magaza: str = None) -> Union[str, AracCiktisi]:
     """
     Kapasite-Performans analizi - Mağaza doluluk ve performans
     DETAYLI ANALİZ: Doluluk aralıkları, stok/satış adetleri, en dolu/boş mağazalar
@@ -1755,10 +3038,11 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     if len(kup.kapasite) == 0:
         return "❌ Kapasite raporu yüklenmemiş."
     
-    df = kup.kapasite.copy()
+    df = kup_kopya(kup.kapasite)
     kolonlar = list(df.columns)
     
-    sonuc = []
+    cikti = AracCiktisi()
+    sonuc = cikti.bolum(ONCELIK_KRITIK)
     sonuc.append("=" * 70)
     sonuc.append("📦 MAĞAZA KAPASİTE VE PERFORMANS ANALİZİ")
     sonuc.append("=" * 70 + "\n")
@@ -1883,6 +3167,7 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     # 2. DOLULUK ARALIKLARI DAĞILIMI (YENİ EŞİKLER)
     # =========================================
     if '_fiili' in df.columns:
+        sonuc = cikti.bolum(ONCELIK_YUKSEK)
         sonuc.append(f"\n📊 DOLULUK ARALIKLARI DAĞILIMI")
         sonuc.append("-" * 70)
 
@@ -1921,6 +3206,7 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     # 2.1 COVER BAZLI MAĞAZA DURUM ANALİZİ
     # =========================================
     if '_fiili' in df.columns and '_cover' in df.columns:
+        sonuc = cikti.bolum(ONCELIK_NORMAL)
         sonuc.append(f"\n📊 COVER BAZLI MAĞAZA DURUM ANALİZİ")
         sonuc.append("-" * 90)
         sonuc.append("Cover ≤12 hf: Hızlı satış - doluluk yüksek olmalı")
@@ -1971,6 +3257,21 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
                 if sayi > 0:
                     sonuc.append(f"   {durum}: {sayi} mağaza")
     
+    def magaza_satirlari(alt_df, varsayilan_durum=''):
+        satirlar = []
+        for _, row in alt_df.iterrows():
+            satirlar.append([
+                str(row[col_magaza])[:29],
+                f"{row.get('_fiili', 0):.0f}",
+                f"{row.get('_cover', 0):.1f}",
+                f"{row.get('_stok_adet', 0):,.0f}",
+                f"{row.get('_satis_adet', 0):,.0f}",
+                row.get('_durum', varsayilan_durum)
+            ])
+        return satirlar
+    
+    magaza_kolonlari = ['Mağaza', 'Doluluk%', 'Cover(hf)', 'Stok', 'Satış', 'Durum']
+    
     # =========================================
     # 3. KRİTİK MAĞAZALAR - HIZLI SATIŞ (Cover ≤12)
     # =========================================
@@ -1979,24 +3280,13 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
         hizli_ve_bos = df[(df['_cover'] <= 12) & (df['_fiili'] < 95)].copy()
 
         if len(hizli_ve_bos) > 0:
-            sonuc.append(f"\n🚨 ACİL MÜDAHALE GEREKLİ - HIZLI SATIŞ AMA BOŞ ({len(hizli_ve_bos)} mağaza)")
-            sonuc.append("Cover ≤12 hf olduğu için hızlı satıyor ama doluluk düşük - stok yetersiz!")
-            sonuc.append("-" * 95)
-            sonuc.append(f"{'Mağaza':<30} {'Doluluk':>10} {'Cover':>8} {'Stok':>12} {'Satış':>12} {'Durum':<20}")
-            sonuc.append("-" * 95)
-
-            # Önceliğe göre sırala (en kritik üstte)
-            hizli_ve_bos = hizli_ve_bos.sort_values('_fiili', ascending=True)
-
-            for _, row in hizli_ve_bos.head(10).iterrows():
-                mag = str(row[col_magaza])[:29]
-                doluluk = row.get('_fiili', 0)
-                cover = row.get('_cover', 0)
-                stok = row.get('_stok_adet', 0)
-                satis = row.get('_satis_adet', 0)
-                durum = row.get('_durum', '')
-                sonuc.append(f"{mag:<30} %{doluluk:>8.0f} {cover:>7.1f}hf {stok:>11,.0f} {satis:>11,.0f} {durum:<20}")
-
+            # Önceliğe göre ilk 10 (en kritik üstte)
+            cikti.tablo(
+                magaza_kolonlari, magaza_satirlari(en_kucuk_n(hizli_ve_bos, 10, '_fiili')), oncelik=ONCELIK_YUKSEK,
+                baslik=[f"\n🚨 ACİL MÜDAHALE GEREKLİ - HIZLI SATIŞ AMA BOŞ ({len(hizli_ve_bos)} mağaza)",
+                        "Cover ≤12 hf olduğu için hızlı satıyor ama doluluk düşük - stok yetersiz!"]
+            )
+            sonuc = cikti.bolum(ONCELIK_YUKSEK)
             sonuc.append(f"\n⚡ AKSİYON: Bu mağazalara acil sevkiyat planla! Satış kaçırılıyor.")
 
     # =========================================
@@ -2007,24 +3297,13 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
         yavas_ve_dolu = df[(df['_cover'] > 12) & (df['_fiili'] >= 110)].copy()
 
         if len(yavas_ve_dolu) > 0:
-            sonuc.append(f"\n⚠️ STOK FAZLASI RİSKİ - YAVAŞ SATIŞ AMA DOLU ({len(yavas_ve_dolu)} mağaza)")
-            sonuc.append("Cover >12 hf olduğu için yavaş satıyor ama doluluk yüksek - stok eritilmeli!")
-            sonuc.append("-" * 95)
-            sonuc.append(f"{'Mağaza':<30} {'Doluluk':>10} {'Cover':>8} {'Stok':>12} {'Satış':>12} {'Durum':<20}")
-            sonuc.append("-" * 95)
-
             # En dolu olanlar üstte
-            yavas_ve_dolu = yavas_ve_dolu.sort_values('_fiili', ascending=False)
-
-            for _, row in yavas_ve_dolu.head(10).iterrows():
-                mag = str(row[col_magaza])[:29]
-                doluluk = row.get('_fiili', 0)
-                cover = row.get('_cover', 0)
-                stok = row.get('_stok_adet', 0)
-                satis = row.get('_satis_adet', 0)
-                durum = row.get('_durum', '')
-                sonuc.append(f"{mag:<30} %{doluluk:>8.0f} {cover:>7.1f}hf {stok:>11,.0f} {satis:>11,.0f} {durum:<20}")
-
+            cikti.tablo(
+                magaza_kolonlari, magaza_satirlari(en_buyuk_n(yavas_ve_dolu, 10, '_fiili')), oncelik=ONCELIK_YUKSEK,
+                baslik=[f"\n⚠️ STOK FAZLASI RİSKİ - YAVAŞ SATIŞ AMA DOLU ({len(yavas_ve_dolu)} mağaza)",
+                        "Cover >12 hf olduğu için yavaş satıyor ama doluluk yüksek - stok eritilmeli!"]
+            )
+            sonuc = cikti.bolum(ONCELIK_YUKSEK)
             sonuc.append(f"\n💡 AKSİYON: Bu mağazalarda indirim/promosyon veya stok transferi değerlendir.")
 
     # =========================================
@@ -2032,24 +3311,16 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     # =========================================
     if '_fiili' in df.columns:
         en_bos = df.nsmallest(5, '_fiili')
-        sonuc.append(f"\n🔴 EN BOŞ 5 MAĞAZA (Ürün Eksikliği)")
-        sonuc.append("-" * 95)
-        sonuc.append(f"{'Mağaza':<30} {'Doluluk':>10} {'Cover':>8} {'Stok':>12} {'Satış':>12} {'Durum':<20}")
-        sonuc.append("-" * 95)
-
-        for _, row in en_bos.iterrows():
-            mag = str(row[col_magaza])[:29]
-            doluluk = row.get('_fiili', 0)
-            cover = row.get('_cover', 0)
-            stok = row.get('_stok_adet', 0)
-            satis = row.get('_satis_adet', 0)
-            durum = row.get('_durum', 'N/A')
-            sonuc.append(f"{mag:<30} %{doluluk:>8.0f} {cover:>7.1f}hf {stok:>11,.0f} {satis:>11,.0f} {durum:<20}")
+        cikti.tablo(
+            magaza_kolonlari, magaza_satirlari(en_bos, 'N/A'), oncelik=ONCELIK_NORMAL,
+            baslik=[f"\n🔴 EN BOŞ 5 MAĞAZA (Ürün Eksikliği)"]
+        )
     
     # =========================================
     # 5. KARLI-HIZLI METRİK DAĞILIMI
     # =========================================
     if col_karli_hizli:
+        sonuc = cikti.bolum(ONCELIK_NORMAL)
         sonuc.append(f"\n📊 KARLI-HIZLI METRİK DAĞILIMI")
         sonuc.append("-" * 70)
         
@@ -2074,6 +3345,7 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     # 6. EN İYİ PERFORMANS (LFL Satış)
     # =========================================
     if '_lfl_satis' in df.columns:
+        sonuc = cikti.bolum(ONCELIK_DUSUK)
         sonuc.append(f"\n✅ EN İYİ PERFORMANS - TOP 5 (LFL Satış Büyümesi)")
         sonuc.append("-" * 60)
         
@@ -2101,6 +3373,7 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
     # =========================================
     # 8. ÖZET DEĞERLENDİRME (YENİ EŞİKLER)
     # =========================================
+    sonuc = cikti.bolum(ONCELIK_KRITIK)
     sonuc.append(f"\n📋 ÖZET DEĞERLENDİRME")
     sonuc.append("-" * 60)
 
@@ -2137,7 +3410,7 @@ def kapasite_analiz(kup: KupVeri, magaza: str = None) -> str:
         ])
         sonuc.append(f"   ✅ {saglikli} mağaza sağlıklı durumda")
 
-    return "\n".join(sonuc)
+    return cikti
 
 
 def siparis_takip_analiz(kup: KupVeri, ana_grup: str = None) -> str:
@@ -2151,7 +3424,7 @@ def siparis_takip_analiz(kup: KupVeri, ana_grup: str = None) -> str:
     if len(kup.siparis_takip) == 0:
         return "❌ Sipariş Takip raporu yüklenmemiş."
     
-    df = kup.siparis_takip.copy()
+    df = kup_kopya(kup.siparis_takip)
     kolonlar = list(df.columns)
     
     sonuc = []
@@ -2246,12 +3519,12 @@ def siparis_takip_analiz(kup: KupVeri, ana_grup: str = None) -> str:
             '_siparis': 'sum',
             '_giren': 'sum',
             '_bekleyen': 'sum'
-        }).sort_values('_butce', ascending=False)
+        })
         
         sonuc.append(f"{'Ana Grup':<25} {'Bütçe':>12} {'Sipariş':>12} {'Giren':>12} {'Bekleyen':>12} {'%Gerç':>8}")
         sonuc.append("-" * 85)
         
-        for idx, row in grup_ozet.head(12).iterrows():
+        for idx, row in en_buyuk_n(grup_ozet, 12, '_butce').iterrows():
             grup = str(idx)[:24]
             butce = row['_butce'] / 1e6
             siparis = row['_siparis'] / 1e6
@@ -2374,61 +3647,20 @@ def ihtiyac_hesapla(kup: KupVeri, limit: int = 50) -> str:
     if len(kup.depo_stok) == 0:
         return "❌ Depo stok verisi yüklenmemiş."
     
-    df = kup.stok_satis.copy()
-    
-    # Mağaza bazında ihtiyaç hesapla
-    if 'stok_durum' not in df.columns:
+    if 'stok_durum' not in kup.stok_satis.columns:
         return "❌ Stok durumu hesaplanamamış."
     
-    # Sevk gereken satırları al
-    sevk_gerekli = df[df['stok_durum'] == 'SEVK_GEREKLI'].copy()
-    
-    if len(sevk_gerekli) == 0:
-        return "✅ Sevk gereken ürün bulunmuyor."
-    
-    # Ürün bazında ihtiyaç topla
-    if 'urun_kod' not in sevk_gerekli.columns:
+    if 'urun_kod' not in kup.stok_satis.columns:
         return "❌ urun_kod kolonu bulunamadı."
     
-    ihtiyac = sevk_gerekli.groupby('urun_kod').agg({
-        'stok': 'sum',
-        'min_deger': 'first'
-    }).reset_index()
-    ihtiyac.columns = ['urun_kod', 'mevcut_stok', 'min_deger']
-    
-    # Mağaza sayısını hesapla
-    magaza_sayisi = sevk_gerekli.groupby('urun_kod').size().reset_index(name='magaza_sayisi')
-    ihtiyac = ihtiyac.merge(magaza_sayisi, on='urun_kod')
-    
-    # İhtiyaç hesapla
-    ihtiyac['ihtiyac'] = ihtiyac['magaza_sayisi'] * ihtiyac['min_deger'].fillna(3) - ihtiyac['mevcut_stok']
-    ihtiyac['ihtiyac'] = ihtiyac['ihtiyac'].clip(lower=0)
-    
-    # Depo stok ile birleştir
-    depo = kup.depo_stok.copy()
-    depo.columns = depo.columns.str.lower().str.strip()
+    # Ürün bazında ihtiyaç + depo stok (veri versiyonu başına bir kez hesaplanır)
+    ihtiyac = kup.ihtiyac_tablosu()
     
-    if 'urun_kod' in depo.columns:
-        depo['urun_kod'] = depo['urun_kod'].astype(str)
-        ihtiyac['urun_kod'] = ihtiyac['urun_kod'].astype(str)
-        
-        depo_grouped = depo.groupby('urun_kod')['stok'].sum().reset_index()
-        depo_grouped.columns = ['urun_kod', 'depo_stok']
-        
-        ihtiyac = ihtiyac.merge(depo_grouped, on='urun_kod', how='left')
-        ihtiyac['depo_stok'] = ihtiyac['depo_stok'].fillna(0)
-    else:
-        ihtiyac['depo_stok'] = 0
-    
-    # Karşılama durumu
-    ihtiyac['karsilama'] = np.where(
-        ihtiyac['depo_stok'] >= ihtiyac['ihtiyac'],
-        'TAM',
-        np.where(ihtiyac['depo_stok'] > 0, 'KISMİ', 'YOK')
-    )
+    if len(ihtiyac) == 0:
+        return "✅ Sevk gereken ürün bulunmuyor."
     
     # Önceliklendir
-    ihtiyac = ihtiyac.sort_values('ihtiyac', ascending=False).head(limit)
+    ihtiyac = en_buyuk_n(ihtiyac, limit, 'ihtiyac')
     
     sonuc.append(f"{'Ürün Kodu':<12} | {'Mağaza#':>8} | {'İhtiyaç':>10} | {'Depo':>10} | Durum")
     sonuc.append("-" * 65)
@@ -2472,21 +3704,23 @@ def genel_ozet(kup: KupVeri) -> str:
     
     sonuc = []
     
-    # Toplam metrikler
-    toplam_stok = kup.stok_satis['stok'].sum() if 'stok' in kup.stok_satis.columns else 0
-    toplam_satis = kup.stok_satis['satis'].sum() if 'satis' in kup.stok_satis.columns else 0
-    toplam_ciro = kup.stok_satis['ciro'].sum() if 'ciro' in kup.stok_satis.columns else 0
-    toplam_kar = kup.stok_satis['kar'].sum() if 'kar' in kup.stok_satis.columns else 0
+    # Toplam metrikler + stok durumu sayıları - yükleme anında hesaplanan
+    # toplamlardan okunur (tam tabloda sum / filtre taraması yok)
+    toplam = kup.toplamlar().topla()
+    toplam_stok = toplam.get('stok', 0)
+    toplam_satis = toplam.get('satis', 0)
+    toplam_ciro = toplam.get('ciro', 0)
+    toplam_kar = toplam.get('kar', 0)
     
     # Depo stok
-    depo_toplam = kup.depo_stok['stok'].sum() if len(kup.depo_stok) > 0 else 0
+    depo_toplam = kup.depo_gorunumu().stok.sum()
     
-    # Stok durumu sayıları
-    sevk_gerekli = len(kup.stok_satis[kup.stok_satis['stok_durum'] == 'SEVK_GEREKLI'])
-    fazla_stok = len(kup.stok_satis[kup.stok_satis['stok_durum'] == 'FAZLA_STOK'])
-    yavas = len(kup.stok_satis[kup.stok_satis['stok_durum'] == 'YAVAS'])
-    normal = len(kup.stok_satis[kup.stok_satis['stok_durum'] == 'NORMAL'])
-    toplam_kayit = len(kup.stok_satis)
+    durumlar = kup.durum_sayilari()
+    sevk_gerekli = int(durumlar['SEVK_GEREKLI'])
+    fazla_stok = int(durumlar['FAZLA_STOK'])
+    yavas = int(durumlar['YAVAS'])
+    normal = int(durumlar['NORMAL'])
+    toplam_kayit = int(toplam.get('satir', len(kup.stok_satis)))
     
     # Cover hesapla
     if toplam_satis > 0:
@@ -2559,46 +3793,52 @@ def genel_ozet(kup: KupVeri) -> str:
 def kategori_analiz(kup: KupVeri, kategori_kod: str) -> str:
     """Belirli kategorinin detaylı analizi"""
     
-    # Kategori filtrele
-    if 'kategori_kod' in kup.stok_satis.columns:
-        kat_veri = kup.stok_satis[kup.stok_satis['kategori_kod'].astype(str) == str(kategori_kod)]
-    else:
+    # Kategori filtrele (toplam küpünden - satırlar taranmaz)
+    if 'kategori_kod' not in kup.stok_satis.columns:
         return "Kategori bilgisi mevcut değil."
     
-    if len(kat_veri) == 0:
+    toplamlar = kup.toplamlar()
+    filtre = {'kategori_kod': kategori_kod}
+    kat_toplam = toplamlar.topla(filtre=filtre)
+    
+    if kat_toplam['satir'] == 0:
         return f"Kategori '{kategori_kod}' bulunamadı."
     
+    tekil = toplamlar.tekil(['kategori_kod'], filtre).sum()
+    
     sonuc = []
     sonuc.append(f"=== KATEGORİ ANALİZİ: {kategori_kod} ===\n")
     
     # Özet metrikler
-    sonuc.append(f"Toplam Satır: {len(kat_veri):,}")
-    sonuc.append(f"Benzersiz Ürün: {kat_veri['urun_kod'].nunique():,}")
-    sonuc.append(f"Benzersiz Mağaza: {kat_veri['magaza_kod'].nunique():,}")
-    sonuc.append(f"Toplam Stok: {kat_veri['stok'].sum():,.0f}")
-    sonuc.append(f"Toplam Satış: {kat_veri['satis'].sum():,.0f}")
-    sonuc.append(f"Toplam Ciro: {kat_veri['ciro'].sum():,.0f} TL")
-    sonuc.append(f"Toplam Kar: {kat_veri['kar'].sum():,.0f} TL")
+    sonuc.append(f"Toplam Satır: {int(kat_toplam['satir']):,}")
+    sonuc.append(f"Benzersiz Ürün: {int(tekil['urun_kod']):,}")
+    sonuc.append(f"Benzersiz Mağaza: {int(tekil['magaza_kod']):,}")
+    sonuc.append(f"Toplam Stok: {kat_toplam['stok']:,.0f}")
+    sonuc.append(f"Toplam Satış: {kat_toplam['satis']:,.0f}")
+    sonuc.append(f"Toplam Ciro: {kat_toplam['ciro']:,.0f} TL")
+    sonuc.append(f"Toplam Kar: {kat_toplam['kar']:,.0f} TL")
     
     # Stok durumu
     sonuc.append("\n--- Stok Durumu ---")
-    for durum in ['SEVK_GEREKLI', 'FAZLA_STOK', 'YAVAS', 'NORMAL']:
-        count = len(kat_veri[kat_veri['stok_durum'] == durum])
+    durumlar = kup.durum_sayilari('kategori_kod', kategori_kod)
+    for durum in STOK_DURUMLARI:
+        count = int(durumlar[durum])
         if count > 0:
             emoji = {'SEVK_GEREKLI': '🔴', 'FAZLA_STOK': '🟡', 'YAVAS': '🟠', 'NORMAL': '✅'}[durum]
             sonuc.append(f"{emoji} {durum}: {count:,} satır")
     
     # Mal grubu kırılımı
-    if 'mg' in kat_veri.columns:
+    if 'mg' in kup.stok_satis.columns:
         sonuc.append("\n--- Mal Grubu Kırılımı ---")
-        mg_ozet = kat_veri.groupby('mg').agg({
-            'urun_kod': 'nunique',
-            'stok': 'sum',
-            'satis': 'sum'
-        }).reset_index()
-        mg_ozet.columns = ['MG', 'Urun_Sayisi', 'Stok', 'Satis']
+        mg_toplam = toplamlar.topla(['mg'], filtre=filtre)
+        mg_ozet = pd.DataFrame({
+            'Urun_Sayisi': toplamlar.tekil(['kategori_kod', 'mg'], filtre)['urun_kod'],
+            'Stok': mg_toplam['stok'],
+            'Satis': mg_toplam['satis'],
+        }).rename_axis('MG').reset_index()
         mg_ozet['Cover'] = mg_ozet['Stok'] / (mg_ozet['Satis'] + 0.1)
         mg_ozet = mg_ozet.nlargest(10, 'Stok')
+        mg_ozet['MG'] = mg_ozet['MG'].astype(str)
         
         for _, row in mg_ozet.iterrows():
             durum = "🔴" if row['Cover'] > 12 else "✅"
@@ -2606,21 +3846,19 @@ def kategori_analiz(kup: KupVeri, kategori_kod: str) -> str:
     
     # En çok satan ürünler
     sonuc.append("\n--- En Çok Satan Ürünler ---")
-    top_satis = kat_veri.groupby('urun_kod').agg({
-        'satis': 'sum',
-        'stok': 'sum',
-        'ciro': 'sum'
-    }).reset_index().nlargest(10, 'satis')
+    top_satis = toplamlar.topla(['urun_kod'], filtre=filtre)[['satis', 'stok', 'ciro']].reset_index().nlargest(10, 'satis')
+    top_satis['urun_kod'] = top_satis['urun_kod'].astype(str)
     
     for _, row in top_satis.iterrows():
         sonuc.append(f"  {row['urun_kod']}: Satış {row['satis']:,.0f} | Stok {row['stok']:,.0f}")
     
     # Sevk gereken ürünler
-    sevk_gerekli = kat_veri[kat_veri['stok_durum'] == 'SEVK_GEREKLI']
-    if len(sevk_gerekli) > 0:
-        sonuc.append(f"\n--- Sevk Gereken ({len(sevk_gerekli)} satır) ---")
-        top_sevk = sevk_gerekli.groupby('urun_kod').size().reset_index(name='magaza_sayisi')
+    sevk_urun = toplamlar.topla(['urun_kod'], durumlar=['SEVK_GEREKLI'], filtre=filtre)
+    if len(sevk_urun) > 0:
+        sonuc.append(f"\n--- Sevk Gereken ({int(sevk_urun['satir'].sum())} satır) ---")
+        top_sevk = sevk_urun['satir'].rename('magaza_sayisi').reset_index()
         top_sevk = top_sevk.nlargest(10, 'magaza_sayisi')
+        top_sevk['urun_kod'] = top_sevk['urun_kod'].astype(str)
         for _, row in top_sevk.iterrows():
             sonuc.append(f"  🔴 {row['urun_kod']}: {row['magaza_sayisi']} mağazada stok düşük")
     
@@ -2659,8 +3897,9 @@ def magaza_analiz(kup: KupVeri, magaza_kod: str) -> str:
     
     # Stok durumu
     sonuc.append("\n--- Stok Durumu ---")
-    for durum in ['SEVK_GEREKLI', 'FAZLA_STOK', 'YAVAS', 'NORMAL']:
-        count = len(mag_veri[mag_veri['stok_durum'] == durum])
+    durumlar = kup.durum_sayilari('magaza_kod', magaza_kod)
+    for durum in STOK_DURUMLARI:
+        count = int(durumlar[durum])
         if count > 0:
             emoji = {'SEVK_GEREKLI': '🔴', 'FAZLA_STOK': '🟡', 'YAVAS': '🟠', 'NORMAL': '✅'}[durum]
             sonuc.append(f"{emoji} {durum}: {count:,} ürün")
@@ -2707,17 +3946,18 @@ def urun_analiz(kup: KupVeri, urun_kod: str) -> str:
     
     # Depo stok
     if len(kup.depo_stok) > 0:
-        depo_urun = kup.depo_stok[kup.depo_stok['urun_kod'].astype(str) == str(urun_kod)]
+        depo_urun = kup.depo_gorunumu().urun_satirlari(urun_kod)
         if len(depo_urun) > 0:
             sonuc.append(f"\n--- Depo Stok ---")
-            for _, row in depo_urun.iterrows():
-                sonuc.append(f"  Depo {row['depo_kod']}: {row['stok']:,.0f} adet")
+            for depo_kod, stok in zip(depo_urun['depo_kod'], depo_urun['stok']):
+                sonuc.append(f"  Depo {depo_kod}: {stok:,.0f} adet")
             sonuc.append(f"  Toplam Depo: {depo_urun['stok'].sum():,.0f} adet")
     
     # Stok durumu dağılımı
     sonuc.append("\n--- Mağaza Stok Durumu ---")
-    for durum in ['SEVK_GEREKLI', 'FAZLA_STOK', 'YAVAS', 'NORMAL']:
-        count = len(urun_veri[urun_veri['stok_durum'] == durum])
+    durumlar = kup.durum_sayilari('urun_kod', urun_kod)
+    for durum in STOK_DURUMLARI:
+        count = int(durumlar[durum])
         if count > 0:
             emoji = {'SEVK_GEREKLI': '🔴', 'FAZLA_STOK': '🟡', 'YAVAS': '🟠', 'NORMAL': '✅'}[durum]
             sonuc.append(f"{emoji} {durum}: {count:,} mağaza")
@@ -2746,54 +3986,24 @@ def sevkiyat_plani(kup: KupVeri, limit: int = 50) -> str:
     if 'stok_durum' not in kup.stok_satis.columns:
         return "❌ Stok durumu hesaplanamamış."
     
-    sevk_gerekli = kup.stok_satis[kup.stok_satis['stok_durum'] == 'SEVK_GEREKLI'].copy()
-    
-    if len(sevk_gerekli) == 0:
-        return "✅ Sevk gereken ürün bulunmuyor."
-    
-    sonuc.append(f"Toplam sevk gereken: {len(sevk_gerekli):,} mağaza×ürün kombinasyonu\n")
-    
-    # Ürün bazlı önceliklendirme - dinamik kolon kullanımı
-    agg_dict = {}
-    if 'magaza_kod' in sevk_gerekli.columns:
-        agg_dict['magaza_kod'] = 'count'
-    if 'satis' in sevk_gerekli.columns:
-        agg_dict['satis'] = 'sum'
-    if 'stok' in sevk_gerekli.columns:
-        agg_dict['stok'] = 'sum'
-    if 'min_deger' in sevk_gerekli.columns:
-        agg_dict['min_deger'] = 'first'
-    
-    if len(agg_dict) == 0 or 'urun_kod' not in sevk_gerekli.columns:
+    if 'urun_kod' not in kup.stok_satis.columns:
         return "❌ Gerekli kolonlar bulunamadı."
     
-    urun_oncelik = sevk_gerekli.groupby('urun_kod').agg(agg_dict).reset_index()
+    # Ürün bazında ihtiyaç + depo stok (ihtiyac_hesapla ile aynı tablo)
+    urun_oncelik = kup.ihtiyac_tablosu()
     
-    # Kolon isimlerini düzelt
-    rename_map = {'magaza_kod': 'magaza_sayisi', 'satis': 'toplam_satis', 'stok': 'toplam_stok'}
-    urun_oncelik = urun_oncelik.rename(columns=rename_map)
+    if len(urun_oncelik) == 0:
+        return "✅ Sevk gereken ürün bulunmuyor."
     
-    # Eksik hesapla
-    if 'magaza_sayisi' in urun_oncelik.columns and 'min_deger' in urun_oncelik.columns:
-        urun_oncelik['eksik'] = urun_oncelik['magaza_sayisi'] * urun_oncelik['min_deger'].fillna(3) - urun_oncelik.get('toplam_stok', 0)
-    else:
-        urun_oncelik['eksik'] = 0
+    sevk_satir = int(kup.toplamlar().topla(durumlar=['SEVK_GEREKLI'])['satir'])
+    sonuc.append(f"Toplam sevk gereken: {sevk_satir:,} mağaza×ürün kombinasyonu\n")
     
     # Sıralama
     if 'toplam_satis' in urun_oncelik.columns:
-        urun_oncelik = urun_oncelik.sort_values('toplam_satis', ascending=False).head(limit)
+        urun_oncelik = en_buyuk_n(urun_oncelik, limit, 'toplam_satis')
     else:
         urun_oncelik = urun_oncelik.head(limit)
     
-    # Depo stok kontrolü
-    if len(kup.depo_stok) > 0 and 'urun_kod' in kup.depo_stok.columns:
-        depo_grouped = kup.depo_stok.groupby('urun_kod')['stok'].sum().reset_index()
-        depo_grouped.columns = ['urun_kod', 'depo_stok']
-        urun_oncelik = urun_oncelik.merge(depo_grouped, on='urun_kod', how='left')
-        urun_oncelik['depo_stok'] = urun_oncelik['depo_stok'].fillna(0)
-    else:
-        urun_oncelik['depo_stok'] = 0
-    
     sonuc.append(f"{'Ürün Kodu':<12} | {'Mağaza#':>8} | {'Satış':>8} | {'Eksik':>8} | {'Depo':>8} | Durum")
     sonuc.append("-" * 75)
     
@@ -2836,34 +4046,23 @@ def fazla_stok_analiz(kup: KupVeri, limit: int = 50) -> str:
         return "❌ Stok durumu hesaplanamamış."
     
     # Fazla stok ve yavaş dönen
-    fazla = kup.stok_satis[kup.stok_satis['stok_durum'].isin(['FAZLA_STOK', 'YAVAS'])].copy()
+    toplamlar = kup.toplamlar()
+    fazla_satir = int(toplamlar.topla(durumlar=['FAZLA_STOK', 'YAVAS'])['satir'])
     
-    if len(fazla) == 0:
+    if fazla_satir == 0:
         return "✅ Fazla stok bulunmuyor."
     
-    sonuc.append(f"Toplam fazla/yavaş stok: {len(fazla):,} mağaza×ürün kombinasyonu\n")
+    sonuc.append(f"Toplam fazla/yavaş stok: {fazla_satir:,} mağaza×ürün kombinasyonu\n")
     
-    # Ürün bazlı özet - dinamik kolon kullanımı
-    if 'urun_kod' not in fazla.columns:
+    # Ürün bazlı özet (toplam küpünün ürün seviyesinden)
+    if 'urun_kod' not in kup.stok_satis.columns:
         return "❌ urun_kod kolonu bulunamadı."
     
-    agg_dict = {}
-    if 'magaza_kod' in fazla.columns:
-        agg_dict['magaza_kod'] = 'count'
-    if 'stok' in fazla.columns:
-        agg_dict['stok'] = 'sum'
-    if 'satis' in fazla.columns:
-        agg_dict['satis'] = 'sum'
-    if 'ciro' in fazla.columns:
-        agg_dict['ciro'] = 'sum'
-    
-    if len(agg_dict) == 0:
-        return "❌ Gerekli kolonlar bulunamadı."
-    
-    urun_ozet = fazla.groupby('urun_kod').agg(agg_dict).reset_index()
+    olculer = [k for k in ['stok', 'satis', 'ciro'] if k in toplamlar.olculer]
+    urun_ozet = toplamlar.topla(['urun_kod'], durumlar=['FAZLA_STOK', 'YAVAS'])[['satir'] + olculer].reset_index()
     
     # Kolon isimlerini düzelt
-    rename_map = {'magaza_kod': 'magaza_sayisi', 'stok': 'toplam_stok', 'satis': 'toplam_satis', 'ciro': 'toplam_ciro'}
+    rename_map = {'satir': 'magaza_sayisi', 'stok': 'toplam_stok', 'satis': 'toplam_satis', 'ciro': 'toplam_ciro'}
     urun_ozet = urun_ozet.rename(columns=rename_map)
     
     # Cover hesapla
@@ -2873,9 +4072,10 @@ def fazla_stok_analiz(kup: KupVeri, limit: int = 50) -> str:
         urun_ozet['cover'] = 0
     
     if 'toplam_stok' in urun_ozet.columns:
-        urun_ozet = urun_ozet.sort_values('toplam_stok', ascending=False).head(limit)
+        urun_ozet = en_buyuk_n(urun_ozet, limit, 'toplam_stok')
     else:
         urun_ozet = urun_ozet.head(limit)
+    urun_ozet['urun_kod'] = urun_ozet['urun_kod'].astype(str)
     
     sonuc.append(f"{'Ürün Kodu':<12} | {'Mağaza#':>8} | {'Stok':>10} | {'Satış':>8} | {'Cover':>8} | Öneri")
     sonuc.append("-" * 75)
@@ -2907,25 +4107,15 @@ def bolge_karsilastir(kup: KupVeri) -> str:
     sonuc = []
     sonuc.append("=== BÖLGE KARŞILAŞTIRMASI ===\n")
     
-    # Dinamik agg dict
-    agg_dict = {}
-    if 'magaza_kod' in kup.stok_satis.columns:
-        agg_dict['magaza_kod'] = 'nunique'
-    if 'urun_kod' in kup.stok_satis.columns:
-        agg_dict['urun_kod'] = 'nunique'
-    if 'stok' in kup.stok_satis.columns:
-        agg_dict['stok'] = 'sum'
-    if 'satis' in kup.stok_satis.columns:
-        agg_dict['satis'] = 'sum'
-    if 'ciro' in kup.stok_satis.columns:
-        agg_dict['ciro'] = 'sum'
-    if 'kar' in kup.stok_satis.columns:
-        agg_dict['kar'] = 'sum'
-    
-    if len(agg_dict) == 0:
+    # Toplam küpünden: benzersiz mağaza/ürün + ölçü toplamları
+    toplamlar = kup.toplamlar()
+    tekil = toplamlar.tekil(['bolge'])
+    tekil = tekil[[k for k in ['magaza_kod', 'urun_kod'] if k in tekil.columns]]
+    
+    if len(tekil.columns) + len(toplamlar.olculer) == 0:
         return "❌ Gerekli kolonlar bulunamadı."
     
-    bolge_ozet = kup.stok_satis.groupby('bolge').agg(agg_dict).reset_index()
+    bolge_ozet = pd.concat([tekil, toplamlar.topla(['bolge'])[toplamlar.olculer]], axis=1).reset_index()
     
     # Kolon isimlerini düzelt
     rename_map = {'magaza_kod': 'Magaza', 'urun_kod': 'Urun', 'stok': 'Stok', 'satis': 'Satis', 'ciro': 'Ciro', 'kar': 'Kar'}
@@ -2960,12 +4150,14 @@ def bolge_karsilastir(kup: KupVeri) -> str:
     return "\n".join(sonuc)
 
 
-def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, marka_kod: str = None, forward_cover: float = 7.0, export_excel: bool = False) -> str:
+def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, marka_kod: str = None, forward_cover: float = 7.0, export_excel: bool = False, talep_yontemi: str = 'ewma') -> str:
     """
     Sevkiyat hesaplaması - INLINE versiyon
     
     Mantık:
     1. hedef_stok = haftalik_satis × forward_cover
+       (haftalik_satis: talep_tahmini ile yumuşatılmış talep; talep_yontemi='son_hafta'
+       ise yalnızca küpteki satış)
     2. rpt_ihtiyac = hedef_stok - stok - yol
     3. min_ihtiyac = min - stok - yol (eğer stok+yol < min ise)
     4. final_ihtiyac = MAX(rpt_ihtiyac, min_ihtiyac)
@@ -2974,7 +4166,7 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
     """
     print("\n" + "="*50)
     print("🚀 SEVKIYAT_HESAPLA ÇAĞRILDI (INLINE)")
-    print(f"   Parametreler: kategori={kategori_kod}, urun={urun_kod}, fc={forward_cover}, excel={export_excel}")
+    print(f"   Parametreler: kategori={kategori_kod}, urun={urun_kod}, fc={forward_cover}, excel={export_excel}, talep={talep_yontemi}")
     print("="*50)
     
     try:
@@ -2990,8 +4182,14 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
         
         print(f"✅ Veri OK: stok_satis={len(stok_satis)}, depo_stok={len(depo_stok)}")
         
-        # 2. ANA VERİYİ HAZIRLA
-        df = stok_satis.copy()
+        talep_yontemi = (talep_yontemi or 'ewma').lower()
+        if talep_yontemi not in TALEP_YONTEMLERI:
+            return f"❌ Geçersiz talep yöntemi: {talep_yontemi}. Seçenekler: {', '.join(TALEP_YONTEMLERI)}"
+        
+        # 2. ANA VERİYİ HAZIRLA (talep filtrelerden önce - stok_satis satır sırasıyla hizalı)
+        df = kup_kopya(stok_satis)
+        talep, talep_bilgi = talep_tahmini(kup, talep_yontemi)
+        df['talep'] = talep
         df['urun_kod'] = df['urun_kod'].astype(str)
         df['magaza_kod'] = df['magaza_kod'].astype(str)
         print(f"   Başlangıç: {len(df)} satır")
@@ -3022,16 +4220,16 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
                 mag_m = mag_m.copy()
                 mag_m['magaza_kod'] = mag_m['magaza_kod'].astype(str)
                 df = df.merge(mag_m[['magaza_kod', 'depo_kod']], on='magaza_kod', how='left')
-                df['depo_kod'] = pd.to_numeric(df['depo_kod'], errors='coerce').fillna(9001).astype(int)
+                df['depo_kod'] = pd.to_numeric(df['depo_kod'], errors='coerce').fillna(VARSAYILAN_DEPO).astype(int)
             else:
-                df['depo_kod'] = 9001
+                df['depo_kod'] = VARSAYILAN_DEPO
         else:
-            df['depo_kod'] = pd.to_numeric(df['depo_kod'], errors='coerce').fillna(9001).astype(int)
+            df['depo_kod'] = pd.to_numeric(df['depo_kod'], errors='coerce').fillna(VARSAYILAN_DEPO).astype(int)
         
         print(f"   Depo kodları: {df['depo_kod'].unique().tolist()}")
         
         # 4. SAYISAL KOLONLARI HAZIRLA
-        df['haftalik_satis'] = pd.to_numeric(df['satis'], errors='coerce').fillna(0)
+        df['haftalik_satis'] = df['talep']
         df['stok'] = pd.to_numeric(df['stok'], errors='coerce').fillna(0)
         df['yol'] = pd.to_numeric(df.get('yol', 0), errors='coerce').fillna(0)
         
@@ -3076,56 +4274,38 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
         print(f"      - MIN ihtiyaç olan: {(df['min_ihtiyac'] > 0).sum()}")
         print(f"      - Toplam ihtiyaç olan: {(df['ihtiyac'] > 0).sum()}")
         
-        # 7. DEPO STOK SÖZLÜĞÜ OLUŞTUR
-        depo_df = depo_stok.copy()
-        depo_df.columns = [c.lower().strip() for c in depo_df.columns]
-        depo_df['urun_kod'] = depo_df['urun_kod'].astype(str)
-        depo_df['depo_kod'] = pd.to_numeric(depo_df['depo_kod'], errors='coerce').fillna(9001).astype(int)
-        depo_df['stok'] = pd.to_numeric(depo_df['stok'], errors='coerce').fillna(0)
-        
-        depo_stok_dict = {}
-        for _, row in depo_df.iterrows():
-            key = (int(row['depo_kod']), str(row['urun_kod']))
-            depo_stok_dict[key] = depo_stok_dict.get(key, 0) + float(row['stok'])
+        # 7. DEPO STOK (küp yüklemesinde bir kez kurulan tekil depo × ürün görünümü)
+        depo_gorunum = kup.depo_gorunumu()
+        if depo_gorunum.eksik_kolonlar:
+            return f"❌ Depo stok verisinde kolon bulunamadı: {', '.join(depo_gorunum.eksik_kolonlar)}"
         
-        print(f"   Depo stok: {len(depo_stok_dict)} ürün×depo kombinasyonu")
+        print(f"   Depo stok: {len(depo_gorunum)} ürün×depo kombinasyonu")
         
-        # 8. SEVKİYAT DAĞIT
-        ihtiyac_df = df[df['ihtiyac'] > 0].copy()
-        ihtiyac_df = ihtiyac_df.sort_values('ihtiyac', ascending=False)
-        
-        sevkiyat_list = []
-        for _, row in ihtiyac_df.iterrows():
-            key = (int(row['depo_kod']), str(row['urun_kod']))
-            ihtiyac = float(row['ihtiyac'])
-            
-            mevcut_depo = depo_stok_dict.get(key, 0)
-            if mevcut_depo > 0:
-                sevk = min(ihtiyac, mevcut_depo)
-                depo_stok_dict[key] -= sevk
-            else:
-                sevk = 0
-            
-            sevkiyat_list.append({
-                'magaza_kod': row['magaza_kod'],
-                'urun_kod': row['urun_kod'],
-                'depo_kod': row['depo_kod'],
-                'stok': int(row['stok']),
-                'yol': int(row['yol']),
-                'min': int(row['min']),
-                'haftalik_satis': round(row['haftalik_satis'], 1),
-                'cover': round(row['cover'], 1),
-                'hedef_stok': int(row['hedef_stok']),
-                'ihtiyac': int(ihtiyac),
-                'ihtiyac_turu': row['ihtiyac_turu'],
-                'sevkiyat': int(sevk),
-                'karsilanamayan': int(ihtiyac - sevk)
-            })
-        
-        if not sevkiyat_list:
+        # 8. SEVKİYAT DAĞIT (büyük ihtiyaç önce - yalnızca çekişmeli gruplar sıralanır)
+        ihtiyac_df = df[df['ihtiyac'] > 0]
+        if len(ihtiyac_df) == 0:
             return "ℹ️ Sevkiyat ihtiyacı bulunamadı. Tüm mağazaların stoku yeterli."
         
-        sonuc_df = pd.DataFrame(sevkiyat_list)
+        grup = depo_gorunum.konum(ihtiyac_df['depo_kod'], ihtiyac_df['urun_kod'])
+        ihtiyac = ihtiyac_df['ihtiyac'].to_numpy(dtype='float64')
+        sevk = depo_dagit(ihtiyac, grup, depo_gorunum.stok)
+        
+        sonuc_df = pd.DataFrame({
+            'magaza_kod': ihtiyac_df['magaza_kod'].to_numpy(),
+            'urun_kod': ihtiyac_df['urun_kod'].to_numpy(),
+            'depo_kod': ihtiyac_df['depo_kod'].to_numpy(),
+            'stok': ihtiyac_df['stok'].to_numpy().astype(int),
+            'yol': ihtiyac_df['yol'].to_numpy().astype(int),
+            'min': ihtiyac_df['min'].to_numpy().astype(int),
+            'haftalik_satis': ihtiyac_df['haftalik_satis'].round(1).to_numpy(),
+            'cover': ihtiyac_df['cover'].round(1).to_numpy(),
+            'hedef_stok': ihtiyac_df['hedef_stok'].to_numpy().astype(int),
+            'rpt_ihtiyac': ihtiyac_df['rpt_ihtiyac'].to_numpy().astype(int),
+            'ihtiyac': ihtiyac.astype(int),
+            'ihtiyac_turu': ihtiyac_df['ihtiyac_turu'].to_numpy(),
+            'sevkiyat': sevk.astype(int),
+            'karsilanamayan': (ihtiyac - sevk).astype(int)
+        })
         
         # 9. ÖZET OLUŞTUR
         toplam_ihtiyac = sonuc_df['ihtiyac'].sum()
@@ -3150,7 +4330,8 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
             filtre_text = f" ({kat_adi})"
         
         rapor.append(f"=== SEVKİYAT HESAPLAMA SONUCU{filtre_text} ===")
-        rapor.append(f"Forward Cover: {forward_cover} hafta\n")
+        rapor.append(f"Forward Cover: {forward_cover} hafta")
+        rapor.append(f"{_talep_aciklamasi(talep_bilgi)}\n")
         
         rapor.append("📊 ÖZET:")
         rapor.append(f"   Toplam İhtiyaç: {toplam_ihtiyac:,.0f} adet")
@@ -3204,7 +4385,7 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
             kars_df = sonuc_df[sonuc_df['karsilanamayan'] > 0]
             if urun_kod:
                 # Tek ürün - mağaza bazında göster
-                for _, row in kars_df.nlargest(10, 'karsilanamayan').iterrows():
+                for _, row in en_buyuk_n(kars_df, 10, 'karsilanamayan').iterrows():
                     rapor.append(f"   Mağaza {row['magaza_kod']}: {int(row['karsilanamayan']):,} adet eksik")
             else:
                 # Çoklu ürün - ürün bazında göster
@@ -3221,7 +4402,7 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
                 from datetime import datetime
                 
                 # Export için DataFrame hazırla
-                export_df = sonuc_df[['magaza_kod', 'urun_kod', 'depo_kod', 'stok', 'yol', 'min',
+                export_df = sonuc_df.sort_values('ihtiyac', ascending=False, kind='stable')[['magaza_kod', 'urun_kod', 'depo_kod', 'stok', 'yol', 'min',
                                       'haftalik_satis', 'cover', 'hedef_stok', 'rpt_ihtiyac', 
                                       'ihtiyac', 'ihtiyac_turu', 'sevkiyat', 'karsilanamayan']].copy()
                 
@@ -3256,11 +4437,656 @@ def sevkiyat_hesapla(kup: KupVeri, kategori_kod = None, urun_kod: str = None, ma
         return "\n".join(rapor)
         
     except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"❌ HATA: {e}")
-        print(error_detail[:500])
-        return f"❌ Sevkiyat hesaplama hatası: {str(e)}\n\nDetay:\n{error_detail[:300]}"
+        import traceback
+        error_detail = traceback.format_exc()
+        print(f"❌ HATA: {e}")
+        print(error_detail[:500])
+        return f"❌ Sevkiyat hesaplama hatası: {str(e)}\n\nDetay:\n{error_detail[:300]}"
+
+
+# =============================================================================
+# HAFTALIK GEÇMİŞ - hafta/hafta karşılaştırma
+# =============================================================================
+# Her küp yüklemesi gecmis_deposu.py ile haftanın Parquet bölümüne eklenir.
+# Araçlar eski Excel dosyalarını okumaz; yalnızca karşılaştırılan haftaların
+# bölümlerinden gereken kolonlar okunur.
+
+GECMIS_SEVIYELERI = {
+    # seviye: (geçmiş tablosu, grup kolonu, kolon başlığı, bölüm başlığı)
+    'kategori': ('stok_satis', 'kategori_kod', 'Kategori', 'KATEGORİ'),
+    'bolge': ('stok_satis', 'bolge', 'Bölge', 'BÖLGE'),
+    'magaza': ('stok_satis', 'magaza_kod', 'Mağaza', 'MAĞAZA'),
+    'urun': ('stok_satis', 'urun_kod', 'Ürün', 'ÜRÜN'),
+    'ana_grup': ('ana_grup', 'ana_grup', 'Ana Grup', 'ANA GRUP'),
+    'doluluk': ('magaza', 'magaza', 'Mağaza', 'MAĞAZA DOLULUK'),
+}
+GECMIS_OLCU_ADLARI = {'stok': 'Stok', 'satis': 'Satış', 'ciro': 'Ciro', 'cover': 'Cover(hf)', 'doluluk': 'Doluluk%'}
+
+
+def _gecmis_deposu_al(kup):
+    """Küpün haftalık geçmiş deposu (pyarrow yoksa None)"""
+    try:
+        from gecmis_deposu import gecmis_deposu, PYARROW_AVAILABLE as GECMIS_AVAILABLE
+    except ImportError:
+        return None
+    if not GECMIS_AVAILABLE or not getattr(kup, 'veri_klasoru', None):
+        return None
+    return gecmis_deposu(kup.veri_klasoru)
+
+
+def _hafta_cifti(haftalar: list, hafta: str = None, onceki_hafta: str = None):
+    """Karşılaştırılacak (önceki, son) haftalar - bulunamazsa (None, mesaj)"""
+    kayitli = ', '.join(haftalar[-8:])
+    for h in (hafta, onceki_hafta):
+        if h and h not in haftalar:
+            return None, f"❌ {h} haftası geçmişte yok. Kayıtlı haftalar: {kayitli}"
+    son = hafta or haftalar[-1]
+    oncekiler = [h for h in haftalar if h < son]
+    onceki = onceki_hafta or (oncekiler[-1] if oncekiler else None)
+    if onceki is None or onceki == son:
+        return None, (f"ℹ️ Karşılaştırma için en az iki hafta gerekli. Kayıtlı haftalar: {kayitli}. "
+                      f"Her hafta yeni veri yüklendiğinde geçmişe otomatik eklenir.")
+    return (onceki, son), None
+
+
+def _haftalik_olculer(depo, tablo: str, grup: str, olculer: list, onceki: str, son: str) -> pd.DataFrame:
+    """
+    Grup × ölçü toplamları: <ölçü> (son hafta) ve <ölçü>_onceki kolonları
+
+    grup None ise tek satırlık zincir toplamı döner. Toplamlar her hafta için
+    depoda (Arrow) hesaplanır; burada yalnızca iki hafta hizalanır.
+    """
+    boyutlar = [grup] if grup else []
+    son_t = depo.topla(tablo, son, boyutlar, olculer)
+    onceki_t = depo.topla(tablo, onceki, boyutlar, olculer)
+    if len(son_t) == 0 and len(onceki_t) == 0:
+        return pd.DataFrame()
+    olculer = [k for k in olculer if k in son_t.columns or k in onceki_t.columns]
+    sonuc = son_t.reindex(columns=olculer).join(
+        onceki_t.reindex(columns=olculer).add_suffix('_onceki'), how='outer'
+    ).fillna(0)
+    if grup is None:
+        sonuc.index = ['Toplam']
+    return sonuc[[k + ek for k in olculer for ek in ('', '_onceki')]]
+
+
+def _cover_ekle(tablo: pd.DataFrame):
+    """Cover (hafta) = stok / haftalık satış - iki hafta için (raporda cover varsa o kalır)"""
+    if 'cover' not in tablo.columns and {'stok', 'satis'}.issubset(tablo.columns):
+        for ek in ('', '_onceki'):
+            satis = tablo[f'satis{ek}']
+            tablo[f'cover{ek}'] = np.where(satis > 0, tablo[f'stok{ek}'] / satis.where(satis > 0, 1), np.nan)
+
+
+def _degisim_yuzde(yeni: float, eski: float) -> str:
+    if eski == 0:
+        return "yeni" if yeni else "-"
+    return f"{(yeni - eski) / abs(eski) * 100:+.1f}%"
+
+
+def _degisim_fark(yeni: float, eski: float, format_: str = "{:+.1f}") -> str:
+    if pd.isna(yeni) or pd.isna(eski):
+        return "-"
+    return format_.format(yeni - eski)
+
+
+def _deger(x: float, format_: str = "{:,.0f}") -> str:
+    return "-" if pd.isna(x) else format_.format(x)
+
+
+def _haftalik_satirlar(tablo: pd.DataFrame, orani_olanlar: tuple = ()) -> list:
+    """Tablo satırları: Grup | ölçü | Δ ... (toplam ölçülerde %, oranlarda fark)"""
+    satirlar = []
+    for grup, row in tablo.iterrows():
+        hucreler = [str(grup)[:28]]
+        for kolon in ('stok', 'satis', 'ciro'):
+            if kolon in tablo.columns:
+                hucreler += [_deger(row[kolon]), _degisim_yuzde(row[kolon], row[f'{kolon}_onceki'])]
+        for kolon in orani_olanlar:
+            if kolon in tablo.columns:
+                hucreler += [_deger(row[kolon], "{:.1f}"), _degisim_fark(row[kolon], row[f'{kolon}_onceki'])]
+        satirlar.append(hucreler)
+    return satirlar
+
+
+def _haftalik_kolonlar(tablo: pd.DataFrame, baslik: str, orani_olanlar: tuple = ()) -> list:
+    kolonlar = [baslik]
+    for kolon in ('stok', 'satis', 'ciro') + tuple(orani_olanlar):
+        if kolon in tablo.columns:
+            kolonlar += [GECMIS_OLCU_ADLARI[kolon], 'Δ']
+    return kolonlar
+
+
+def haftalik_karsilastir(kup: KupVeri, seviye: str = 'genel', hafta: str = None,
+                         onceki_hafta: str = None, limit: int = 15) -> Union[str, AracCiktisi]:
+    """
+    Hafta/hafta (WoW) karşılaştırma - stok, satış, cover, doluluk değişimleri
+
+    seviye: 'genel' (zincir toplamı + kategori/ana grup/doluluk hareketleri) veya
+            'kategori', 'bolge', 'magaza', 'urun', 'ana_grup', 'doluluk'
+    hafta / onceki_hafta: '2026-W42' biçiminde; verilmezse son iki kayıtlı hafta
+    """
+    depo = _gecmis_deposu_al(kup)
+    if depo is None:
+        return "❌ Haftalık geçmiş kullanılamıyor (pyarrow kurulu değil)."
+    haftalar = depo.haftalar()
+    if not haftalar:
+        return "ℹ️ Haftalık geçmiş henüz boş. Her hafta veri yüklendiğinde otomatik kaydedilir."
+    seviye = (seviye or 'genel').lower()
+    if seviye != 'genel' and seviye not in GECMIS_SEVIYELERI:
+        return f"❌ Geçersiz seviye: {seviye}. Seçenekler: genel, {', '.join(GECMIS_SEVIYELERI)}"
+    cift, hata = _hafta_cifti(haftalar, hafta, onceki_hafta)
+    if hata:
+        return hata
+    onceki, son = cift
+    limit = max(1, min(int(limit or 15), 100))
+
+    cikti = AracCiktisi()
+    sonuc = cikti.bolum(ONCELIK_KRITIK)
+    sonuc.append(f"📅 HAFTALIK KARŞILAŞTIRMA: {onceki} → {son}")
+    sonuc.append("=" * 50)
+
+    def hareketliler(tablo_adi: str, grup: str, olculer: list, sirala: str):
+        """Seviye tablosu - |Δ sirala| en büyük ilk `limit` grup"""
+        tablo = _haftalik_olculer(depo, tablo_adi, grup, olculer, onceki, son)
+        if len(tablo) == 0:
+            return tablo, 0
+        _cover_ekle(tablo)
+        if sirala not in tablo.columns:
+            sirala = next(k for k in olculer if k in tablo.columns)
+        tablo['_hareket'] = (tablo[sirala] - tablo[f'{sirala}_onceki']).abs()
+        return en_buyuk_n(tablo, limit, '_hareket'), len(tablo)
+
+    if seviye == 'genel':
+        zincir = _haftalik_olculer(depo, 'stok_satis', None, ['stok', 'satis', 'ciro'], onceki, son)
+        magazalar = _haftalik_olculer(depo, 'magaza', 'magaza', ['doluluk'], onceki, son)
+        if len(zincir) == 0 and len(magazalar) == 0:
+            return f"❌ {onceki} / {son} haftalarında karşılaştırılabilir veri yok."
+        satirlar = []
+        if len(zincir):
+            _cover_ekle(zincir)
+            row = zincir.iloc[0]
+            for kolon, ad in (('stok', 'Stok'), ('satis', 'Satış'), ('ciro', 'Ciro')):
+                if kolon in zincir.columns:
+                    satirlar.append([ad, _deger(row[f'{kolon}_onceki']), _deger(row[kolon]),
+                                     _degisim_yuzde(row[kolon], row[f'{kolon}_onceki'])])
+            if 'cover' in zincir.columns:
+                satirlar.append(['Cover (hf)', _deger(row['cover_onceki'], "{:.1f}"), _deger(row['cover'], "{:.1f}"),
+                                 _degisim_fark(row['cover'], row['cover_onceki'])])
+        if len(magazalar):
+            # Her iki haftada da raporlanan mağazaların ortalaması
+            ortak = magazalar[(magazalar['doluluk'] > 0) & (magazalar['doluluk_onceki'] > 0)]
+            if len(ortak):
+                satirlar.append([f'Ort. Doluluk % ({len(ortak)} mağaza)', _deger(ortak['doluluk_onceki'].mean(), "{:.1f}"),
+                                 _deger(ortak['doluluk'].mean(), "{:.1f}"),
+                                 _degisim_fark(ortak['doluluk'].mean(), ortak['doluluk_onceki'].mean())])
+        cikti.tablo(['Metrik', onceki, son, 'Değişim'], satirlar, oncelik=ONCELIK_KRITIK,
+                    baslik=["\n📊 ZİNCİR TOPLAMI"])
+
+        alt_seviyeler = [('kategori', 'satis', ONCELIK_YUKSEK), ('ana_grup', 'satis', ONCELIK_NORMAL),
+                         ('doluluk', 'doluluk', ONCELIK_NORMAL)]
+    else:
+        alt_seviyeler = [(seviye, 'doluluk' if seviye == 'doluluk' else 'satis', ONCELIK_YUKSEK)]
+
+    for ad, sirala, oncelik in alt_seviyeler:
+        tablo_adi, grup, baslik, bolum_basligi = GECMIS_SEVIYELERI[ad]
+        # Kapasite raporunda mağaza stoku adet olarak gösterilmez - doluluk yeterli
+        olculer = ['doluluk', 'cover', 'satis'] if tablo_adi == 'magaza' else ['stok', 'satis', 'ciro']
+        tablo, toplam = hareketliler(tablo_adi, grup, olculer, sirala)
+        if toplam == 0:
+            if seviye != 'genel':
+                return f"❌ {onceki} / {son} haftalarında '{ad}' için kayıt yok."
+            continue
+        oranlar = ('doluluk', 'cover') if tablo_adi == 'magaza' else ('cover',)
+        cikti.tablo(
+            _haftalik_kolonlar(tablo, baslik, oranlar), _haftalik_satirlar(tablo, oranlar), oncelik=oncelik,
+            baslik=[f"\n📈 {bolum_basligi} - EN ÇOK DEĞİŞEN {len(tablo)} / {toplam} (|Δ {GECMIS_OLCU_ADLARI[sirala]}| sıralı)"]
+        )
+
+    sonuc = cikti.bolum(ONCELIK_DUSUK)
+    sonuc.append(f"\nℹ️ Kayıtlı haftalar: {', '.join(haftalar[-8:])}. Δ: toplamlarda %, cover/doluluk için fark.")
+    return cikti
+
+
+# Trend ölçüleri: hesap için gereken toplam kolonları
+TREND_OLCULERI = {
+    'cover': ['stok', 'satis'],
+    'satis': ['satis'],
+    'stok': ['stok'],
+    'ciro': ['ciro'],
+    'sell_through': ['stok', 'satis'],
+    'doluluk': ['doluluk'],
+}
+TREND_OLCU_ADLARI = {'cover': 'Cover(hf)', 'satis': 'Satış', 'stok': 'Stok', 'ciro': 'Ciro',
+                     'sell_through': 'Sell-through%', 'doluluk': 'Doluluk%'}
+# Kaç hafta geriye bakılacağı sınırlı - geçmiş uzasa da okunan bölüm sayısı sabit
+TREND_MAKS_HAFTA = 26
+TREND_PENCERE = 3
+TREND_Z_ESIGI = 2.0
+SPARK_KARAKTERLERI = "▁▂▃▄▅▆▇█"
+
+
+def _trend_olcusu(toplamlar: Dict[str, pd.DataFrame], olcu: str) -> pd.DataFrame:
+    """Haftalık toplam matrislerinden (grup × hafta) ölçü matrisi"""
+    if olcu in toplamlar:
+        return toplamlar[olcu]
+    stok, satis = toplamlar['stok'], toplamlar['satis']
+    if olcu == 'cover':
+        return stok / satis.where(satis > 0)
+    # sell_through: haftanın satışının (satış + kalan stok) içindeki payı
+    return satis / (stok + satis).where(stok + satis > 0) * 100
+
+
+def _nan_ortalama(m: np.ndarray) -> np.ndarray:
+    """Satır ortalaması (NaN hariç, hiç değer yoksa NaN) - uyarısız"""
+    adet = (~np.isnan(m)).sum(axis=1)
+    toplam = np.nansum(m, axis=1)
+    return np.where(adet > 0, toplam / np.maximum(adet, 1), np.nan)
+
+
+def trend_istatistikleri(m: np.ndarray, pencere: int = TREND_PENCERE) -> Dict[str, np.ndarray]:
+    """
+    Grup × hafta matrisi için satır bazında vektörel trend ölçüleri
+
+    egim:     en küçük kareler eğimi (birim/hafta), eksik haftalar atlanır
+    son_ort:  son `pencere` haftanın ortalaması; onceki_ort: ondan önceki pencere
+    z:        son haftanın önceki haftalara (ortalaması gecmis_ort) göre z-skoru;
+              en az 3 önceki hafta gerekir
+    """
+    m = np.asarray(m, dtype='float64')
+    gecerli = ~np.isnan(m)
+    adet = gecerli.sum(axis=1)
+    t = np.arange(m.shape[1], dtype='float64')
+    t_ort = np.where(adet > 0, (gecerli * t).sum(axis=1) / np.maximum(adet, 1), 0)
+    x = np.where(gecerli, m, 0.0)
+    x_ort = np.where(adet > 0, x.sum(axis=1) / np.maximum(adet, 1), 0)
+    dt = np.where(gecerli, t - t_ort[:, None], 0.0)
+    payda = (dt ** 2).sum(axis=1)
+    egim = np.where(payda > 0, (dt * (x - x_ort[:, None])).sum(axis=1) / np.where(payda > 0, payda, 1), np.nan)
+
+    gecmis = m[:, :-1]
+    g_adet = (~np.isnan(gecmis)).sum(axis=1)
+    g_ort = _nan_ortalama(gecmis)
+    sapma = np.where(~np.isnan(gecmis), gecmis - g_ort[:, None], 0.0)
+    g_std = np.sqrt((sapma ** 2).sum(axis=1) / np.maximum(g_adet - 1, 1))
+    z = np.where((g_adet >= 3) & (g_std > 0) & ~np.isnan(m[:, -1]),
+                 (m[:, -1] - g_ort) / np.where(g_std > 0, g_std, 1), np.nan)
+    return {
+        'egim': egim,
+        'ortalama': np.where(adet > 0, x_ort, np.nan),
+        'son_ort': _nan_ortalama(m[:, -pencere:]),
+        'onceki_ort': _nan_ortalama(m[:, -2 * pencere:-pencere]) if m.shape[1] > pencere else np.full(len(m), np.nan),
+        'gecmis_ort': g_ort,
+        'z': z,
+    }
+
+
+def _spark(degerler) -> str:
+    """Haftalık seriyi tek satırlık mini grafiğe çevir (eksik hafta = ·)"""
+    seri = np.asarray(degerler, dtype='float64')
+    dolu = seri[~np.isnan(seri)]
+    if len(dolu) == 0:
+        return ""
+    alt, ust = dolu.min(), dolu.max()
+    # Ortalamanın %0.5'inden küçük oynamalar düz çizilir (gürültü trend gibi görünmesin)
+    if ust - alt <= abs(dolu.mean()) * 0.005:
+        return "".join("·" if np.isnan(v) else SPARK_KARAKTERLERI[3] for v in seri)
+    aralik = ust - alt
+    return "".join(
+        "·" if np.isnan(v) else SPARK_KARAKTERLERI[int((v - alt) / aralik * (len(SPARK_KARAKTERLERI) - 1))]
+        for v in seri
+    )
+
+
+def trend_analiz(kup: KupVeri, seviye: str = 'ana_grup', olcu: str = None,
+                 hafta_sayisi: int = 8, limit: int = 15) -> Union[str, AracCiktisi]:
+    """
+    Haftalık geçmişten trend analizi - eğim, hareketli ortalama, anomali
+
+    seviye: 'ana_grup', 'kategori', 'bolge', 'magaza', 'urun', 'doluluk'
+    olcu: 'cover', 'satis', 'stok', 'ciro', 'sell_through', 'doluluk'
+          (varsayılan: doluluk seviyesinde doluluk, diğerlerinde cover)
+    hafta_sayisi: geriye bakılacak kayıtlı hafta (en çok TREND_MAKS_HAFTA)
+    """
+    depo = _gecmis_deposu_al(kup)
+    if depo is None:
+        return "❌ Haftalık geçmiş kullanılamıyor (pyarrow kurulu değil)."
+    seviye = (seviye or 'ana_grup').lower()
+    if seviye not in GECMIS_SEVIYELERI:
+        return f"❌ Geçersiz seviye: {seviye}. Seçenekler: {', '.join(GECMIS_SEVIYELERI)}"
+    tablo_adi, grup, baslik, bolum_basligi = GECMIS_SEVIYELERI[seviye]
+    olcu = (olcu or ('doluluk' if tablo_adi == 'magaza' else 'cover')).lower()
+    if olcu not in TREND_OLCULERI:
+        return f"❌ Geçersiz ölçü: {olcu}. Seçenekler: {', '.join(TREND_OLCULERI)}"
+    # Kapasite raporunda cover hazır gelir; stok_satis/trading'de toplamlardan hesaplanır
+    gerekli = ['cover'] if (tablo_adi == 'magaza' and olcu == 'cover') else TREND_OLCULERI[olcu]
+
+    hafta_sayisi = max(3, min(int(hafta_sayisi or 8), TREND_MAKS_HAFTA))
+    haftalar = depo.haftalar()[-hafta_sayisi:]
+    if len(haftalar) < 3:
+        return (f"ℹ️ Trend için en az 3 kayıtlı hafta gerekli (şu an {len(haftalar)}). "
+                f"Her hafta veri yüklendiğinde geçmişe otomatik eklenir.")
+    limit = max(1, min(int(limit or 15), 100))
+
+    # Hafta başına grup toplamları (Arrow'da, önbellekli) → grup × hafta matrisleri.
+    # Bölümler paralel okunur (Arrow GIL'i bırakır) - soğuk okumada süre hafta sayısıyla büyümez
+    with ThreadPoolExecutor(max_workers=min(8, len(haftalar))) as havuz:
+        haftalik = dict(zip(haftalar, havuz.map(lambda h: depo.topla(tablo_adi, h, [grup], gerekli), haftalar)))
+    haftalik = {h: t for h, t in haftalik.items() if len(t) and set(gerekli).issubset(t.columns)}
+    if len(haftalik) < 3:
+        return f"❌ Son {len(haftalar)} haftada '{seviye}' için {TREND_OLCU_ADLARI[olcu]} verisi yeterli değil."
+    haftalar = list(haftalik)
+    toplamlar = {
+        k: pd.concat({h: t[k] for h, t in haftalik.items()}, axis=1).reindex(columns=haftalar)
+        for k in gerekli
+    }
+    matris = _trend_olcusu(toplamlar, olcu)
+    ist = trend_istatistikleri(matris.to_numpy())
+
+    # Zincir serisi: oranlarda toplamlardan, doluluk/kapasite cover'da mağaza ortalaması
+    if tablo_adi == 'magaza':
+        zincir = matris.mean(axis=0)
+    else:
+        zincir = _trend_olcusu({k: v.sum(axis=0, min_count=1).to_frame().T for k, v in toplamlar.items()}, olcu).iloc[0]
+    hareketli = zincir.rolling(TREND_PENCERE, min_periods=1).mean()
+
+    cikti = AracCiktisi()
+    sonuc = cikti.bolum(ONCELIK_KRITIK)
+    ad = TREND_OLCU_ADLARI[olcu]
+    sonuc.append(f"📉 TREND ANALİZİ: {bolum_basligi} × {ad} ({haftalar[0]} → {haftalar[-1]}, {len(haftalar)} hafta)")
+    sonuc.append("=" * 60)
+    bicim, egim_bicim = ("{:,.0f}", "{:+,.0f}") if olcu in ('satis', 'stok', 'ciro') else ("{:.1f}", "{:+.2f}")
+    zincir_egim = trend_istatistikleri(zincir.to_numpy()[None, :])['egim'][0]
+    sonuc.append(f"Zincir: {_spark(zincir.to_numpy())}  son {_deger(zincir.iloc[-1], bicim)}, "
+                 f"{TREND_PENCERE}hf ort {_deger(hareketli.iloc[-1], bicim)}, eğim {_deger(zincir_egim, egim_bicim)}/hf")
+    cikti.tablo(
+        ['Hafta', ad, f'{TREND_PENCERE}hf Ort.'],
+        [[h, _deger(zincir[h], bicim), _deger(hareketli[h], bicim)] for h in haftalar],
+        oncelik=ONCELIK_NORMAL, baslik=["\n📅 ZİNCİR SERİSİ"], min_satir=3
+    )
+
+    # Göreli eğim (%/hafta) gruplar arası karşılaştırılabilir sıralama için
+    ozet = pd.DataFrame({
+        'son': matris.iloc[:, -1].to_numpy(),
+        'son_ort': ist['son_ort'], 'onceki_ort': ist['onceki_ort'],
+        'egim': ist['egim'], 'z': ist['z'], 'gecmis_ort': ist['gecmis_ort'],
+        'egim_yuzde': ist['egim'] / np.abs(np.where(ist['ortalama'] != 0, ist['ortalama'], np.nan)) * 100,
+    }, index=matris.index)
+    ozet['_guc'] = ozet['egim_yuzde'].abs()
+    guclu = en_buyuk_n(ozet.dropna(subset=['_guc']), limit, '_guc')
+    satirlar = []
+    for grup_degeri, row in guclu.iterrows():
+        seri = matris.loc[grup_degeri].to_numpy()
+        anomali = f"⚠️ z={row['z']:+.1f}" if abs(row['z']) >= TREND_Z_ESIGI else ""
+        satirlar.append([str(grup_degeri)[:28], _deger(row['son'], bicim), _deger(row['son_ort'], bicim),
+                         _deger(row['onceki_ort'], bicim), _deger(row['egim'], egim_bicim),
+                         _deger(row['egim_yuzde'], '{:+.1f}%'), _spark(seri), anomali])
+    cikti.tablo(
+        [baslik, 'Son', f'Son {TREND_PENCERE}hf', f'Önceki {TREND_PENCERE}hf', 'Eğim/hf', 'Eğim%', 'Seri', 'Anomali'],
+        satirlar, oncelik=ONCELIK_YUKSEK,
+        baslik=[f"\n📈 EN GÜÇLÜ TRENDLER - {len(guclu)} / {len(ozet)} grup (|eğim %/hf| sıralı)"]
+    )
+
+    anomaliler = ozet[ozet['z'].abs() >= TREND_Z_ESIGI].copy()
+    if len(anomaliler):
+        anomaliler['_z'] = anomaliler['z'].abs()
+        secili = en_buyuk_n(anomaliler, limit, '_z')
+        cikti.tablo(
+            [baslik, 'Son', 'Geçmiş Ort.', 'z'],
+            [[str(g)[:28], _deger(r['son'], bicim), _deger(r['gecmis_ort'], bicim), f"{r['z']:+.1f}"]
+             for g, r in secili.iterrows()],
+            oncelik=ONCELIK_NORMAL,
+            baslik=[f"\n🚨 ANOMALİ - son hafta önceki haftalardan sapıyor (|z| ≥ {TREND_Z_ESIGI:g}): {len(anomaliler)} grup"]
+        )
+
+    sonuc = cikti.bolum(ONCELIK_DUSUK)
+    sonuc.append(f"\nℹ️ Eğim: haftalık doğrusal trend; Eğim%: ortalamaya göre. "
+                 f"Sell-through% = satış / (satış + stok). Seri: ▁ düşük … █ yüksek, · veri yok.")
+    return cikti
+
+
+# =============================================================================
+# TALEP TAHMİNİ - mağaza × ürün yumuşatılmış haftalık talep
+# =============================================================================
+# Tek haftanın satışı gürültülü; sevkiyatın hedef stoku (satış × forward cover)
+# bu tahminle hesaplanır. Geçmiş haftalar + güncel küp satışı mağaza × ürün ×
+# hafta matrisine dizilir, yumuşatma tüm serilerde aynı anda yapılır (döngü
+# yalnızca hafta sayısı kadar).
+
+TALEP_YONTEMLERI = ['ewma', 'ortalama', 'son_hafta']
+TALEP_ALFA = float(os.environ.get('SANAL_PLANNER_TALEP_ALFA', '0.4'))
+TALEP_HAFTA = 8
+
+
+def ewma_talep(m: np.ndarray, alfa: float = TALEP_ALFA) -> np.ndarray:
+    """
+    Satır bazında üstel yumuşatma (seri × hafta matrisi, son kolon en yeni hafta)
+
+    s_t = alfa × x_t + (1 - alfa) × s_(t-1); seri ilk kayıtlı haftadan başlar,
+    kaydı olmayan (NaN) haftalar seriyi değiştirmez. Hiç kaydı olmayan seri 0.
+    """
+    m = np.asarray(m, dtype='float64')
+    if m.shape[1] == 0:
+        return np.zeros(len(m))
+    s = m[:, 0].copy()
+    for j in range(1, m.shape[1]):
+        x = m[:, j]
+        s = np.where(np.isnan(s), x, np.where(np.isnan(x), s, alfa * x + (1 - alfa) * s))
+    return np.nan_to_num(s)
+
+
+def talep_tahmini(kup: KupVeri, yontem: str = 'ewma', alfa: float = TALEP_ALFA,
+                  hafta_sayisi: int = TALEP_HAFTA):
+    """
+    stok_satis satır sırasıyla hizalı haftalık talep tahmini -> (dizi, bilgi)
+
+    yontem: 'ewma' (üstel yumuşatma), 'ortalama' (hareketli ortalama),
+            'son_hafta' (küpteki satış, eski davranış)
+    hafta_sayisi: güncel hafta dahil bakılan hafta sayısı
+    Geçmiş yoksa ya da kullanılamıyorsa küpteki satış döner. Küpün kendi
+    yüklemesi geçmişte de kayıtlıysa o hafta ikinci kez sayılmaz.
+    Sonuç küp üzerinde veri versiyonu + geçmiş manifest'lerine göre önbelleklenir.
+    """
+    ss = kup.stok_satis
+    canli = pd.to_numeric(ss['satis'], errors='coerce').fillna(0).to_numpy(dtype='float64')
+    bilgi = {'yontem': 'son_hafta', 'hafta': 1, 'alfa': alfa}
+    depo = _gecmis_deposu_al(kup) if yontem != 'son_hafta' else None
+    if depo is None or not {'magaza_kod', 'urun_kod'}.issubset(ss.columns):
+        return canli, bilgi
+
+    versiyon = getattr(kup, 'veri_versiyonu', None)
+    gecmis_versiyonlari = {h: (depo.manifest(h) or {}).get('veri_versiyonu') for h in depo.haftalar()}
+    haftalar = [h for h, v in gecmis_versiyonlari.items() if versiyon is None or v != versiyon]
+    gecmis_hafta = max(int(hafta_sayisi), 1) - 1
+    haftalar = haftalar[-gecmis_hafta:] if gecmis_hafta else []
+    if not haftalar:
+        return canli, bilgi
+
+    anahtar = (versiyon, len(ss), yontem, alfa, tuple((h, gecmis_versiyonlari[h]) for h in haftalar))
+    onbellek = getattr(kup, '_talep_tahmini', None)
+    if onbellek is not None and onbellek[0] == anahtar:
+        return onbellek[1]
+
+    from gecmis_deposu import birlesik_anahtar
+    baslangic = time.time()
+    kodlar = [pd.to_numeric(ss[k], errors='coerce').fillna(0).to_numpy(dtype='int64') for k in ('magaza_kod', 'urun_kod')]
+    seri, tekil = pd.factorize(birlesik_anahtar(*kodlar))
+    m = depo.haftalik_matris('stok_satis', haftalar, ['magaza_kod', 'urun_kod'], 'satis', tekil)
+    canli_seri = np.bincount(seri, weights=canli, minlength=len(tekil))
+    m = np.column_stack([m, canli_seri])
+
+    if yontem == 'ortalama':
+        talep_seri = np.nan_to_num(_nan_ortalama(m))
+    else:
+        talep_seri = ewma_talep(m, alfa)
+
+    # Aynı mağaza × ürün birden çok satırdaysa tahmin satırlara satış payıyla bölünür
+    talep = talep_seri[seri]
+    if len(tekil) < len(seri):
+        adet = np.bincount(seri, minlength=len(tekil))[seri]
+        pay = np.where(canli_seri[seri] > 0, canli / np.where(canli_seri[seri] > 0, canli_seri[seri], 1), 1 / adet)
+        talep = talep * pay
+
+    bilgi = {'yontem': yontem, 'hafta': m.shape[1], 'alfa': alfa,
+             'gecmisli': int((~np.isnan(m[:, :-1])).any(axis=1).sum()), 'seri': len(tekil)}
+    print(f"   📈 Talep tahmini ({yontem}): {len(tekil):,} seri × {m.shape[1]} hafta, {time.time() - baslangic:.2f}s")
+    kup._talep_tahmini = (anahtar, (talep, bilgi))
+    return talep, bilgi
+
+
+def _talep_aciklamasi(bilgi: dict) -> str:
+    """Rapor satırı: ihtiyaçta kullanılan talep kaynağı"""
+    if bilgi is None or bilgi['yontem'] == 'son_hafta':
+        return "Talep: son hafta satışı"
+    yontem = f"EWMA (α={bilgi['alfa']:g})" if bilgi['yontem'] == 'ewma' else "hareketli ortalama"
+    return (f"Talep: {yontem}, {bilgi['hafta']} hafta "
+            f"({bilgi['gecmisli']:,}/{bilgi['seri']:,} mağaza×ürün geçmişli)")
+
+
+# =============================================================================
+# SQL SORGU - küp tabloları üzerinde salt-okunur DuckDB sorgusu
+# =============================================================================
+# Sabit araçların karşılamadığı sorular için agent doğrudan SQL yazar.
+# Her çağrıda ayrı in-memory bağlantı açılır; yalnızca sorguda geçen küp
+# tabloları register edilir (DataFrame'ler kopyalanmadan taranır, tembel
+# gruplar gereksiz yere yüklenmez). Dosya/ağ erişimi kapalı ve ayar kilitli,
+# yalnızca tek bir SELECT / WITH sorgusu kabul edilir.
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+SQL_TABLOLARI = {
+    'stok_satis': "Mağaza × ürün stok/satış (master + KPI kolonları, stok_durum, cover dahil)",
+    'urun_master': "Ürün master",
+    'magaza_master': "Mağaza master",
+    'depo_stok': "Depo × ürün stok",
+    'kpi': "MG bazlı min/max/forward cover",
+    'trading': "Trading raporu (CUBE)",
+    'kapasite': "Mağaza kapasite / doluluk",
+    'siparis_takip': "Sipariş takip",
+    'cover_diagram': "Alt grup × mağaza cover",
+}
+SQL_SATIR_LIMITI = 100
+SQL_MAKS_SATIR = 500
+SQL_SURE_LIMITI = float(os.environ.get("SANAL_PLANNER_SQL_SURE", "15"))
+SQL_BELLEK_LIMITI = os.environ.get("SANAL_PLANNER_SQL_BELLEK", "2GB")
+
+
+def _sql_tablo_grubu(ad: str) -> str:
+    return vars(KupVeri)[ad].grup
+
+
+def _sql_sema(kup: KupVeri) -> str:
+    """Sorgulanabilir tablolar; yüklü gruplar için kolonlar da listelenir"""
+    satirlar = ["📋 SORGULANABİLİR TABLOLAR"]
+    for ad, aciklama in SQL_TABLOLARI.items():
+        if not kup.yuklu_mu(_sql_tablo_grubu(ad)):
+            satirlar.append(f"\n• {ad} - {aciklama} (ilk sorguda yüklenir)")
+            continue
+        df = getattr(kup, ad)
+        if len(df) == 0:
+            continue
+        satirlar.append(f"\n• {ad} - {aciklama} ({len(df):,} satır)")
+        satirlar.append("  " + ", ".join(f'"{k}" {df[k].dtype}' for k in df.columns[:60]))
+    return "\n".join(satirlar)
+
+
+def _sql_dogrula(sorgu: str) -> Optional[str]:
+    """Sorgu tek bir SELECT / WITH ise None, değilse hata mesajı"""
+    try:
+        ifadeler = duckdb.extract_statements(sorgu)
+    except Exception as e:
+        return f"❌ SQL sözdizimi hatası: {e}"
+    if len(ifadeler) != 1:
+        return "❌ Tek seferde yalnızca bir sorgu çalıştırılabilir."
+    ilk_kelime = sorgu.lstrip(" \t\n(").split(None, 1)[0].lower() if sorgu.strip() else ""
+    if ifadeler[0].type != duckdb.StatementType.SELECT or ilk_kelime not in ('select', 'with'):
+        return "❌ Yalnızca SELECT / WITH sorguları çalıştırılabilir (salt-okunur)."
+    return None
+
+
+def _sql_hucre(deger) -> str:
+    if deger is None or (isinstance(deger, float) and np.isnan(deger)):
+        return ""
+    if isinstance(deger, (float, np.floating)):
+        return f"{deger:,.0f}" if float(deger).is_integer() else f"{deger:,.2f}"
+    return str(deger)
+
+
+def sql_sorgu(kup: KupVeri, sorgu: str, limit: int = SQL_SATIR_LIMITI) -> Union[str, AracCiktisi]:
+    """
+    Küp tabloları üzerinde salt-okunur SQL (DuckDB)
+
+    sorgu boşsa tablo/kolon şeması döner. Sonuç en fazla `limit` satır,
+    sorgu SQL_SURE_LIMITI saniyede kesilir.
+    """
+    if not DUCKDB_AVAILABLE:
+        return "❌ SQL motoru yüklü değil (pip install duckdb)."
+
+    sorgu = (sorgu or "").strip().rstrip(';').strip()
+    if not sorgu:
+        return _sql_sema(kup)
+
+    hata = _sql_dogrula(sorgu)
+    if hata:
+        return hata
+
+    limit = max(1, min(int(limit or SQL_SATIR_LIMITI), SQL_MAKS_SATIR))
+    tablolar = [ad for ad in SQL_TABLOLARI if re.search(rf'\b{ad}\b', sorgu, re.IGNORECASE)]
+    if not tablolar:
+        return f"❌ Sorguda küp tablosu yok. Kullanılabilir tablolar: {', '.join(SQL_TABLOLARI)}"
+
+    baglanti = duckdb.connect(':memory:', config={
+        'enable_external_access': False,
+        'autoload_known_extensions': False,
+        'memory_limit': SQL_BELLEK_LIMITI,
+        'lock_configuration': True,
+    })
+    zamanlayici = threading.Timer(SQL_SURE_LIMITI, baglanti.interrupt)
+    zamanlayici.daemon = True
+    baslangic = time.perf_counter()
+    try:
+        for ad in tablolar:
+            df = getattr(kup, ad)
+            if len(df.columns) == 0:
+                return f"❌ '{ad}' tablosu yüklenmemiş."
+            baglanti.register(ad, df)
+
+        zamanlayici.start()
+        sonuc_df = baglanti.sql(sorgu).limit(limit + 1).df()
+    except duckdb.InterruptException:
+        return f"❌ Sorgu {SQL_SURE_LIMITI:.0f} saniyede tamamlanamadı ve durduruldu. Daha dar bir sorgu deneyin."
+    except duckdb.Error as e:
+        # Kolon adı hatalarında agent düzeltebilsin diye ilgili tabloların kolonları eklenir
+        kolonlar = "\n".join(
+            f"• {ad}: " + ", ".join(f'"{k}"' for k in getattr(kup, ad).columns[:60]) for ad in tablolar
+        )
+        return f"❌ SQL hatası: {str(e).splitlines()[0]}\n\nKolonlar:\n{kolonlar}"
+    finally:
+        zamanlayici.cancel()
+        baglanti.close()
+    sure_ms = (time.perf_counter() - baslangic) * 1000
+
+    kesildi = len(sonuc_df) > limit
+    sonuc_df = sonuc_df.head(limit)
+
+    cikti = AracCiktisi()
+    ozet = cikti.bolum(ONCELIK_KRITIK)
+    ozet.append(f"🧮 SQL SONUCU ({', '.join(tablolar)}) - {len(sonuc_df):,} satır{'+' if kesildi else ''}, {sure_ms:.0f} ms")
+    if len(sonuc_df) == 0:
+        ozet.append("Sorgu sonuç döndürmedi.")
+        return cikti
+    cikti.tablo(
+        [str(k) for k in sonuc_df.columns],
+        [[_sql_hucre(v) for v in satir] for satir in sonuc_df.itertuples(index=False, name=None)]
+    )
+    if kesildi:
+        cikti.bolum(ONCELIK_DUSUK).append(
+            f"⚠️ Sonuç {limit} satırla sınırlandı - GROUP BY / ORDER BY ... LIMIT ile daraltın."
+        )
+    return cikti
 
 
 # =============================================================================
@@ -3492,6 +5318,91 @@ TOOLS = [
                     "type": "boolean",
                     "description": "Excel dosyası oluşturmak için true yap. Mağaza, stok, yol, sevk adet gibi kolonları içeren detaylı Excel çıktısı alırsın.",
                     "default": False
+                },
+                "talep_yontemi": {
+                    "type": "string",
+                    "enum": ["ewma", "ortalama", "son_hafta"],
+                    "description": "Hedef stokta kullanılan haftalık talep. ewma: haftalık geçmişten üstel yumuşatılmış (varsayılan), ortalama: son haftaların ortalaması, son_hafta: yalnızca bu haftanın satışı",
+                    "default": "ewma"
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "haftalik_karsilastir",
+        "description": "Geçen haftaya göre (WoW) karşılaştırma. Her hafta yüklenen küp geçmişe kaydedilir; bu araç iki haftanın stok, satış, ciro, cover ve mağaza doluluk değişimlerini verir. 'genel' zincir toplamı + en çok değişen kategori/ana grup/mağaza doluluklarını gösterir.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "seviye": {
+                    "type": "string",
+                    "enum": ["genel", "kategori", "bolge", "magaza", "urun", "ana_grup", "doluluk"],
+                    "description": "Kırılım. doluluk = kapasite raporundan mağaza doluluğu. Varsayılan: genel",
+                    "default": "genel"
+                },
+                "hafta": {
+                    "type": "string",
+                    "description": "Son hafta (ISO, örn. '2026-W42'). Boşsa en son kayıtlı hafta"
+                },
+                "onceki_hafta": {
+                    "type": "string",
+                    "description": "Kıyas haftası. Boşsa son haftadan bir önceki kayıtlı hafta"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Kırılım tablosunda gösterilecek en çok değişen grup sayısı (varsayılan 15)",
+                    "default": 15
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "trend_analiz",
+        "description": "Haftalık geçmişten trend analizi: ana grup cover gidişatı, mağaza doluluk trendi, satış/sell-through hızı. Grup başına son değer, hareketli ortalama, haftalık eğim, mini seri ve anomali (son hafta önceki haftalardan sapıyor) döner. En az 3 kayıtlı hafta gerekir.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "seviye": {
+                    "type": "string",
+                    "enum": ["ana_grup", "kategori", "bolge", "magaza", "urun", "doluluk"],
+                    "description": "Kırılım. doluluk = kapasite raporundan mağaza bazında. Varsayılan: ana_grup",
+                    "default": "ana_grup"
+                },
+                "olcu": {
+                    "type": "string",
+                    "enum": ["cover", "satis", "stok", "ciro", "sell_through", "doluluk"],
+                    "description": "Trend ölçüsü. Varsayılan: doluluk seviyesinde doluluk, diğerlerinde cover"
+                },
+                "hafta_sayisi": {
+                    "type": "integer",
+                    "description": "Geriye bakılacak hafta sayısı (3-26, varsayılan 8)",
+                    "default": 8
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Gösterilecek en güçlü trend sayısı (varsayılan 15)",
+                    "default": 15
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "sql_sorgu",
+        "description": "Küp tabloları üzerinde salt-okunur SQL (DuckDB) çalıştırır. Sabit araçların karşılamadığı özel kırılım, filtre, sıralama ve karşılaştırmalar için kullan. Tablolar: stok_satis, urun_master, magaza_master, depo_stok, kpi, trading, kapasite, siparis_takip, cover_diagram. Yalnızca tek SELECT / WITH sorgusu. Kolon adlarını bilmiyorsan sorgu'yu boş gönder, şema döner. Boşluk içeren kolonları çift tırnakla yaz (\"TY Sales Value TRY\").",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "sorgu": {
+                    "type": "string",
+                    "description": "SQL sorgusu. Örn: SELECT bolge, stok_durum, COUNT(*) AS satir, SUM(stok) AS stok FROM stok_satis GROUP BY ALL ORDER BY stok DESC"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "En fazla dönecek satır (varsayılan 100, üst sınır 500)",
+                    "default": 100
                 }
             },
             "required": []
@@ -3499,6 +5410,14 @@ TOOLS = [
     }
 ]
 
+# Prompt caching: SYSTEM_PROMPT ve TOOLS her iterasyonda birebir aynı gönderilir.
+# Son tool tanımına cache_control koymak tools prefix'ini, sistem prompt bloğuna
+# koymak ise tools + system prefix'ini önbelleğe alır. Değişken kısımlar
+# (analiz_kurallari eki) breakpoint'in SONRASINA eklenir ki cache hit bozulmasın.
+ONBELLEK_KONTROL = {"type": "ephemeral"}
+
+TOOLS_ONBELLEKLI = TOOLS[:-1] + [{**TOOLS[-1], "cache_control": ONBELLEK_KONTROL}]
+
 SYSTEM_PROMPT = """Sen deneyimli bir Retail Planner'sın. Adın "Sanal Planner". 
 
 ## 🎯 KİMLİĞİN
@@ -3675,6 +5594,23 @@ cover_diagram_analiz() sonucundan en yüksek cover'lı 5-10 alt grubu tablo hali
 3. cover_diagram_analiz() → Alt grup + mağaza cover detayı (veri varsa)
 4. siparis_takip_analiz() → Tedarik durumu (veri varsa)
 
+## 📅 HAFTALIK KARŞILAŞTIRMA (haftalik_karsilastir)
+
+Her hafta yüklenen veri geçmişe kaydedilir. "Geçen haftaya göre", "bu hafta ne değişti", "WoW" sorularında haftalik_karsilastir() çağır:
+- Genel analizde trend yorumu için seviye='genel' ile bir kez çağır
+- Belirli kırılım için seviye: kategori, bolge, magaza, urun, ana_grup, doluluk
+- Geçmişte tek hafta varsa kıyas yapma, bundan bahsetme
+- Birkaç haftalık gidişat ("trend", "son haftalarda", "giderek") için trend_analiz() çağır: ana grup cover → seviye='ana_grup', mağaza doluluk → seviye='doluluk', satış hızı → olcu='sell_through'
+- Anomali işaretli grupları ayrıca vurgula
+- sevkiyat_hesapla hedef stoku geçmişten yumuşatılmış talebe (EWMA) göre kurar; kullanıcı "sadece bu haftanın satışına göre" derse talep_yontemi='son_hafta' ver
+
+## 🧮 SERBEST SORGU (sql_sorgu)
+
+Sabit araçların karşılamadığı sorularda (özel kırılım, filtre, sıralama, karşılaştırma) birkaç ağır aracı zincirleyip tahmin yürütme - sql_sorgu ile tek bir SELECT yaz:
+- Kolon adlarından emin değilsen önce sorgu'yu boş gönder, şema döner
+- Boşluk / büyük harf içeren kolonları çift tırnakla yaz: "TY Sales Value TRY"
+- Sonucu GROUP BY ve ORDER BY ... LIMIT ile özetle, ham satır listeleme
+
 ## 🏪 KAPASİTE ANALİZİ ÖZEL TALİMAT
 
 Kullanıcı "kapasite analizi yap", "kapasite", "mağaza doluluk", "mağaza kapasite" dediğinde:
@@ -3758,7 +5694,7 @@ VM önerilerini stok/fiyat aksiyonlarıyla birlikte kullan, tek başına yeterli
 ## 🧠 ÖĞRENME KURALI
 - Kullanıcının önceki analizlerde özellikle sorduğu grupları hatırla
 - Aynı grup tekrar sorunluysa bunu vurgula
-- "Geçen haftaya göre" kıyas yap
+- "Geçen haftaya göre" kıyas yap (haftalik_karsilastir)
 
 ## 📋 KOLON İSİMLERİ REHBERİ
 
@@ -3790,224 +5726,699 @@ VM önerilerini stok/fiyat aksiyonlarıyla birlikte kullan, tek başına yeterli
 Her zaman Türkçe, detaylı ve stratejik ol!"""
 
 
-def agent_calistir(api_key: str, kup: KupVeri, kullanici_mesaji: str, analiz_kurallari: dict = None) -> str:
-    """Agent'ı çalıştır ve sonuç al
+# =============================================================================
+# TELEMETRİ
+# =============================================================================
+
+# Her olay bir JSON satırı olarak bu dosyaya eklenir (env ile değiştirilebilir)
+TELEMETRI_DOSYASI = os.environ.get(
+    "SANAL_PLANNER_TELEMETRI",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "agent_telemetri.jsonl")
+)
+
+# Admin paneli için süreç içi son olaylar
+TELEMETRI_KAYITLARI = deque(maxlen=2000)
+_TELEMETRI_KILIDI = threading.Lock()
+
+
+def telemetri_yaz(kayit: dict):
+    """Olayı belleğe ve JSON lines dosyasına yaz (yazma hatası agent'ı durdurmaz)"""
+    with _TELEMETRI_KILIDI:
+        TELEMETRI_KAYITLARI.append(kayit)
+        if not TELEMETRI_DOSYASI:
+            return
+        try:
+            os.makedirs(os.path.dirname(TELEMETRI_DOSYASI), exist_ok=True)
+            with open(TELEMETRI_DOSYASI, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(kayit, ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            print(f"   ⚠️ Telemetri yazılamadı: {e}")
+
+
+class AgentTelemetri:
+    """
+    Tek bir agent isteğinin ölçümleri
     
-    analiz_kurallari: Kullanıcının tanımladığı eşikler ve yorumlar
+    Olay tipleri:
+    - api:   iterasyon, sure_ms, input/output/cache token, stop_reason, tool_sayisi
+    - arac:  iterasyon, arac, sure_ms, ham/gönderilen karakter, token,
+             sikistirildi, hafizadan, zaman_asimi, hata
+    - istek: toplam süre, iterasyon sayısı, token toplamları, durum
+    """
+    
+    def __init__(self, kullanici_mesaji: str):
+        self.istek_id = uuid.uuid4().hex[:12]
+        self.soru = kullanici_mesaji[:120]
+        self.baslangic = time.perf_counter()
+    
+    def kaydet(self, olay: str, **alanlar):
+        telemetri_yaz({
+            'zaman': datetime.now().isoformat(timespec='seconds'),
+            'istek_id': self.istek_id,
+            'olay': olay,
+            **alanlar
+        })
+    
+    def bitir(self, durum: str, iterasyon: int, token_toplam: dict):
+        self.kaydet(
+            'istek',
+            soru=self.soru,
+            durum=durum,
+            iterasyon=iterasyon,
+            sure_ms=round((time.perf_counter() - self.baslangic) * 1000),
+            **token_toplam
+        )
+
+
+def telemetri_tablolari() -> Dict[str, pd.DataFrame]:
+    """Son olayları admin paneli için olay tipine göre DataFrame'lere ayır"""
+    with _TELEMETRI_KILIDI:
+        kayitlar = list(TELEMETRI_KAYITLARI)
+    df = pd.DataFrame(kayitlar)
+    if len(df) == 0:
+        return {'istek': df, 'api': df, 'arac': df}
+    return {
+        olay: df[df['olay'] == olay].dropna(axis=1, how='all').drop(columns=['olay'])
+        for olay in ('istek', 'api', 'arac')
+    }
+
+
+# =============================================================================
+# KONUŞMA HAFIZASI
+# =============================================================================
+
+class KonusmaHafizasi:
+    """
+    Oturum bazlı konuşma hafızası
+    
+    - Son TAM_TUR_SAYISI tur (soru, tool çağrıları, tool sonuçları, cevap)
+      mesaj olarak birebir saklanır ve sonraki soruya eklenir.
+    - Daha eski turlar kompakt özete indirilir (soru + çağrılan araçlar +
+      cevap başı) ve sistem promptunun sonuna eklenir.
+    - Aynı araç aynı parametrelerle tekrar çağrılırsa sonuç yeniden
+      hesaplanmadan hafızadan döner ("detaya in" gibi takip soruları için).
+    
+    Streamlit'te st.session_state içinde tutulur; veri yeniden yüklenince
+    araç sonuçları geçersiz sayılır.
+    """
+    
+    TAM_TUR_SAYISI = 2
+    OZET_TUR_SAYISI = 8
+    CEVAP_OZET_KARAKTER = 600
+    ARAC_ONBELLEK_LIMITI = 40
+    
+    # Yan etkisi olan / zamana bağlı araçlar önbelleklenmez
+    ONBELLEKLENMEZ_ARACLAR = {"web_arama"}
+    
+    def __init__(self):
+        self.turlar = []          # [{'soru', 'mesajlar', 'cevap', 'araclar'}]
+        self.ozetler = []         # Eski turların kompakt özetleri
+        self.arac_sonuclari = {}  # (araç, json girdi) -> sıkıştırılmış sonuç
+        self.veri_kimligi = None
+    
+    def temizle(self):
+        self.turlar = []
+        self.ozetler = []
+        self.arac_sonuclari = {}
+    
+    def veri_kontrol(self, kup: KupVeri):
+        """Veri versiyonu değiştiyse eski araç sonuçlarını at"""
+        kimlik = getattr(kup, 'veri_versiyonu', None) or id(kup)
+        if self.veri_kimligi != kimlik:
+            if self.arac_sonuclari:
+                print(f"   🧠 Veri değişti - {len(self.arac_sonuclari)} araç sonucu hafızadan silindi")
+            self.arac_sonuclari = {}
+            self.veri_kimligi = kimlik
+    
+    @staticmethod
+    def _anahtar(tool_name: str, tool_input: dict) -> tuple:
+        return (tool_name, json.dumps(tool_input or {}, sort_keys=True, ensure_ascii=False, default=str))
+    
+    def arac_sonucu(self, tool_name: str, tool_input: dict) -> Optional[str]:
+        return self.arac_sonuclari.get(self._anahtar(tool_name, tool_input))
+    
+    def arac_sonucu_kaydet(self, tool_name: str, tool_input: dict, sonuc: str):
+        if tool_name in self.ONBELLEKLENMEZ_ARACLAR or (tool_input or {}).get('export_excel'):
+            return
+        if sonuc.startswith("❌") or sonuc.startswith("Hata:"):
+            return
+        anahtar = self._anahtar(tool_name, tool_input)
+        self.arac_sonuclari.pop(anahtar, None)
+        self.arac_sonuclari[anahtar] = sonuc
+        # En eski kayıtları at (dict ekleme sırasını korur)
+        while len(self.arac_sonuclari) > self.ARAC_ONBELLEK_LIMITI:
+            self.arac_sonuclari.pop(next(iter(self.arac_sonuclari)))
+    
+    def gecmis_mesajlar(self) -> list:
+        """Birebir saklanan son turların mesajları (API formatında)"""
+        mesajlar = []
+        for tur in self.turlar:
+            mesajlar.extend(tur['mesajlar'])
+        return mesajlar
+    
+    def ozet_metni(self) -> str:
+        """Eski turların özeti - sistem promptuna eklenir"""
+        if not self.ozetler:
+            return ""
+        metin = "\n\n## 🧠 ÖNCEKİ KONUŞMA ÖZETİ (eski sorular)\n"
+        metin += "Aşağıdaki araç sonuçları hafızada; aynı parametrelerle tekrar çağırmak anında döner.\n"
+        for i, ozet in enumerate(self.ozetler, 1):
+            metin += f"\n{i}. {ozet}\n"
+        return metin
+    
+    def tur_ekle(self, soru: str, mesajlar: list, cevap: str, araclar: list):
+        """
+        Tamamlanan turu kaydet
+        
+        mesajlar: Bu turda soru sonrası eklenen assistant/tool_result mesajları
+        araclar: [(tool_name, tool_input), ...]
+        """
+        tur_mesajlari = [{"role": "user", "content": soru}] + list(mesajlar)
+        # İptal edilen turda sonucu gelmemiş tool_use bırakılmaz (API tool_result bekler)
+        son = tur_mesajlari[-1]
+        if son["role"] == "assistant" and isinstance(son["content"], list) and \
+                any(b.get("type") == "tool_use" for b in son["content"]):
+            tur_mesajlari.pop()
+        # Tur her zaman assistant metniyle bitmeli (sonraki soru user olarak eklenecek)
+        if tur_mesajlari[-1]["role"] != "assistant":
+            tur_mesajlari.append({"role": "assistant", "content": cevap.strip() or "(yanıt yarım kaldı)"})
+        
+        self.turlar.append({'soru': soru, 'mesajlar': tur_mesajlari, 'cevap': cevap, 'araclar': araclar})
+        
+        while len(self.turlar) > self.TAM_TUR_SAYISI:
+            self.ozetler.append(self._ozetle(self.turlar.pop(0)))
+        self.ozetler = self.ozetler[-self.OZET_TUR_SAYISI:]
+    
+    def _ozetle(self, tur: dict) -> str:
+        araclar = []
+        for ad, girdi in tur['araclar']:
+            parametreler = ", ".join(f"{k}={v}" for k, v in (girdi or {}).items())
+            araclar.append(f"{ad}({parametreler})")
+        cevap = " ".join(tur['cevap'].split())
+        if len(cevap) > self.CEVAP_OZET_KARAKTER:
+            cevap = cevap[:self.CEVAP_OZET_KARAKTER] + "..."
+        ozet = f"Soru: {tur['soru'][:200]}"
+        if araclar:
+            ozet += f"\n   Araçlar: {', '.join(araclar)}"
+        ozet += f"\n   Cevap özeti: {cevap}"
+        return ozet
+
+
+def _blok_sozluk(block) -> dict:
+    """API yanıt bloğunu hafızada saklanabilir sade sözlüğe çevir"""
+    if block.type == "text":
+        return {"type": "text", "text": block.text}
+    if block.type == "tool_use":
+        return {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+    return block.model_dump()
+
+
+def arac_calistir(kup: KupVeri, tool_name: str, tool_input: dict) -> Union[str, AracCiktisi]:
+    """Tool adını ilgili araç fonksiyonuna yönlendir (ham sonuç, sıkıştırılmamış)"""
+    if tool_name == "web_arama":
+        return web_arama(tool_input.get("sorgu", "Türkiye enflasyon"))
+    elif tool_name == "genel_ozet":
+        return genel_ozet(kup)
+    elif tool_name == "trading_analiz":
+        return trading_analiz(
+            kup,
+            ana_grup=tool_input.get("ana_grup", None),
+            ara_grup=tool_input.get("ara_grup", None)
+        )
+    elif tool_name == "cover_analiz":
+        return cover_analiz(kup, tool_input.get("sayfa", None))
+    elif tool_name == "cover_diagram_analiz":
+        return cover_diagram_analiz(
+            kup,
+            alt_grup=tool_input.get("alt_grup", None),
+            magaza=tool_input.get("magaza", None)
+        )
+    elif tool_name == "kapasite_analiz":
+        return kapasite_analiz(
+            kup,
+            magaza=tool_input.get("magaza", None)
+        )
+    elif tool_name == "siparis_takip_analiz":
+        return siparis_takip_analiz(
+            kup,
+            ana_grup=tool_input.get("ana_grup", None)
+        )
+    elif tool_name == "ihtiyac_hesapla":
+        return ihtiyac_hesapla(kup, tool_input.get("limit", 30))
+    elif tool_name == "kategori_analiz":
+        return kategori_analiz(kup, tool_input.get("kategori_kod", ""))
+    elif tool_name == "magaza_analiz":
+        return magaza_analiz(kup, tool_input.get("magaza_kod", ""))
+    elif tool_name == "urun_analiz":
+        return urun_analiz(kup, tool_input.get("urun_kod", ""))
+    elif tool_name == "sevkiyat_plani":
+        return sevkiyat_plani(kup, tool_input.get("limit", 30))
+    elif tool_name == "fazla_stok_analiz":
+        return fazla_stok_analiz(kup, tool_input.get("limit", 30))
+    elif tool_name == "bolge_karsilastir":
+        return bolge_karsilastir(kup)
+    elif tool_name == "sevkiyat_hesapla":
+        return sevkiyat_hesapla(
+            kup,
+            kategori_kod=tool_input.get("kategori_kod", None),
+            urun_kod=tool_input.get("urun_kod", None),
+            marka_kod=tool_input.get("marka_kod", None),
+            forward_cover=tool_input.get("forward_cover", 7.0),
+            export_excel=tool_input.get("export_excel", False),
+            talep_yontemi=tool_input.get("talep_yontemi", "ewma")
+        )
+    elif tool_name == "haftalik_karsilastir":
+        return haftalik_karsilastir(
+            kup,
+            seviye=tool_input.get("seviye", "genel"),
+            hafta=tool_input.get("hafta", None),
+            onceki_hafta=tool_input.get("onceki_hafta", None),
+            limit=tool_input.get("limit", 15)
+        )
+    elif tool_name == "trend_analiz":
+        return trend_analiz(
+            kup,
+            seviye=tool_input.get("seviye", "ana_grup"),
+            olcu=tool_input.get("olcu", None),
+            hafta_sayisi=tool_input.get("hafta_sayisi", 8),
+            limit=tool_input.get("limit", 15)
+        )
+    elif tool_name == "sql_sorgu":
+        return sql_sorgu(kup, tool_input.get("sorgu", ""), tool_input.get("limit", SQL_SATIR_LIMITI))
+    else:
+        return f"Bilinmeyen araç: {tool_name}"
+
+
+def _kural_eki_olustur(analiz_kurallari: dict) -> str:
+    """Kullanıcı analiz kurallarından sistem promptu eki oluştur
+    
+    SYSTEM_PROMPT'a dokunmadan ayrı (cache'lenmeyen) blok olarak gönderilir.
     """
+    if not analiz_kurallari:
+        return ""
+    
+    kural_eki = "\n\n## 📋 KULLANICI TANIMI ANALİZ KURALLARI\n"
+    
+    # Analiz sırası
+    if analiz_kurallari.get('analiz_sirasi'):
+        kural_eki += f"\n### Analiz Sırası:\n"
+        for i, analiz in enumerate(analiz_kurallari['analiz_sirasi'], 1):
+            kural_eki += f"{i}. {analiz}\n"
+    
+    # Eşikler
+    esikler = analiz_kurallari.get('esikler', {})
+    if esikler:
+        kural_eki += f"\n### Kritik Eşikler (Bu değerleri kullan!):\n"
+        kural_eki += f"- Cover > {esikler.get('cover_yuksek', 12)} hafta → 🔴 YÜKSEK COVER, stok eritme gerekli\n"
+        kural_eki += f"- Cover < {esikler.get('cover_dusuk', 4)} hafta → 🔴 DÜŞÜK COVER, sevkiyat gerekli\n"
+        kural_eki += f"- Bütçe sapması > %{esikler.get('butce_sapma', 15)} → 🔴 KRİTİK bütçe altında\n"
+        kural_eki += f"- LFL düşüş > %{esikler.get('lfl_dusus', 20)} → 🔴 CİDDİ küçülme\n"
+        kural_eki += f"- Marj düşüşü > {esikler.get('marj_dusus', 3)} puan → 🔴 MARJ baskısı\n"
+        kural_eki += f"- Stok/Ciro oranı > {esikler.get('stok_fazla', 1.3)} → ⚠️ Stok fazlası, ERİTME gerekli\n"
+        kural_eki += f"- Stok/Ciro oranı < {esikler.get('stok_az', 0.7)} → ⚠️ Stok az, SEVKİYAT gerekli\n"
+    
+    # Yorumlar
+    yorumlar = analiz_kurallari.get('yorumlar', {})
+    if yorumlar:
+        kural_eki += f"\n### Yorum Kuralları (Bu önerileri yap!):\n"
+        if yorumlar.get('cover_yuksek'):
+            kural_eki += f"- Cover yüksekse: {yorumlar['cover_yuksek']}\n"
+        if yorumlar.get('butce_dusuk'):
+            kural_eki += f"- Bütçe düşükse: {yorumlar['butce_dusuk']}\n"
+        if yorumlar.get('marj_dusuk'):
+            kural_eki += f"- Marj düşüşü varsa: {yorumlar['marj_dusuk']}\n"
+        if yorumlar.get('lfl_negatif'):
+            kural_eki += f"- LFL negatifse: {yorumlar['lfl_negatif']}\n"
+    
+    # Öncelik sırası
+    if analiz_kurallari.get('oncelik_sirasi'):
+        kural_eki += f"\n### Raporlama Önceliği:\n"
+        kural_eki += f"Şu sırayla raporla: {', '.join(analiz_kurallari['oncelik_sirasi'])}\n"
+    
+    # Kullanıcının serbest metin yorum kuralları (EN YÜKSEK ÖNCELİK)
+    if analiz_kurallari.get('ek_talimatlar'):
+        kural_eki += f"\n### ⭐ KULLANICI YORUM KURALLARI (BUNLARA ÖNCE UYGULAYIN!):\n"
+        kural_eki += f"{analiz_kurallari['ek_talimatlar']}\n"
+        kural_eki += f"\nÖNEMLİ: Yukarıdaki kuralları analiz yaparken ilk öncelik olarak uygula. "
+        kural_eki += f"Her analiz çıktısında önce bu kurallara göre değerlendir.\n"
+
+    # AI ek yorum izni
+    if analiz_kurallari.get('ai_yorum_ekle', True):
+        kural_eki += f"\n### AI Ek Yorumlar:\n"
+        kural_eki += f"Kullanıcı kurallarını uyguladıktan sonra, kendi profesyonel analizlerini de ekle. "
+        kural_eki += f"Kullanıcının gözden kaçırabileceği trendleri, riskleri ve fırsatları belirt. "
+        kural_eki += f"Bu ek yorumları '📊 AI Ek Değerlendirme:' başlığı altında sun.\n"
+    else:
+        kural_eki += f"\n### AI Ek Yorumlar:\n"
+        kural_eki += f"Sadece kullanıcının tanımladığı kurallara göre yorum yap. Ekstra yorum ekleme.\n"
+
+    print(f"   📋 Analiz kuralları eklendi ({len(kural_eki)} karakter)")
+    
+    return kural_eki
+
+
+# Agent bütçesi: tüm istek için toplam süre, her API çağrısı ve tool bu süreden kalanla sınırlanır
+AGENT_SURE_LIMITI = 180.0
+
+# CPU ağırlıklı araçlar (pandas) event loop'u bloklamasın diye thread havuzunda çalışır
+ARAC_ISCI_SAYISI = 4
+_ARAC_HAVUZU = ThreadPoolExecutor(max_workers=ARAC_ISCI_SAYISI, thread_name_prefix="agent-arac")
+# Çalışan araç yuvaları: zaman aşımına uğrayan araç thread'i kesilemez, yuvası iş
+# gerçekten bitince boşalır. Havuz kuyruğuna iş atılmaz - tüm yuvalar kısa sürede
+# boşalmazsa yeni çağrı reddedilir (takılan araçlar diğer oturumları kilitlemez).
+_ARAC_YUVALARI = threading.BoundedSemaphore(ARAC_ISCI_SAYISI)
+ARAC_YUVA_BEKLEME = 5.0
+
+_ARKA_PLAN_DONGUSU = None
+_ARKA_PLAN_KILIDI = threading.Lock()
+
+
+def _arka_plan_dongusu() -> asyncio.AbstractEventLoop:
+    """Tüm agent isteklerinin koştuğu, süreç ömrü boyunca yaşayan event loop"""
+    global _ARKA_PLAN_DONGUSU
+    with _ARKA_PLAN_KILIDI:
+        if _ARKA_PLAN_DONGUSU is None:
+            dongu = asyncio.new_event_loop()
+            threading.Thread(target=dongu.run_forever, name="agent-dongu", daemon=True).start()
+            _ARKA_PLAN_DONGUSU = dongu
+    return _ARKA_PLAN_DONGUSU
+
+
+def _araci_calistir_ve_sikistir(kup: KupVeri, tool_name: str, tool_input: dict) -> tuple:
+    """Thread havuzunda çalışır: aracı çağır + token bütçesine sığdır"""
+    ham = arac_calistir(kup, tool_name, tool_input)
+    ham_uzunluk = len(str(ham))
+    return arac_sonucu_sikistir(ham), ham_uzunluk
+
+
+async def _arac_yuvasi_al(bekleme: float) -> bool:
+    """Boş araç yuvası bekle (en çok `bekleme` sn) - alınamazsa False"""
+    bitis = time.monotonic() + bekleme
+    while not _ARAC_YUVALARI.acquire(blocking=False):
+        if time.monotonic() >= bitis:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+
+def _arac_gonder(kup: KupVeri, tool_name: str, tool_input: dict) -> asyncio.Future:
+    """Alınmış yuvayla aracı havuza gönder - yuva iş bitince (veya başlamadan iptal edilince) boşalır"""
+    is_ = _ARAC_HAVUZU.submit(_araci_calistir_ve_sikistir, kup, tool_name, tool_input)
+    is_.add_done_callback(lambda _: _ARAC_YUVALARI.release())
+    return asyncio.wrap_future(is_)
+
+
+async def agent_calistir_async(api_key: str, kup: KupVeri, kullanici_mesaji: str, analiz_kurallari: dict = None,
+                               hafiza: KonusmaHafizasi = None, sure_limiti: float = AGENT_SURE_LIMITI,
+                               kismi_cevaplar: list = None) -> str:
+    """
+    Agent'ı asyncio üzerinde çalıştır
+    
+    Args:
+        sure_limiti: Toplam süre (sn). Kalan süre her API çağrısına ve her
+            tool'a deadline olarak geçirilir; süre dolunca o ana kadarki
+            cevaplar döner.
+        kismi_cevaplar: Dışarıdan verilirse cevap parçaları buna yazılır -
+            görev iptal edilse bile o ana kadarki bulgular okunabilir.
     
-    import time
-    start_time = time.time()
+    Returns:
+        Agent cevabı (zaman aşımında kısmi cevap + not)
+    
+    İptal: Görev cancel() edilirse asyncio.CancelledError yukarı fırlatılır;
+    kısmi cevap kismi_cevaplar listesinde kalır.
+    """
+    loop = asyncio.get_running_loop()
+    son_an = loop.time() + sure_limiti
+    telemetri = AgentTelemetri(kullanici_mesaji)
+    
+    def kalan_sure() -> float:
+        return son_an - loop.time()
     
     print(f"\n🤖 AGENT BAŞLADI: {kullanici_mesaji[:50]}...")
     print(f"   API Key: {api_key[:20]}...")
     
     try:
-        client = anthropic.Anthropic(api_key=api_key, timeout=120.0)  # 120 saniye timeout
+        client = anthropic.AsyncAnthropic(api_key=api_key, timeout=120.0)  # 120 saniye timeout
         print("   ✅ Anthropic client oluşturuldu")
     except Exception as e:
         print(f"   ❌ Client hatası: {e}")
         return f"❌ API Client hatası: {str(e)}"
     
-    # Dinamik SYSTEM_PROMPT oluştur
-    system_prompt = SYSTEM_PROMPT
-    
-    if analiz_kurallari:
-        kural_eki = "\n\n## 📋 KULLANICI TANIMI ANALİZ KURALLARI\n"
-        
-        # Analiz sırası
-        if analiz_kurallari.get('analiz_sirasi'):
-            kural_eki += f"\n### Analiz Sırası:\n"
-            for i, analiz in enumerate(analiz_kurallari['analiz_sirasi'], 1):
-                kural_eki += f"{i}. {analiz}\n"
-        
-        # Eşikler
-        esikler = analiz_kurallari.get('esikler', {})
-        if esikler:
-            kural_eki += f"\n### Kritik Eşikler (Bu değerleri kullan!):\n"
-            kural_eki += f"- Cover > {esikler.get('cover_yuksek', 12)} hafta → 🔴 YÜKSEK COVER, stok eritme gerekli\n"
-            kural_eki += f"- Cover < {esikler.get('cover_dusuk', 4)} hafta → 🔴 DÜŞÜK COVER, sevkiyat gerekli\n"
-            kural_eki += f"- Bütçe sapması > %{esikler.get('butce_sapma', 15)} → 🔴 KRİTİK bütçe altında\n"
-            kural_eki += f"- LFL düşüş > %{esikler.get('lfl_dusus', 20)} → 🔴 CİDDİ küçülme\n"
-            kural_eki += f"- Marj düşüşü > {esikler.get('marj_dusus', 3)} puan → 🔴 MARJ baskısı\n"
-            kural_eki += f"- Stok/Ciro oranı > {esikler.get('stok_fazla', 1.3)} → ⚠️ Stok fazlası, ERİTME gerekli\n"
-            kural_eki += f"- Stok/Ciro oranı < {esikler.get('stok_az', 0.7)} → ⚠️ Stok az, SEVKİYAT gerekli\n"
-        
-        # Yorumlar
-        yorumlar = analiz_kurallari.get('yorumlar', {})
-        if yorumlar:
-            kural_eki += f"\n### Yorum Kuralları (Bu önerileri yap!):\n"
-            if yorumlar.get('cover_yuksek'):
-                kural_eki += f"- Cover yüksekse: {yorumlar['cover_yuksek']}\n"
-            if yorumlar.get('butce_dusuk'):
-                kural_eki += f"- Bütçe düşükse: {yorumlar['butce_dusuk']}\n"
-            if yorumlar.get('marj_dusuk'):
-                kural_eki += f"- Marj düşüşü varsa: {yorumlar['marj_dusuk']}\n"
-            if yorumlar.get('lfl_negatif'):
-                kural_eki += f"- LFL negatifse: {yorumlar['lfl_negatif']}\n"
-        
-        # Öncelik sırası
-        if analiz_kurallari.get('oncelik_sirasi'):
-            kural_eki += f"\n### Raporlama Önceliği:\n"
-            kural_eki += f"Şu sırayla raporla: {', '.join(analiz_kurallari['oncelik_sirasi'])}\n"
-        
-        # Kullanıcının serbest metin yorum kuralları (EN YÜKSEK ÖNCELİK)
-        if analiz_kurallari.get('ek_talimatlar'):
-            kural_eki += f"\n### ⭐ KULLANICI YORUM KURALLARI (BUNLARA ÖNCE UYGULAYIN!):\n"
-            kural_eki += f"{analiz_kurallari['ek_talimatlar']}\n"
-            kural_eki += f"\nÖNEMLİ: Yukarıdaki kuralları analiz yaparken ilk öncelik olarak uygula. "
-            kural_eki += f"Her analiz çıktısında önce bu kurallara göre değerlendir.\n"
-
-        # AI ek yorum izni
-        if analiz_kurallari.get('ai_yorum_ekle', True):
-            kural_eki += f"\n### AI Ek Yorumlar:\n"
-            kural_eki += f"Kullanıcı kurallarını uyguladıktan sonra, kendi profesyonel analizlerini de ekle. "
-            kural_eki += f"Kullanıcının gözden kaçırabileceği trendleri, riskleri ve fırsatları belirt. "
-            kural_eki += f"Bu ek yorumları '📊 AI Ek Değerlendirme:' başlığı altında sun.\n"
-        else:
-            kural_eki += f"\n### AI Ek Yorumlar:\n"
-            kural_eki += f"Sadece kullanıcının tanımladığı kurallara göre yorum yap. Ekstra yorum ekleme.\n"
-
-        system_prompt = SYSTEM_PROMPT + kural_eki
-        print(f"   📋 Analiz kuralları eklendi ({len(kural_eki)} karakter)")
-    
-    messages = [{"role": "user", "content": kullanici_mesaji}]
-    
-    tum_cevaplar = []
+    kural_eki = _kural_eki_olustur(analiz_kurallari)
+    
+    # Statik prompt cache'lenebilir prefix bloğu, kullanıcı kuralları ayrı suffix bloğu
+    system_bloklari = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": ONBELLEK_KONTROL}]
+    if kural_eki:
+        system_bloklari.append({"type": "text", "text": kural_eki})
+    
+    # Konuşma hafızası: eski turların özeti system sonuna, son turlar mesaj olarak
+    gecmis = []
+    if hafiza is not None:
+        hafiza.veri_kontrol(kup)
+        ozet = hafiza.ozet_metni()
+        if ozet:
+            system_bloklari.append({"type": "text", "text": ozet})
+        gecmis = hafiza.gecmis_mesajlar()
+        print(f"   🧠 Hafıza: {len(hafiza.turlar)} tam tur, {len(hafiza.ozetler)} özet, {len(hafiza.arac_sonuclari)} araç sonucu")
+    
+    # Soru bloğundaki cache_control: tur içindeki iterasyonlarda geçmiş + soru prefix'i de cache'ten gelir
+    messages = gecmis + [{"role": "user", "content": [
+        {"type": "text", "text": kullanici_mesaji, "cache_control": ONBELLEK_KONTROL}
+    ]}]
+    tur_baslangici = len(messages)
+    cagrilan_araclar = []
+    
+    tum_cevaplar = kismi_cevaplar if kismi_cevaplar is not None else []
     max_iterasyon = 12  # 8'den 12'ye çıkardım
     iterasyon = 0
-    
-    while iterasyon < max_iterasyon:
-        iterasyon += 1
-        print(f"\n   📡 İterasyon {iterasyon}/{max_iterasyon} - API çağrısı yapılıyor...")
-        
-        # Süre kontrolü - 180 saniyeyi geçerse dur
-        elapsed = time.time() - start_time
-        if elapsed > 180:
-            print(f"   ⏱️ Zaman aşımı! ({elapsed:.1f}s)")
-            tum_cevaplar.append("\n⏱️ Zaman limiti aşıldı. Mevcut bulgular yukarıda.")
-            break
-        
-        try:
-            response = client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4096,  # Daha uzun yanıtlar için artırıldı
-                system=system_prompt,
-                tools=TOOLS,
-                messages=messages
-            )
-            print(f"   ✅ API yanıt aldı: stop_reason={response.stop_reason}")
-        except Exception as api_error:
-            tum_cevaplar.append(f"\n❌ API Hatası: {str(api_error)}")
-            break
-        
-        # Text içeriklerini topla
-        for block in response.content:
-            if block.type == "text":
-                tum_cevaplar.append(block.text)
-        
-        # Tool kullanımlarını topla
-        tool_uses = [block for block in response.content if block.type == "tool_use"]
-        
-        # Tool kullanımı yoksa bitir
-        if not tool_uses:
-            break
-        
-        # Assistant mesajını ekle
-        messages.append({"role": "assistant", "content": response.content})
-        
-        # Tüm tool'lar için sonuçları topla
-        tool_results = []
-        for tool_use in tool_uses:
-            tool_name = tool_use.name
-            tool_input = tool_use.input
-            tool_use_id = tool_use.id
-            
-            # Tool'u çağır
+    token_toplam = {'input': 0, 'output': 0, 'cache_okuma': 0, 'cache_yazma': 0}
+    zaman_asimi = False
+    durum = 'tamam'
+    
+    async def arac_gorevi(tool_use, iterasyon_no: int) -> dict:
+        tool_name = tool_use.name
+        tool_input = tool_use.input
+        olcum = {'iterasyon': iterasyon_no, 'arac': tool_name,
+                 'girdi': json.dumps(tool_input or {}, ensure_ascii=False, default=str),
+                 'hafizadan': False, 'zaman_asimi': False, 'hata': None}
+        t0 = time.perf_counter()
+        
+        # Önceki turlarda aynı çağrı yapıldıysa hafızadan dön
+        onceki_sonuc = hafiza.arac_sonucu(tool_name, tool_input) if hafiza is not None else None
+        if onceki_sonuc is not None:
+            print(f"      ♻️ {tool_name}: hafızadan ({len(onceki_sonuc)} karakter)")
+            tool_result = onceki_sonuc
+            ham_uzunluk = len(onceki_sonuc)
+            olcum['hafizadan'] = True
+        elif not await _arac_yuvasi_al(min(ARAC_YUVA_BEKLEME, max(kalan_sure(), 0))):
+            ham_uzunluk = 0
+            tool_result = "⏳ Araç çalıştırıcıları meşgul (önceki uzun süren araçlar hâlâ çalışıyor), sonuç alınamadı. Biraz sonra tekrar dene."
+            print(f"      ⏳ {tool_name}: tüm araç yuvaları dolu, çağrı reddedildi")
+            olcum['hata'] = 'arac_yuvalari_dolu'
+        else:
+            ham_uzunluk = 0
             try:
-                if tool_name == "web_arama":
-                    tool_result = web_arama(tool_input.get("sorgu", "Türkiye enflasyon"))
-                elif tool_name == "genel_ozet":
-                    tool_result = genel_ozet(kup)
-                elif tool_name == "trading_analiz":
-                    tool_result = trading_analiz(
-                        kup,
-                        ana_grup=tool_input.get("ana_grup", None),
-                        ara_grup=tool_input.get("ara_grup", None)
-                    )
-                elif tool_name == "cover_analiz":
-                    tool_result = cover_analiz(kup, tool_input.get("sayfa", None))
-                elif tool_name == "cover_diagram_analiz":
-                    tool_result = cover_diagram_analiz(
-                        kup,
-                        alt_grup=tool_input.get("alt_grup", None),
-                        magaza=tool_input.get("magaza", None)
-                    )
-                elif tool_name == "kapasite_analiz":
-                    tool_result = kapasite_analiz(
-                        kup,
-                        magaza=tool_input.get("magaza", None)
-                    )
-                elif tool_name == "siparis_takip_analiz":
-                    tool_result = siparis_takip_analiz(
-                        kup,
-                        ana_grup=tool_input.get("ana_grup", None)
-                    )
-                elif tool_name == "ihtiyac_hesapla":
-                    tool_result = ihtiyac_hesapla(kup, tool_input.get("limit", 30))
-                elif tool_name == "kategori_analiz":
-                    tool_result = kategori_analiz(kup, tool_input.get("kategori_kod", ""))
-                elif tool_name == "magaza_analiz":
-                    tool_result = magaza_analiz(kup, tool_input.get("magaza_kod", ""))
-                elif tool_name == "urun_analiz":
-                    tool_result = urun_analiz(kup, tool_input.get("urun_kod", ""))
-                elif tool_name == "sevkiyat_plani":
-                    tool_result = sevkiyat_plani(kup, tool_input.get("limit", 30))
-                elif tool_name == "fazla_stok_analiz":
-                    tool_result = fazla_stok_analiz(kup, tool_input.get("limit", 30))
-                elif tool_name == "bolge_karsilastir":
-                    tool_result = bolge_karsilastir(kup)
-                elif tool_name == "sevkiyat_hesapla":
-                    tool_result = sevkiyat_hesapla(
-                        kup,
-                        kategori_kod=tool_input.get("kategori_kod", None),
-                        urun_kod=tool_input.get("urun_kod", None),
-                        marka_kod=tool_input.get("marka_kod", None),
-                        forward_cover=tool_input.get("forward_cover", 7.0),
-                        export_excel=tool_input.get("export_excel", False)
-                    )
-                else:
-                    tool_result = f"Bilinmeyen araç: {tool_name}"
-                
-                # Sonucu logla
-                print(f"      🔧 {tool_name}: {len(tool_result)} karakter")
-                
-                # Sonuç çok uzunsa kısalt (API limiti için)
-                if len(tool_result) > 8000:
-                    tool_result = tool_result[:8000] + "\n\n... (kısaltıldı)"
-                    print(f"      ⚠️ Sonuç kısaltıldı: 8000 karakter")
-                    
+                # Not: süre dolunca beklemeyi bırakırız; thread'deki pandas işi
+                # kesilemez, arka planda biter, sonucu atılır ve yuvası o zaman boşalır.
+                tool_result, ham_uzunluk = await asyncio.wait_for(
+                    _arac_gonder(kup, tool_name, tool_input),
+                    timeout=max(kalan_sure(), 0.1)
+                )
+                print(f"      🔧 {tool_name}: {ham_uzunluk} → {len(tool_result)} karakter (~{token_tahmini(tool_result)} token)")
+                if hafiza is not None:
+                    hafiza.arac_sonucu_kaydet(tool_name, tool_input, tool_result)
+            except asyncio.TimeoutError:
+                tool_result = "⏱️ Araç zaman limitini aştı, sonuç alınamadı."
+                print(f"      ⏱️ {tool_name}: zaman aşımı")
+                olcum['zaman_asimi'] = True
             except Exception as e:
                 tool_result = f"Hata: {str(e)}"
                 print(f"      ❌ Tool hatası: {e}")
+                olcum['hata'] = str(e)[:200]
+        
+        telemetri.kaydet(
+            'arac', **olcum,
+            sure_ms=round((time.perf_counter() - t0) * 1000),
+            ham_karakter=ham_uzunluk,
+            karakter=len(tool_result),
+            token=token_tahmini(tool_result),
+            sikistirildi=len(tool_result) < ham_uzunluk
+        )
+        return {"type": "tool_result", "tool_use_id": tool_use.id, "content": tool_result}
+    
+    try:
+        while iterasyon < max_iterasyon:
+            iterasyon += 1
+            print(f"\n   📡 İterasyon {iterasyon}/{max_iterasyon} - API çağrısı yapılıyor...")
+            
+            # Süre kontrolü - bütçe bittiyse yeni çağrı yapma
+            if kalan_sure() <= 1:
+                zaman_asimi = True
+                break
+            
+            t0 = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    client.messages.create(
+                        model="claude-sonnet-4-20250514",
+                        max_tokens=4096,  # Daha uzun yanıtlar için artırıldı
+                        system=system_bloklari,
+                        tools=TOOLS_ONBELLEKLI,
+                        messages=messages,
+                        timeout=max(kalan_sure(), 1.0)
+                    ),
+                    timeout=kalan_sure()
+                )
+                print(f"   ✅ API yanıt aldı: stop_reason={response.stop_reason}")
+            except asyncio.TimeoutError:
+                zaman_asimi = True
+                break
+            except Exception as api_error:
+                tum_cevaplar.append(f"\n❌ API Hatası: {str(api_error)}")
+                telemetri.kaydet('api', iterasyon=iterasyon, sure_ms=round((time.perf_counter() - t0) * 1000),
+                                 hata=str(api_error)[:200])
+                durum = 'hata'
+                break
+            api_sure_ms = round((time.perf_counter() - t0) * 1000)
+            
+            # Token ve cache kullanımı (cache_okuma > 0 ise prefix cache'ten geldi)
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                cache_okuma = getattr(usage, 'cache_read_input_tokens', 0) or 0
+                cache_yazma = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+                token_toplam['input'] += usage.input_tokens or 0
+                token_toplam['output'] += usage.output_tokens or 0
+                token_toplam['cache_okuma'] += cache_okuma
+                token_toplam['cache_yazma'] += cache_yazma
+                print(f"   💾 Token: input={usage.input_tokens}, output={usage.output_tokens}, "
+                      f"cache_okuma={cache_okuma}, cache_yazma={cache_yazma}")
+            
+            telemetri.kaydet(
+                'api', iterasyon=iterasyon, sure_ms=api_sure_ms, stop_reason=response.stop_reason,
+                input_tokens=getattr(usage, 'input_tokens', 0) if usage is not None else 0,
+                output_tokens=getattr(usage, 'output_tokens', 0) if usage is not None else 0,
+                cache_okuma=cache_okuma if usage is not None else 0,
+                cache_yazma=cache_yazma if usage is not None else 0,
+                tool_sayisi=sum(1 for b in response.content if b.type == "tool_use")
+            )
+            
+            # Text içeriklerini topla
+            for block in response.content:
+                if block.type == "text":
+                    tum_cevaplar.append(block.text)
+            
+            # Tool kullanımlarını topla
+            tool_uses = [block for block in response.content if block.type == "tool_use"]
+            
+            # Tool kullanımı yoksa bitir
+            if not tool_uses:
+                icerik = [_blok_sozluk(b) for b in response.content if b.type != "text" or b.text.strip()]
+                if icerik:
+                    messages.append({"role": "assistant", "content": icerik})
+                break
             
-            tool_results.append({
-                "type": "tool_result",
-                "tool_use_id": tool_use_id,
-                "content": tool_result
+            # Assistant mesajını ekle
+            messages.append({"role": "assistant", "content": [_blok_sozluk(b) for b in response.content]})
+            
+            # Tool'ları paralel çalıştır (her biri kalan süreyle sınırlı)
+            for tool_use in tool_uses:
+                cagrilan_araclar.append((tool_use.name, tool_use.input))
+            tool_results = await asyncio.gather(*(arac_gorevi(tu, iterasyon) for tu in tool_uses))
+            
+            # Tüm tool sonuçlarını tek bir user mesajında gönder
+            messages.append({
+                "role": "user",
+                "content": list(tool_results)
             })
-        
-        # Tüm tool sonuçlarını tek bir user mesajında gönder
-        messages.append({
-            "role": "user",
-            "content": tool_results
-        })
-        
-        # Stop reason end_turn ise bitir
-        if response.stop_reason == "end_turn":
-            break
+            
+            # Stop reason end_turn ise bitir
+            if response.stop_reason == "end_turn":
+                break
+    except asyncio.CancelledError:
+        print("   ⏹️ Agent iptal edildi")
+        tum_cevaplar.append("\n⏹️ Analiz iptal edildi. Mevcut bulgular yukarıda.")
+        telemetri.bitir('iptal', iterasyon, token_toplam)
+        if hafiza is not None:
+            # Yarım tur da hafızaya girer - takip sorusu o ana kadarki bulguları görür
+            hafiza.tur_ekle(kullanici_mesaji, messages[tur_baslangici:], "\n".join(tum_cevaplar), cagrilan_araclar)
+        raise
+    finally:
+        await client.close()
+    
+    if zaman_asimi:
+        print(f"   ⏱️ Zaman aşımı! ({sure_limiti - kalan_sure():.1f}s)")
+        tum_cevaplar.append("\n⏱️ Zaman limiti aşıldı. Mevcut bulgular yukarıda.")
+        durum = 'zaman_asimi'
+    
+    telemetri.bitir(durum, iterasyon, token_toplam)
+    
+    print(f"\n   💾 Toplam token: input={token_toplam['input']:,}, output={token_toplam['output']:,}, "
+          f"cache_okuma={token_toplam['cache_okuma']:,}, cache_yazma={token_toplam['cache_yazma']:,}")
+    
+    cevap = "\n".join(tum_cevaplar)
+    
+    if hafiza is not None:
+        hafiza.tur_ekle(kullanici_mesaji, messages[tur_baslangici:], cevap, cagrilan_araclar)
+    
+    return cevap
+
+
+class AgentCalismasi:
+    """
+    Arka plan event loop'unda koşan tek bir agent isteği
+    
+    Streamlit script'i bloklanmadan tamamlanmayı bekleyebilir, kullanıcı
+    sayfadan ayrılınca / durdurunca iptal() ile işi kesebilir.
+    """
+    
+    def __init__(self, coro_fabrikasi):
+        self.baslangic = time.time()
+        self.kismi_cevaplar = []
+        self._future = asyncio.run_coroutine_threadsafe(
+            coro_fabrikasi(self.kismi_cevaplar), _arka_plan_dongusu()
+        )
+    
+    def tamamlandi(self) -> bool:
+        return self._future.done()
+    
+    def gecen_sure(self) -> float:
+        return time.time() - self.baslangic
+    
+    def iptal(self):
+        """Çalışan görevi iptal et (API çağrısı ve tool beklemesi kesilir)"""
+        if not self._future.done():
+            self._future.cancel()
     
-    return "\n".join(tum_cevaplar)
+    def sonuc(self, timeout: float = None) -> str:
+        """Cevabı bekle; iptal edildiyse o ana kadarki kısmi cevabı döndür"""
+        try:
+            return self._future.result(timeout)
+        except CancelledError:
+            kismi = "\n".join(self.kismi_cevaplar)
+            if "⏹️" not in kismi:
+                kismi += "\n⏹️ Analiz iptal edildi."
+            return kismi.strip()
+
+
+def agent_baslat(api_key: str, kup: KupVeri, kullanici_mesaji: str, analiz_kurallari: dict = None,
+                 hafiza: KonusmaHafizasi = None, sure_limiti: float = AGENT_SURE_LIMITI) -> AgentCalismasi:
+    """Agent'ı arka planda başlat, iptal edilebilir AgentCalismasi döndür"""
+    return AgentCalismasi(lambda kismi: agent_calistir_async(
+        api_key, kup, kullanici_mesaji, analiz_kurallari=analiz_kurallari,
+        hafiza=hafiza, sure_limiti=sure_limiti, kismi_cevaplar=kismi
+    ))
+
+
+def agent_calistir(api_key: str, kup: KupVeri, kullanici_mesaji: str, analiz_kurallari: dict = None,
+                   hafiza: KonusmaHafizasi = None, sure_limiti: float = AGENT_SURE_LIMITI) -> str:
+    """Agent'ı çalıştır ve sonuç al (senkron sarmalayıcı)
+    
+    analiz_kurallari: Kullanıcının tanımladığı eşikler ve yorumlar
+    hafiza: Oturumun KonusmaHafizasi'ı - verilirse önceki turlar ve araç sonuçları kullanılır
+    sure_limiti: Toplam süre bütçesi (sn) - her API çağrısı ve tool'a deadline olarak iner
+    """
+    return agent_baslat(api_key, kup, kullanici_mesaji, analiz_kurallari=analiz_kurallari,
+                        hafiza=hafiza, sure_limiti=sure_limiti).sonuc()
 
 
 # =============================================================================
@@ -9,6 +9,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 import os
+import time
 import base64
 from io import BytesIO
 import asyncio
@@ -424,6 +425,53 @@ def sesli_oku(metin: str, ses: str = "tr-TR-AhmetNeural") -> str:
         return f"<p style='color: red;'>❌ Ses hatası: {str(e)}</p>"
 
 
+# ============================================
+# PAYLAŞIMLI VERİ KÜPÜ
+# ============================================
+# Küp süreç genelinde tek kopya: tüm oturumlar aynı salt-okunur nesneyi
+# kullanır. Yükleme KupYoneticisi'nin arka plan thread'inde yapılır -
+# yükleme sürerken oturumlar eski küpü kullanır, hazır olunca küp atomik
+# olarak değişir. Devam eden agent çalışmaları küpü kiralar, eski versiyon
+# son çalışma bitene kadar yaşar.
+# SANAL_PLANNER_PAYLASIM_KLASORU tanımlıysa worker süreçleri de küpü
+# Arrow deposundan paylaşır (kup_deposu.py).
+
+@st.cache_resource
+def kup_yoneticisi(veri_klasoru: str):
+    from kup_deposu import KupYoneticisi
+    return KupYoneticisi(veri_klasoru)
+
+
+def kup_baglan(veri_klasoru: str):
+    """Oturumu yöneticideki aktif küpe bağla (yoksa None)"""
+    kup = kup_yoneticisi(veri_klasoru).aktif()
+    if kup is not None:
+        st.session_state['kup'] = kup
+        st.session_state['kup_yuklendi'] = True
+    return kup
+
+
+def _yukleme_ilerlemesi(veri_klasoru: str):
+    """Arka plan yüklemesinin ilerleme çubuğu - bitince sayfayı yeniler"""
+    yonetici = kup_yoneticisi(veri_klasoru)
+    durum = yonetici.ilerleme()
+    if yonetici.yukleniyor():
+        st.progress(durum['yuzde'] / 100,
+                    text=f"🔄 {durum['mesaj']} ({durum.get('gecen_sure', 0):.0f} sn)")
+    else:
+        if durum['hata']:
+            st.error(f"❌ Veri yükleme hatası: {durum['hata']}")
+        else:
+            st.rerun()
+
+
+# Streamlit fragment varsa ilerleme çubuğu sayfanın geri kalanını yenilemeden güncellenir
+if hasattr(st, 'fragment'):
+    yukleme_ilerlemesi = st.fragment(run_every=1.0)(_yukleme_ilerlemesi)
+else:
+    yukleme_ilerlemesi = _yukleme_ilerlemesi
+
+
 # ============================================
 # STREAMLIT ARAYÜZÜ
 # ============================================
@@ -577,35 +625,44 @@ with st.sidebar:
     DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    # Uygulama başlarken data klasöründen otomatik yükle
-    if not st.session_state.get('kup_yuklendi') and 'kup' not in st.session_state:
-        # CUBE dosyası var mı kontrol et
-        cube_var = any(
-            'cube' in f.lower() for f in os.listdir(DATA_DIR)
-            if f.endswith('.xlsx') or f.endswith('.xls')
-        ) if os.path.exists(DATA_DIR) else False
+    # Data klasöründen paylaşılan küpe bağlan (her rerun'da versiyon kontrolü -
+    # dosyalar değiştiyse yeni küp arka planda yüklenir, bu sırada eski küp kullanılır)
+    # CUBE dosyası var mı kontrol et
+    cube_var = any(
+        'cube' in f.lower() for f in os.listdir(DATA_DIR)
+        if f.endswith('.xlsx') or f.endswith('.xls')
+    ) if os.path.exists(DATA_DIR) else False
 
-        if cube_var:
-            try:
-                from agent_tools import KupVeri
-                st.session_state['kup'] = KupVeri(DATA_DIR)
-                st.session_state['kup_yuklendi'] = True
-            except Exception as e:
-                st.error(f"❌ Otomatik yükleme hatası: {e}")
+    if cube_var:
+        try:
+            kup_yoneticisi(DATA_DIR).yenile()
+            kup_baglan(DATA_DIR)
+        except Exception as e:
+            st.error(f"❌ Otomatik yükleme hatası: {e}")
+    if kup_yoneticisi(DATA_DIR).yukleniyor():
+        yukleme_ilerlemesi(DATA_DIR)
 
     st.subheader("📊 Veri Durumu")
 
     if st.session_state.get('kup_yuklendi') and 'kup' in st.session_state:
         st.success("✅ Veri hazır")
+        # Değişimden sonra arka planda yüklenemeyen veri grupları
+        yukleme_hatasi = kup_yoneticisi(DATA_DIR).ilerleme()['hata']
+        if yukleme_hatasi and not kup_yoneticisi(DATA_DIR).yukleniyor():
+            st.warning(f"⚠️ {yukleme_hatasi}")
         kup = st.session_state['kup']
-        if len(kup.trading) > 0:
+        # Sadece yüklenmiş veri grupları gösterilir - burada erişim yüklemeyi tetiklemesin
+        if kup.yuklu_mu('trading') and len(kup.trading) > 0:
             st.caption(f"📈 Trading: {len(kup.trading):,} satır")
-        if hasattr(kup, 'cover_diagram') and len(kup.cover_diagram) > 0:
+        if kup.yuklu_mu('cover') and len(kup.cover_diagram) > 0:
             st.caption(f"🎯 Cover Diagram: {len(kup.cover_diagram):,} satır")
-        if hasattr(kup, 'kapasite') and len(kup.kapasite) > 0:
+        if kup.yuklu_mu('kapasite') and len(kup.kapasite) > 0:
             st.caption(f"🏪 Kapasite: {len(kup.kapasite):,} satır")
-        if hasattr(kup, 'siparis_takip') and len(kup.siparis_takip) > 0:
+        if kup.yuklu_mu('siparis') and len(kup.siparis_takip) > 0:
             st.caption(f"📋 Sipariş Takip: {len(kup.siparis_takip):,} satır")
+        bekleyen = [g for g in kup.VERI_GRUPLARI if not kup.yuklu_mu(g)]
+        if bekleyen:
+            st.caption(f"⏳ İlk kullanımda yüklenecek: {', '.join(bekleyen)}")
     else:
         # CUBE dosyası yoksa uyarı göster
         cube_var = any(
@@ -629,8 +686,6 @@ with st.sidebar:
             if uploaded_files:
                 if st.button("📂 Yükle ve Kaydet", use_container_width=True):
                     try:
-                        from agent_tools import KupVeri
-
                         # Lokale kaydet
                         for uploaded_file in uploaded_files:
                             file_path = os.path.join(DATA_DIR, uploaded_file.name)
@@ -716,11 +771,10 @@ with st.sidebar:
                         except Exception as gh_err:
                             st.caption(f"ℹ️ GitHub push atlandı: {gh_err}")
 
-                        with st.spinner("Veri işleniyor..."):
-                            st.session_state['kup'] = KupVeri(DATA_DIR)
-                            st.session_state['kup_yuklendi'] = True
+                        # Yeni küp arka planda hazırlanır, bu sırada mevcut veri kullanılmaya devam eder
+                        kup_yoneticisi(DATA_DIR).yenile()
 
-                        st.success("✅ Veriler güncellendi ve kaydedildi!")
+                        st.success("✅ Veriler kaydedildi, arka planda işleniyor!")
                         st.rerun()
 
                     except Exception as e:
@@ -736,11 +790,11 @@ with st.sidebar:
             ) if os.path.exists(DATA_DIR) else False
             if cube_var:
                 try:
-                    from agent_tools import KupVeri
-                    with st.spinner("Veriler yenileniyor..."):
-                        st.session_state['kup'] = KupVeri(DATA_DIR)
-                        st.session_state['kup_yuklendi'] = True
-                    st.success("✅ Veriler yenilendi!")
+                    # Zorla yenile: dosyalar değişmemiş olsa da küp arka planda yeniden yüklenir
+                    if kup_yoneticisi(DATA_DIR).yenile(zorla=True):
+                        st.success("✅ Veriler arka planda yenileniyor!")
+                    else:
+                        st.info("ℹ️ Yenileme zaten sürüyor")
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ Hata: {e}")
@@ -842,6 +896,50 @@ with st.sidebar:
                 'ek_talimatlar': yorum_kurallari if yorum_kurallari else None,
                 'ai_yorum_ekle': ai_yorum_ekle,
             }
+
+        # Agent telemetrisi - hangi iterasyon / araç süreyi dolduruyor
+        with st.expander("📈 Agent Telemetri", expanded=False):
+            from agent_tools import telemetri_tablolari, TELEMETRI_DOSYASI
+
+            tablolar = telemetri_tablolari()
+            istekler = tablolar['istek']
+            if len(istekler) == 0:
+                st.caption("Henüz agent çalışması yok.")
+            else:
+                st.markdown("**Son istekler**")
+                st.dataframe(
+                    istekler.iloc[::-1][['zaman', 'soru', 'durum', 'sure_ms', 'iterasyon',
+                                         'input', 'output', 'cache_okuma', 'cache_yazma']],
+                    hide_index=True, use_container_width=True
+                )
+
+                istek_id = st.selectbox(
+                    "İstek detayı",
+                    list(istekler['istek_id'].iloc[::-1]),
+                    format_func=lambda i: f"{i} - {istekler.loc[istekler['istek_id'] == i, 'soru'].iloc[0][:40]}"
+                )
+                api_df = tablolar['api']
+                arac_df = tablolar['arac']
+                if len(api_df) > 0:
+                    st.markdown("**API iterasyonları**")
+                    st.dataframe(api_df[api_df['istek_id'] == istek_id].drop(columns=['istek_id']),
+                                 hide_index=True, use_container_width=True)
+                if len(arac_df) > 0:
+                    st.markdown("**Araç çağrıları**")
+                    st.dataframe(arac_df[arac_df['istek_id'] == istek_id].drop(columns=['istek_id']),
+                                 hide_index=True, use_container_width=True)
+
+                    st.markdown("**Araç bazında toplam (tüm istekler)**")
+                    arac_ozet = arac_df.groupby('arac').agg(
+                        cagri=('sure_ms', 'size'),
+                        ort_sure_ms=('sure_ms', 'mean'),
+                        max_sure_ms=('sure_ms', 'max'),
+                        ort_token=('token', 'mean'),
+                        sikistirma=('sikistirildi', 'sum'),
+                        hafizadan=('hafizadan', 'sum'),
+                    ).round(0).sort_values('ort_sure_ms', ascending=False)
+                    st.dataframe(arac_ozet, use_container_width=True)
+            st.caption(f"JSON lines: {TELEMETRI_DOSYASI}")
     else:
         # Admin değilse varsayılan kuralları kullan
         if 'analiz_kurallari' not in st.session_state:
@@ -912,6 +1010,30 @@ st.header("💬 Planner ile Konuş")
 if 'messages' not in st.session_state:
     st.session_state['messages'] = []
 
+
+def _analizi_durdur():
+    """Durdur butonu (on_click): çalışmayı iptal et - kısmi sonuç bu rerun'da sohbete eklenir"""
+    st.session_state['analiz_durdur'] = True
+    aktif = st.session_state.get('aktif_analiz')
+    if aktif is not None:
+        aktif['calisma'].iptal()
+
+
+def _analiz_sonucunu_ekle(mesaj: str, sonuc: str):
+    st.session_state['messages'].append({'role': 'user', 'content': mesaj})
+    st.session_state['messages'].append({'role': 'agent', 'content': sonuc})
+
+
+# Durdurulan (veya başka bir etkileşimle yarıda kesilen) analiz: buton tıklaması
+# script'i bekleme döngüsünde keser, soru ve kısmi bulgular burada sohbete eklenir
+yarim_analiz = st.session_state.pop('aktif_analiz', None)
+if yarim_analiz is not None:
+    yarim_analiz['calisma'].iptal()
+    yarim_sonuc = yarim_analiz['calisma'].sonuc()
+    if yarim_sonuc:
+        _analiz_sonucunu_ekle(yarim_analiz['mesaj'], yarim_sonuc)
+st.session_state['analiz_durdur'] = False
+
 for msg in st.session_state['messages']:
     if msg['role'] == 'user':
         st.markdown(f'<div class="chat-message user-message">🧑 {msg["content"]}</div>', unsafe_allow_html=True)
@@ -967,16 +1089,43 @@ if mesaj:
         """, unsafe_allow_html=True)
 
         try:
-            from agent_tools import agent_calistir
-
-            analiz_kurallari = st.session_state.get('analiz_kurallari', None)
-            sonuc = agent_calistir(api_key, st.session_state['kup'], mesaj, analiz_kurallari=analiz_kurallari)
-
+            from agent_tools import agent_baslat, KonusmaHafizasi
+
+            # Oturum hafızası - takip soruları önceki turları ve araç sonuçlarını kullanır
+            if 'hafiza' not in st.session_state:
+                st.session_state['hafiza'] = KonusmaHafizasi()
+
+            # Küpü çalışma boyunca kirala - bu sırada veri yenilenirse eski küp
+            # çalışma bitene kadar bellekte kalır
+            with kup_yoneticisi(DATA_DIR).kiralik() as kira_kup:
+                analiz_kurallari = st.session_state.get('analiz_kurallari', None)
+                calisma = agent_baslat(api_key, kira_kup or st.session_state['kup'], mesaj, analiz_kurallari=analiz_kurallari,
+                                           hafiza=st.session_state['hafiza'])
+                st.session_state['aktif_analiz'] = {'calisma': calisma, 'mesaj': mesaj}
+
+                # Agent arka plan loop'unda koşar; burada bekleyip süreyi gösteriyoruz.
+                # Kullanıcı durdurursa / sayfadan ayrılırsa Streamlit bir sonraki st.*
+                # çağrısında script'i keser, finally bloğu da agent'ı iptal eder;
+                # kısmi sonuç sonraki rerun'da aktif_analiz'den sohbete eklenir.
+                durdur_placeholder = st.empty()
+                durdur_placeholder.button("⏹️ Analizi Durdur", key="analizi_durdur", on_click=_analizi_durdur)
+                sure_placeholder = st.empty()
+                try:
+                    while not calisma.tamamlandi() and not st.session_state.get('analiz_durdur'):
+                        sure_placeholder.caption(f"⏱️ {calisma.gecen_sure():.0f} sn")
+                        time.sleep(0.5)
+                finally:
+                    if not calisma.tamamlandi():
+                        calisma.iptal()
+                sonuc = calisma.sonuc()
+                st.session_state.pop('aktif_analiz', None)
+
+            durdur_placeholder.empty()
+            sure_placeholder.empty()
             thinking_placeholder.empty()
 
             if sonuc and len(sonuc.strip()) > 0:
-                st.session_state['messages'].append({'role': 'user', 'content': mesaj})
-                st.session_state['messages'].append({'role': 'agent', 'content': sonuc})
+                _analiz_sonucunu_ekle(mesaj, sonuc)
                 st.markdown(f'<div class="chat-message agent-message">🤖 {sonuc}</div>', unsafe_allow_html=True)
 
                 if st.session_state.get('sesli_aktif', False):
@@ -988,6 +1137,7 @@ if mesaj:
                 st.warning("⚠️ Agent yanıt vermedi.")
 
         except Exception as e:
+            st.session_state.pop('aktif_analiz', None)
             thinking_placeholder.empty()
             import traceback
             st.error(f"❌ Hata: {str(e)}")
@@ -1000,6 +1150,8 @@ col1, col2, col3, col4 = st.columns(4)
 with col1:
     if st.button("🗑️ Sohbeti Temizle", use_container_width=True):
         st.session_state['messages'] = []
+        if 'hafiza' in st.session_state:
+            st.session_state['hafiza'].temizle()
         st.rerun()
 
 with col2:
@@ -0,0 +1,269 @@
+"""
+Sanal Planner - Performans Benchmark
+Veri yükleme adımlarının süre karşılaştırması
+
+Excel motorları: CUBE / rapor workbook'larının pandas read_excel (eski çift
+okuma akışı), openpyxl ve calamine ile okunma süreleri. Motorların ürettiği
+tabloların aynı olduğu da kontrol edilir.
+
+Genel özet: zincir ölçeğinde sentetik küpte (mağaza × ürün) genel_ozet
+metriklerinin eski akış (4 sum + 4 filtre), tek geçiş (sum + value_counts) ve
+yükleme anında hesaplanan toplamlardan okunma süreleri.
+
+Kullanım:
+    python benchmark.py                                  # tüm bölümler
+    python benchmark.py --bolum excel --excel rapor.xlsx --tekrar 5
+    python benchmark.py --bolum ozet --magaza 500 --urun 4000
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import warnings
+import contextlib
+import numpy as np
+import pandas as pd
+
+from agent_tools import (
+    ExcelOkuyucu, EXCEL_MOTORLARI, CALAMINE_AVAILABLE, header_satiri_bul, satirlardan_tablo,
+    KupVeri, STOK_DURUMLARI, genel_ozet
+)
+
+VARSAYILAN_EXCEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "AI_CUBE_SABLON.xlsx")
+
+# KupVeri._excel_oto_header ile aynı anahtarlar (header tespiti dahil ölçülsün)
+HEADER_KEYWORDS = [
+    'ana grup', 'alt grup', 'maingroupdesc', 'subgroupdesc',
+    'main group', 'sub group', 'categoryleader', 'tribeleader',
+    'ty sales unit', 'ty sales value', 'ty gross profit',
+]
+
+
+def _sure_olc(fonksiyon, tekrar: int):
+    """En iyi ve ortalama süre (sn) + son sonuç"""
+    sureler = []
+    sonuc = None
+    for _ in range(tekrar):
+        baslangic = time.perf_counter()
+        sonuc = fonksiyon()
+        sureler.append(time.perf_counter() - baslangic)
+    return min(sureler), sum(sureler) / len(sureler), sonuc
+
+
+# =============================================================================
+# EXCEL MOTORLARI
+# =============================================================================
+
+def _eski_akis(path: str) -> dict:
+    """Eski KupVeri akışı: header için nrows=30 okuma + header=N ile tekrar okuma"""
+    tablolar = {}
+    xl = pd.ExcelFile(path)
+    for sayfa in xl.sheet_names:
+        raw = pd.read_excel(xl, sheet_name=sayfa, header=None, nrows=30)
+        satirlar = [tuple(None if pd.isna(v) else v for v in row) for row in raw.itertuples(index=False)]
+        header_row, _ = header_satiri_bul(satirlar, HEADER_KEYWORDS)
+        tablolar[sayfa] = pd.read_excel(xl, sheet_name=sayfa, header=header_row or 0)
+    xl.close()
+    return tablolar
+
+
+def _motor_akisi(path: str, motor: str) -> dict:
+    """ExcelOkuyucu: workbook bir kez açılır, her sayfa tek geçişte okunur"""
+    tablolar = {}
+    with ExcelOkuyucu(path, motor=motor) as xl:
+        for sayfa in xl.sayfalar:
+            satirlar = xl.satirlar(sayfa)
+            header_row, _ = header_satiri_bul(satirlar[:30], HEADER_KEYWORDS)
+            tablolar[sayfa] = satirlardan_tablo(satirlar, header_row or 0)
+    return tablolar
+
+
+def excel_motorlari_benchmark(path: str, tekrar: int = 3):
+    print(f"\n📊 EXCEL MOTORLARI - {os.path.basename(path)} ({os.path.getsize(path) / 1024:,.0f} KB, {tekrar} tekrar)")
+    print("=" * 72)
+
+    adaylar = [("pandas read_excel (eski çift okuma)", lambda: _eski_akis(path))]
+    for motor in ['openpyxl', 'calamine']:
+        if motor == 'calamine' and not CALAMINE_AVAILABLE:
+            print("   ⚠️ python-calamine yüklü değil - calamine atlandı (pip install python-calamine)")
+            continue
+        adaylar.append((f"ExcelOkuyucu [{motor}]", lambda m=motor: _motor_akisi(path, m)))
+
+    sonuclar = []
+    for ad, fonksiyon in adaylar:
+        en_iyi, ortalama, tablolar = _sure_olc(fonksiyon, tekrar)
+        satir = sum(len(df) for df in tablolar.values())
+        sonuclar.append((ad, en_iyi, ortalama, satir, tablolar))
+
+    referans = sonuclar[0][1]
+    print(f"{'Yöntem':<38} | {'En iyi':>8} | {'Ort.':>8} | {'Hız':>6} | {'Satır':>7}")
+    print("-" * 72)
+    for ad, en_iyi, ortalama, satir, _ in sonuclar:
+        print(f"{ad:<38} | {en_iyi:>7.3f}s | {ortalama:>7.3f}s | {referans / en_iyi:>5.1f}x | {satir:>7,}")
+
+    # Motorlar aynı tabloyu üretmeli
+    taban = sonuclar[0][4]
+    for ad, _, _, _, tablolar in sonuclar[1:]:
+        farkli = []
+        for sayfa, df in taban.items():
+            try:
+                pd.testing.assert_frame_equal(tablolar[sayfa], df)
+            except (AssertionError, KeyError):
+                farkli.append(sayfa)
+        durum = "✅ aynı" if not farkli else f"❌ farklı sayfalar: {farkli}"
+        print(f"   {ad}: {durum}")
+
+
+# =============================================================================
+# GENEL ÖZET
+# =============================================================================
+
+def sentetik_kup(magaza_sayisi: int, urun_sayisi: int, seed: int = 42) -> KupVeri:
+    """Zincir ölçeğinde sentetik küp (her mağaza × her ürün) - _hazirla dahil"""
+    rng = np.random.default_rng(seed)
+    n = magaza_sayisi * urun_sayisi
+    magazalar = np.arange(1, magaza_sayisi + 1)
+    urunler = np.arange(100000, 100000 + urun_sayisi)
+    urun_idx = np.tile(np.arange(urun_sayisi), magaza_sayisi)
+
+    satis = rng.poisson(2, n)
+    ciro = satis * rng.uniform(20, 500, urun_sayisi)[urun_idx]
+    stok_satis = pd.DataFrame({
+        'magaza_kod': np.repeat(magazalar, urun_sayisi),
+        'urun_kod': urunler[urun_idx],
+        'stok': rng.poisson(8, n),
+        'satis': satis,
+        'ciro': ciro,
+        'smm': ciro * rng.uniform(0.4, 0.8, n),
+    })
+    mg = rng.integers(1, 41, urun_sayisi)
+    urun_master = pd.DataFrame({
+        'urun_kod': urunler,
+        'kategori_kod': (mg - 1) // 5 * 10 + 10,
+        'mg': mg,
+        'umg': mg * 10 + rng.integers(0, 5, urun_sayisi),
+        'marka_kod': rng.integers(1, 200, urun_sayisi),
+    })
+    magaza_master = pd.DataFrame({
+        'magaza_kod': magazalar,
+        'bolge': [f"B{i % 8}" for i in magazalar],
+        'il': [f"IL{i % 60}" for i in magazalar],
+        'depo_kod': 9001 + magazalar % 4,
+    })
+    kpi = pd.DataFrame({
+        'mg_id': np.arange(1, 41),
+        'min_deger': rng.integers(2, 6, 40),
+        'max_deger': rng.integers(15, 30, 40),
+        'forward_cover': rng.integers(3, 8, 40),
+    })
+    depo_stok = pd.DataFrame({
+        'depo_kod': np.repeat(np.arange(9001, 9005), urun_sayisi),
+        'urun_kod': np.tile(urunler, 4),
+        'stok': rng.poisson(200, 4 * urun_sayisi),
+    })
+
+    # Dosyasız küp: tüm gruplar yüklü sayılır, stok grubu _hazirla'dan geçer
+    kup = KupVeri.__new__(KupVeri)
+    kup.veri_klasoru = None
+    kup.veri_versiyonu = f"sentetik-{magaza_sayisi}x{urun_sayisi}"
+    kup._ilerleme = None
+    kup._arka_plan = False
+    kup._tembel_durum_olustur(KupVeri.VERI_GRUPLARI)
+    for ad in ['trading', 'trading_detay', 'online_offline', 'cover_diagram', 'kapasite', 'siparis_takip']:
+        setattr(kup, ad, pd.DataFrame())
+    kup.sc_sayfalari = {}
+    kup.stok_satis, kup.urun_master, kup.magaza_master, kup.kpi, kup.depo_stok = (
+        stok_satis, urun_master, magaza_master, kpi, depo_stok
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        kup._hazirla()
+    return kup
+
+
+def _eski_ozet_metrikleri(kup: KupVeri) -> dict:
+    """Eski genel_ozet: her ölçü için ayrı sum + her durum için filtrelenmiş kopya"""
+    df = kup.stok_satis
+    metrik = {k: df[k].sum() for k in ['stok', 'satis', 'ciro', 'kar']}
+    for durum in STOK_DURUMLARI:
+        metrik[durum] = len(df[df['stok_durum'] == durum])
+    return metrik
+
+
+def _tek_gecis_metrikleri(kup: KupVeri) -> dict:
+    """Tek geçiş: kolonların birlikte toplamı + tek value_counts"""
+    df = kup.stok_satis
+    metrik = df[['stok', 'satis', 'ciro', 'kar']].sum().to_dict()
+    metrik.update(df['stok_durum'].value_counts().reindex(STOK_DURUMLARI, fill_value=0).to_dict())
+    return metrik
+
+
+def _toplam_metrikleri(kup: KupVeri) -> dict:
+    """Yükleme anında hesaplanan toplamlardan okuma (genel_ozet'in kullandığı yol)"""
+    toplam = kup.toplamlar().topla()
+    metrik = {k: toplam[k] for k in ['stok', 'satis', 'ciro', 'kar']}
+    metrik.update(kup.durum_sayilari().to_dict())
+    return metrik
+
+
+def genel_ozet_benchmark(magaza_sayisi: int, urun_sayisi: int, tekrar: int = 3):
+    print(f"\n📊 GENEL ÖZET - sentetik küp {magaza_sayisi:,} mağaza × {urun_sayisi:,} ürün "
+          f"({magaza_sayisi * urun_sayisi:,} satır, {tekrar} tekrar)")
+    print("=" * 72)
+
+    baslangic = time.perf_counter()
+    kup = sentetik_kup(magaza_sayisi, urun_sayisi)
+    print(f"   Küp hazırlandı (_hazirla + toplamlar): {time.perf_counter() - baslangic:.2f}s")
+
+    adaylar = [
+        ("Eski (4 sum + 4 filtre)", lambda: _eski_ozet_metrikleri(kup)),
+        ("Tek geçiş (sum + value_counts)", lambda: _tek_gecis_metrikleri(kup)),
+        ("Önceden hesaplanmış toplamlar", lambda: _toplam_metrikleri(kup)),
+    ]
+    sonuclar = [(ad, *_sure_olc(fonksiyon, tekrar)) for ad, fonksiyon in adaylar]
+
+    referans = sonuclar[0][1]
+    print(f"{'Yöntem':<38} | {'En iyi':>9} | {'Ort.':>9} | {'Hız':>8}")
+    print("-" * 72)
+    for ad, en_iyi, ortalama, _ in sonuclar:
+        print(f"{ad:<38} | {en_iyi * 1000:>7.1f}ms | {ortalama * 1000:>7.1f}ms | {referans / en_iyi:>7.1f}x")
+
+    # Tüm yöntemler aynı metrikleri vermeli
+    taban = sonuclar[0][3]
+    for ad, _, _, metrik in sonuclar[1:]:
+        farkli = [k for k in taban if not np.isclose(float(taban[k]), float(metrik[k]))]
+        print(f"   {ad}: {'✅ aynı' if not farkli else f'❌ farklı metrikler: {farkli}'}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        en_iyi, _, _ = _sure_olc(lambda: genel_ozet(kup), tekrar)
+    print(f"   genel_ozet aracı (rapor metni dahil): {en_iyi * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sanal Planner performans benchmark")
+    parser.add_argument("--bolum", choices=["hepsi", "excel", "ozet"], default="hepsi", help="Çalıştırılacak bölüm")
+    parser.add_argument("--excel", default=VARSAYILAN_EXCEL, help="Excel motorları için workbook")
+    parser.add_argument("--magaza", type=int, default=500, help="Sentetik küp mağaza sayısı")
+    parser.add_argument("--urun", type=int, default=4000, help="Sentetik küp ürün sayısı")
+    parser.add_argument("--tekrar", type=int, default=3, help="Her ölçüm için tekrar sayısı")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
+
+    if args.bolum in ("hepsi", "excel"):
+        print(f"🔧 Excel motorları: {list(EXCEL_MOTORLARI)} | calamine: {'var' if CALAMINE_AVAILABLE else 'yok'}")
+        if os.path.exists(args.excel):
+            excel_motorlari_benchmark(args.excel, args.tekrar)
+        elif args.bolum == "excel":
+            print(f"❌ Dosya bulunamadı: {args.excel}")
+            sys.exit(1)
+        else:
+            print(f"   ⚠️ Dosya bulunamadı, Excel bölümü atlandı: {args.excel}")
+
+    if args.bolum in ("hepsi", "ozet"):
+        genel_ozet_benchmark(args.magaza, args.urun, args.tekrar)
+
+
+if __name__ == "__main__":
+    main()
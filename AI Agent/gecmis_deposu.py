@@ -0,0 +1,537 @@
+"""
+Geçmiş Deposu - Haftalık küp anlık görüntüleri
+Hazırlanmış küpün her haftaki halini sıkıştırılmış Parquet olarak saklar
+
+Yüklenen dosyalar bir önceki haftanınkilerin üzerine yazıldığı için KupVeri
+yalnızca güncel haftayı bilir. Bu modül her küp yüklemesinde küpün özet
+görünümünü verinin ait olduğu ISO hafta bölümüne ekler; haftalık karşılaştırma
+ve trend araçları eski Excel dosyalarını yeniden okumadan bu bölümlerden çalışır.
+
+Hafta yükleme gününden değil veriden gelir (bkz. veri_haftasi): trading
+raporunun günlük satırlarındaki en son tarih, yoksa kaynak dosyaların en yeni
+değişiklik zamanı. Bir veri versiyonu herhangi bir haftada kayıtlıysa tekrar
+yazılmaz - değişmeyen dosyaların sonraki hafta yeniden yüklenmesi sahte hafta
+üretmez.
+
+Yapı (yalnızca ekleme - mevcut dosyalar hiç değiştirilmez):
+    <klasor>/hafta=2026-W42/stok_satis-20261019T101500-<versiyon>.parquet
+    <klasor>/hafta=2026-W42/magaza-20261019T101500-<versiyon>.parquet
+    <klasor>/hafta=2026-W42/ana_grup-20261019T101500-<versiyon>.parquet
+    <klasor>/hafta=2026-W42/manifest-20261019T101500-<versiyon>.json
+
+Aynı haftanın verisi yeniden yüklenirse (düzeltme) yeni dosyalar eklenir; okurken
+her haftanın en son manifest'i geçerlidir (tablolar hep aynı versiyondan gelir).
+
+Tablolar:
+- stok_satis: mağaza × ürün stok/satış/ciro (+ kategori, mg, bolge)
+- magaza:     kapasite raporundan mağaza doluluk/cover/stok/satış
+- ana_grup:   trading raporundan ana grup stok/satış/ciro/cover
+
+Yapılandırma:
+- SANAL_PLANNER_GECMIS_KLASORU ortam değişkeni (varsayılan: veri klasörünün
+  yanındaki 'gecmis' klasörü). Kalıcı bir diske işaret etmelidir.
+- pyarrow kurulu değilse geçmiş kaydedilmez, araçlar uyarı döner.
+
+Kullanım:
+    depo = gecmis_deposu(DATA_DIR)
+    depo.kaydet(kup)
+    depo.oku('stok_satis', haftalar=depo.haftalar()[-2:], kolonlar=['kategori_kod', 'stok'])
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Optional, List, Dict
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    print("⚠️ pyarrow yüklü değil - haftalık geçmiş deposu devre dışı")
+
+
+GECMIS_KLASORU = os.environ.get('SANAL_PLANNER_GECMIS_KLASORU', '')
+
+# Hafta toplamları önbelleği (bölüm dosyaları değişmediği için geçersiz kalmaz)
+TOPLAM_ONBELLEK_BOYUTU = 128
+
+GECMIS_TABLOLARI = ['stok_satis', 'magaza', 'ana_grup']
+
+# stok_satis anlık görüntüsüne alınan kolonlar (hepsi olmak zorunda değil)
+STOK_KOLONLARI = ['magaza_kod', 'urun_kod', 'kategori_kod', 'mg', 'bolge', 'stok', 'satis', 'ciro']
+
+# Bölüm klasörü: hafta=2026-W42
+HAFTA_DESENI = re.compile(r'^hafta=(\d{4}-W\d{2})$')
+SIKISTIRMA = 'zstd'
+# Yazım kilidi bu süreden eskiyse yazarken düşen worker'dan kalmıştır (sn)
+KILIT_ZAMAN_ASIMI = 300
+
+
+def eski_kilidi_temizle(kilit: str, sure: float = KILIT_ZAMAN_ASIMI) -> None:
+    """Yazarken düşen worker'dan kalan, `sure` saniyeden eski kilit dosyasını sil"""
+    try:
+        if time.time() - os.path.getmtime(kilit) > sure:
+            os.remove(kilit)
+    except OSError:
+        pass
+
+
+def iso_hafta(tarih: date = None) -> str:
+    """ISO hafta etiketi: 2026-W42"""
+    yil, hafta, _ = (tarih or date.today()).isocalendar()
+    return f"{yil}-W{hafta:02d}"
+
+
+def _rapor_tarihi(kup) -> Optional[date]:
+    """Trading raporunun günlük satırlarındaki (online/offline sayfası) en son tarih"""
+    df = getattr(kup, 'online_offline', None)
+    if df is None or len(df) == 0:
+        return None
+    kol = next((k for k in df.columns if str(k).strip().lower() in ('date', 'tarih')), None)
+    if kol is None:
+        return None
+    # '27.01.2026' metinleri ve Excel tarih hücreleri; ara toplam satırları NaT olur
+    tarihler = pd.to_datetime(df[kol], format='%d.%m.%Y', errors='coerce').dropna()
+    # Bozuk hücreler (uzak gelecek) haftayı kaydırmasın
+    tarihler = tarihler[tarihler <= pd.Timestamp(date.today()) + pd.Timedelta(days=7)]
+    return tarihler.max().date() if len(tarihler) else None
+
+
+def _kaynak_tarihi(kup) -> Optional[date]:
+    """Küpün okunduğu kaynak dosyaların en yeni değişiklik zamanı"""
+    zamanlar = [
+        zaman for imza in getattr(kup, '_parmak_izleri', {}).values()
+        for _, _, zaman in imza if zaman > 0
+    ]
+    return date.fromtimestamp(max(zamanlar) / 1e9) if zamanlar else None
+
+
+def veri_haftasi(kup) -> str:
+    """
+    Küp verisinin ait olduğu ISO hafta (yükleme günü değil)
+
+    Önce trading raporundaki en son gün, yoksa kaynak dosyaların en yeni
+    değişiklik zamanı; ikisi de yoksa bugün.
+    """
+    try:
+        tarih = _rapor_tarihi(kup)
+    except Exception as e:
+        print(f"   ⚠️ Rapor tarihi okunamadı: {e}")
+        tarih = None
+    return iso_hafta(tarih or _kaynak_tarihi(kup))
+
+
+# =============================================================================
+# ANLIK GÖRÜNTÜ - küpten özet tablolar
+# =============================================================================
+
+def _kolon_bul(kolonlar: list, *anahtar_setleri) -> Optional[str]:
+    """Anahtar kelimelerin hepsini içeren ilk kolon (setler sırayla denenir)"""
+    for anahtarlar in anahtar_setleri:
+        for kol in kolonlar:
+            kol_lower = str(kol).lower().replace('_', ' ').replace('#', '')
+            if all(k in kol_lower for k in anahtarlar):
+                return kol
+    return None
+
+
+def _sayi(seri: pd.Series) -> pd.Series:
+    """'12,5' / '%85' gibi Excel metinlerini sayıya çevir (okunamayan = 0)"""
+    if pd.api.types.is_numeric_dtype(seri):
+        return seri.astype('float64').fillna(0)
+    metin = seri.astype(str).str.replace('%', '', regex=False).str.replace(',', '.', regex=False).str.strip()
+    return pd.to_numeric(metin, errors='coerce').fillna(0)
+
+
+def _stok_satis_goruntusu(kup) -> Optional[pd.DataFrame]:
+    df = getattr(kup, 'stok_satis', None)
+    if df is None or len(df) == 0:
+        return None
+    kolonlar = [k for k in STOK_KOLONLARI if k in df.columns]
+    gorunum = df[kolonlar].copy()
+    for kol in ('magaza_kod', 'urun_kod', 'kategori_kod', 'mg'):
+        if kol in gorunum.columns:
+            gorunum[kol] = pd.to_numeric(gorunum[kol], errors='coerce').fillna(0).astype('int64')
+    for kol in ('stok', 'satis', 'ciro'):
+        if kol in gorunum.columns:
+            gorunum[kol] = pd.to_numeric(gorunum[kol], errors='coerce').fillna(0).astype('float64')
+    if 'bolge' in gorunum.columns:
+        gorunum['bolge'] = gorunum['bolge'].astype(str)
+    # Sıralı yazım: daha iyi sıkıştırma + row group istatistikleriyle filtre atlama
+    sira = [k for k in ('kategori_kod', 'magaza_kod', 'urun_kod') if k in gorunum.columns]
+    return gorunum.sort_values(sira, kind='stable').reset_index(drop=True)
+
+
+def _magaza_goruntusu(kup) -> Optional[pd.DataFrame]:
+    """Kapasite raporundan mağaza doluluğu (kapasite_analiz ile aynı kolon eşleme)"""
+    df = getattr(kup, 'kapasite', None)
+    if df is None or len(df) == 0:
+        return None
+    kolonlar = list(df.columns)
+    col_magaza = (_kolon_bul(kolonlar, ['storename'], ['store name'], ['mağaza ad'], ['mağaza'])
+                  or kolonlar[0])
+    col_kapasite_dm3 = _kolon_bul(kolonlar, ['store', 'capacity', 'dm3'], ['capacity', 'dm3'], ['kapasite'])
+    col_eop_stok_dm3 = _kolon_bul(kolonlar, ['eop', 'ty', 'store', 'stock', 'dm3'],
+                                  ['eop', 'store', 'stock', 'dm3'], ['store', 'stock', 'dm3'])
+    col_fiili = _kolon_bul(kolonlar, ['fiili', 'doluluk'])
+    col_cover = _kolon_bul(kolonlar, ['store', 'cover'], ['cover'])
+    col_stok = _kolon_bul(kolonlar, ['avg', 'store', 'stock', 'unit'], ['stok', 'adet'])
+    col_satis = _kolon_bul(kolonlar, ['sales', 'unit'], ['satış', 'adet'])
+
+    gorunum = pd.DataFrame({'magaza': df[col_magaza].astype(str).str.strip()})
+    if col_eop_stok_dm3 and col_kapasite_dm3:
+        kapasite = _sayi(df[col_kapasite_dm3])
+        gorunum['doluluk'] = np.where(kapasite > 0, _sayi(df[col_eop_stok_dm3]) / kapasite.where(kapasite > 0, 1) * 100, 0)
+    elif col_fiili:
+        doluluk = _sayi(df[col_fiili])
+        # 0.85 gibi oran olarak gelen değerler yüzdeye çevrilir
+        gorunum['doluluk'] = np.where((doluluk.abs() < 2) & (doluluk != 0), doluluk * 100, doluluk)
+    for ad, kol in (('cover', col_cover), ('stok', col_stok), ('satis', col_satis)):
+        if kol:
+            gorunum[ad] = _sayi(df[kol]).to_numpy()
+    gorunum = gorunum[gorunum['magaza'].str.len() > 0]
+    return gorunum.drop_duplicates('magaza', keep='first').reset_index(drop=True)
+
+
+def _ana_grup_goruntusu(kup) -> Optional[pd.DataFrame]:
+    """Trading raporundan ana grup toplamları (cover = stok / satış)"""
+    df = getattr(kup, 'trading', None)
+    if df is None or len(df) == 0:
+        return None
+    kolonlar = [str(c).strip() for c in df.columns]
+    df = df.set_axis(kolonlar, axis=1)
+    col_ana = next((k for k in kolonlar if 'ana grup' in k.lower() or 'ana_grup' in k.lower()
+                    or k.lower() in ('maingroupdesc', 'main group desc', 'main group')), None)
+    col_stok = _kolon_bul(kolonlar, ['ty', 'avg', 'store', 'stock', 'unit'], ['ty', 'store', 'stock'])
+    col_satis = _kolon_bul(kolonlar, ['ty', 'sales', 'unit'])
+    col_ciro = _kolon_bul(kolonlar, ['ty', 'sales', 'value'])
+    if col_ana is None or not (col_stok or col_satis):
+        return None
+
+    grup = df[col_ana].astype(str).str.strip()
+    # Toplam/ara toplam satırları ve boş gruplar alınmaz
+    gecerli = (grup != '') & (grup.str.lower() != 'nan') & ~grup.str.lower().str.contains('total|toplam')
+    gorunum = pd.DataFrame({'ana_grup': grup[gecerli]})
+    for ad, kol in (('stok', col_stok), ('satis', col_satis), ('ciro', col_ciro)):
+        if kol:
+            gorunum[ad] = _sayi(df.loc[gecerli, kol]).to_numpy()
+    gorunum = gorunum.groupby('ana_grup', sort=True).sum().reset_index()
+    if 'stok' in gorunum.columns and 'satis' in gorunum.columns:
+        gorunum['cover'] = np.where(gorunum['satis'] > 0, gorunum['stok'] / gorunum['satis'].where(gorunum['satis'] > 0, 1), 0)
+    return gorunum
+
+
+def anlik_goruntu(kup) -> Dict[str, pd.DataFrame]:
+    """Küpün geçmişe yazılacak özet tabloları (boş olanlar atlanır)"""
+    uretecler = {
+        'stok_satis': _stok_satis_goruntusu,
+        'magaza': _magaza_goruntusu,
+        'ana_grup': _ana_grup_goruntusu,
+    }
+    tablolar = {}
+    for ad, uretec in uretecler.items():
+        try:
+            tablo = uretec(kup)
+        except Exception as e:
+            print(f"   ⚠️ Geçmiş görüntüsü oluşturulamadı ({ad}): {e}")
+            continue
+        if tablo is not None and len(tablo) > 0:
+            tablolar[ad] = tablo
+    return tablolar
+
+
+# =============================================================================
+# DEPO
+# =============================================================================
+
+class GecmisDeposu:
+    """
+    ISO hafta bölümlü, yalnızca eklemeli Parquet geçmişi
+
+    - kaydet(): küpün anlık görüntüsünü bu haftanın bölümüne ekler
+    - haftalar(): kayıtlı haftalar (eskiden yeniye)
+    - oku(): yalnızca istenen hafta bölümlerini ve kolonları okur
+    - topla(): bir haftanın grup toplamlarını Arrow içinde hesaplar (önbellekli)
+    """
+
+    def __init__(self, klasor: str):
+        self.klasor = klasor
+        self._kilit = threading.Lock()
+        # (hafta, manifest adı) -> manifest içeriği
+        self._manifestler: Dict[tuple, dict] = {}
+        # (dosya, boyutlar, ölçüler) -> toplam DataFrame
+        self._toplamlar: OrderedDict = OrderedDict()
+
+    def _hafta_klasoru(self, hafta: str) -> str:
+        return os.path.join(self.klasor, f"hafta={hafta}")
+
+    def haftalar(self) -> List[str]:
+        """Tamamlanmış (manifest'i yazılmış) haftalar, eskiden yeniye"""
+        try:
+            klasorler = os.listdir(self.klasor)
+        except OSError:
+            return []
+        haftalar = []
+        for ad in klasorler:
+            eslesme = HAFTA_DESENI.match(ad)
+            if eslesme and self._son_manifest_adi(eslesme.group(1)):
+                haftalar.append(eslesme.group(1))
+        return sorted(haftalar)
+
+    def _son_manifest_adi(self, hafta: str) -> Optional[str]:
+        try:
+            adlar = [f for f in os.listdir(self._hafta_klasoru(hafta))
+                     if f.startswith('manifest-') and f.endswith('.json')]
+        except OSError:
+            return None
+        # Ad: manifest-<zaman damgası>-<versiyon>.json → sözlük sırası = zaman sırası
+        return max(adlar) if adlar else None
+
+    def manifest(self, hafta: str) -> Optional[dict]:
+        """Haftanın geçerli (en son) anlık görüntüsü"""
+        ad = self._son_manifest_adi(hafta)
+        if ad is None:
+            return None
+        anahtar = (hafta, ad)
+        with self._kilit:
+            if anahtar not in self._manifestler:
+                with open(os.path.join(self._hafta_klasoru(hafta), ad), encoding='utf-8') as f:
+                    self._manifestler[anahtar] = json.load(f)
+            return self._manifestler[anahtar]
+
+    def versiyon_haftasi(self, versiyon: str) -> Optional[str]:
+        """Veri versiyonunun kayıtlı olduğu hafta (manifest adından - dosya okunmaz)"""
+        try:
+            klasorler = sorted(os.listdir(self.klasor))
+        except OSError:
+            return None
+        sonek = f"-{versiyon}.json"
+        for ad in klasorler:
+            eslesme = HAFTA_DESENI.match(ad)
+            if not eslesme:
+                continue
+            try:
+                dosyalar = os.listdir(os.path.join(self.klasor, ad))
+            except OSError:
+                continue
+            if any(f.startswith('manifest-') and f.endswith(sonek) for f in dosyalar):
+                return eslesme.group(1)
+        return None
+
+    def kaydet(self, kup, hafta: str = None) -> Optional[str]:
+        """
+        Küpün anlık görüntüsünü verinin haftasının bölümüne ekle
+
+        hafta verilmezse veri_haftasi(kup) kullanılır. Aynı veri versiyonu
+        herhangi bir haftada zaten kayıtlıysa tekrar yazılmaz. Tablolar önce
+        geçici adla yazılıp rename edilir; manifest en son yazılır - yarım
+        kalan bir kayıt okuyuculara hiç görünmez.
+
+        Returns:
+            Yazılan manifest yolu, yazılmadıysa None
+        """
+        if not PYARROW_AVAILABLE or not self.klasor:
+            return None
+
+        versiyon = getattr(kup, 'veri_versiyonu', None) or 'bilinmiyor'
+        if self.versiyon_haftasi(versiyon) is not None:
+            return None
+        hafta = hafta or veri_haftasi(kup)
+        hedef = self._hafta_klasoru(hafta)
+
+        os.makedirs(hedef, exist_ok=True)
+        # Aynı versiyonu aynı anda yalnızca bir worker yazar
+        kilit = os.path.join(hedef, f".{versiyon}.kilit")
+        # Yazarken düşen worker'ın kilidi bu versiyonun kaydını kalıcı olarak engellemesin
+        eski_kilidi_temizle(kilit)
+        try:
+            fd = os.open(kilit, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            print(f"   ℹ️ Haftalık geçmiş başka bir worker tarafından yazılıyor: {hafta} ({versiyon})")
+            return None
+
+        baslangic = time.time()
+        damga = time.strftime('%Y%m%dT%H%M%S')
+        try:
+            os.close(fd)
+            tablolar = anlik_goruntu(kup)
+            if not tablolar:
+                return None
+            dosyalar = {}
+            for ad, df in tablolar.items():
+                dosya = f"{ad}-{damga}-{versiyon}.parquet"
+                gecici = os.path.join(hedef, f".{dosya}.tmp-{os.getpid()}")
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), gecici,
+                               compression=SIKISTIRMA, row_group_size=256_000)
+                os.replace(gecici, os.path.join(hedef, dosya))
+                dosyalar[ad] = {'dosya': dosya, 'satir': len(df)}
+
+            meta = {
+                'hafta': hafta,
+                'veri_versiyonu': versiyon,
+                'veri_klasoru': getattr(kup, 'veri_klasoru', None),
+                'tablolar': dosyalar,
+                'olusturma': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            manifest_yolu = os.path.join(hedef, f"manifest-{damga}-{versiyon}.json")
+            gecici = f"{manifest_yolu}.tmp-{os.getpid()}"
+            with open(gecici, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.replace(gecici, manifest_yolu)
+
+            boyut = sum(os.path.getsize(os.path.join(hedef, d['dosya'])) for d in dosyalar.values())
+            satirlar = ', '.join(f"{ad}={d['satir']:,}" for ad, d in dosyalar.items())
+            print(f"   🗄️ Haftalık geçmiş kaydedildi: {hafta} ({satirlar}, "
+                  f"{boyut / 1024 / 1024:.1f} MB, {time.time() - baslangic:.1f} sn)")
+            return manifest_yolu
+        except Exception as e:
+            print(f"   ⚠️ Haftalık geçmiş kaydedilemedi: {e}")
+            return None
+        finally:
+            try:
+                os.remove(kilit)
+            except OSError:
+                pass
+
+    def _tablo_yolu(self, hafta: str, tablo: str) -> Optional[str]:
+        meta = self.manifest(hafta)
+        if meta is None or tablo not in meta['tablolar']:
+            return None
+        return os.path.join(self._hafta_klasoru(hafta), meta['tablolar'][tablo]['dosya'])
+
+    def topla(self, tablo: str, hafta: str, boyutlar: List[str], olculer: List[str]) -> pd.DataFrame:
+        """
+        Haftanın tablosunu boyutlara göre topla - index: boyutlar, kolonlar: ölçüler
+
+        Yalnızca gereken kolonlar okunur, gruplama Arrow'da yapılır; pandas'a
+        yalnızca grup sayısı kadar satır çevrilir. Boyut yoksa tek satırlık toplam.
+        Tabloda olmayan boyut/ölçü varsa (veya hafta kayıtsızsa) boş DataFrame.
+        """
+        yol = self._tablo_yolu(hafta, tablo) if PYARROW_AVAILABLE else None
+        if yol is None:
+            return pd.DataFrame()
+        anahtar = (yol, tuple(boyutlar), tuple(olculer))
+        with self._kilit:
+            if anahtar in self._toplamlar:
+                self._toplamlar.move_to_end(anahtar)
+                return self._toplamlar[anahtar]
+
+        mevcut = pq.read_schema(yol).names
+        olculer = [k for k in olculer if k in mevcut]
+        if not olculer or not set(boyutlar).issubset(mevcut):
+            return pd.DataFrame()
+        veri = pq.read_table(yol, columns=list(boyutlar) + olculer)
+        if boyutlar:
+            toplam = veri.group_by(list(boyutlar)).aggregate([(k, 'sum') for k in olculer])
+            sonuc = toplam.to_pandas().rename(columns={f"{k}_sum": k for k in olculer})
+            sonuc = sonuc.set_index(list(boyutlar))[olculer]
+        else:
+            sonuc = pd.DataFrame({k: [pa.compute.sum(veri[k]).as_py() or 0] for k in olculer})
+
+        with self._kilit:
+            self._toplamlar[anahtar] = sonuc
+            while len(self._toplamlar) > TOPLAM_ONBELLEK_BOYUTU:
+                self._toplamlar.popitem(last=False)
+        return sonuc
+
+    def oku(self, tablo: str, haftalar: List[str] = None, kolonlar: List[str] = None,
+            filtre: list = None) -> pd.DataFrame:
+        """
+        Hafta bölümlerinden tablo oku - 'hafta' kolonu eklenir
+
+        haftalar: okunacak haftalar (None = hepsi); kayıtsız haftalar atlanır
+        kolonlar: yalnızca bu kolonlar diskten okunur (olmayanlar yok sayılır)
+        filtre: pyarrow filtre ifadesi, ör. [('kategori_kod', '=', 10)] - row
+                group istatistikleriyle eşleşmeyen bloklar okunmaz
+        """
+        if not PYARROW_AVAILABLE:
+            return pd.DataFrame()
+        parcalar = []
+        for hafta in (haftalar if haftalar is not None else self.haftalar()):
+            yol = self._tablo_yolu(hafta, tablo)
+            if yol is None:
+                continue
+            mevcut = pq.read_schema(yol).names
+            secili = [k for k in kolonlar if k in mevcut] if kolonlar is not None else None
+            parca = pq.read_table(yol, columns=secili, filters=filtre)
+            parca = parca.append_column('hafta', pa.array([hafta] * parca.num_rows, pa.string()))
+            parcalar.append(parca)
+        if not parcalar:
+            return pd.DataFrame()
+        # Haftalar arasında şema farkı (eklenen/çıkan kolon) null ile doldurulur
+        return pa.concat_tables(parcalar, promote_options='default').to_pandas()
+
+    def haftalik_matris(self, tablo: str, haftalar: List[str], anahtarlar: List[str], olcu: str,
+                        hedef: np.ndarray) -> np.ndarray:
+        """
+        Ölçünün (hedef anahtar × hafta) matrisi - satır sırası `hedef` ile aynı
+
+        anahtarlar: iki tamsayı kod kolonu, ör. ['magaza_kod', 'urun_kod']
+        hedef: birlesik_anahtar() ile üretilmiş tekil int64 anahtarlar
+        Haftada kaydı olmayan hücre NaN; aynı anahtarın tekrarları toplanır.
+        Her hafta yalnızca üç kolon okunur ve hash ile hizalanır (join/pivot yok).
+        """
+        matris = np.full((len(hedef), len(haftalar)), np.nan)
+        if not PYARROW_AVAILABLE or len(hedef) == 0:
+            return matris
+        hedef_index = pd.Index(hedef)
+        for j, hafta in enumerate(haftalar):
+            yol = self._tablo_yolu(hafta, tablo)
+            if yol is None or not set(anahtarlar + [olcu]).issubset(pq.read_schema(yol).names):
+                continue
+            veri = pq.read_table(yol, columns=anahtarlar + [olcu])
+            anahtar = birlesik_anahtar(veri[anahtarlar[0]].to_numpy(), veri[anahtarlar[1]].to_numpy())
+            konum = hedef_index.get_indexer(anahtar)
+            var = konum >= 0
+            if not var.any():
+                continue
+            degerler = np.nan_to_num(veri[olcu].to_numpy().astype('float64'))[var]
+            toplam = np.bincount(konum[var], weights=degerler, minlength=len(hedef))
+            bulunan = np.bincount(konum[var], minlength=len(hedef)) > 0
+            matris[bulunan, j] = toplam[bulunan]
+        return matris
+
+
+def birlesik_anahtar(ust, alt) -> np.ndarray:
+    """İki tamsayı kodu tek int64 anahtara çevir (ust << 32 | alt) - alt kod 2^32'den küçük olmalı"""
+    return (np.asarray(ust, dtype='int64') << 32) | np.asarray(alt, dtype='int64')
+
+
+_depolar: Dict[str, GecmisDeposu] = {}
+_depolar_kilit = threading.Lock()
+
+
+def gecmis_klasoru(veri_klasoru: str) -> str:
+    """Geçmiş klasörü: ortam değişkeni, yoksa veri klasörünün yanındaki 'gecmis'"""
+    if GECMIS_KLASORU:
+        return GECMIS_KLASORU
+    return os.path.join(os.path.dirname(os.path.abspath(veri_klasoru)), 'gecmis')
+
+
+def gecmis_deposu(veri_klasoru: str) -> GecmisDeposu:
+    """Veri klasörüne ait geçmiş deposu (süreç başına tek nesne)"""
+    klasor = gecmis_klasoru(veri_klasoru)
+    with _depolar_kilit:
+        if klasor not in _depolar:
+            _depolar[klasor] = GecmisDeposu(klasor)
+        return _depolar[klasor]
+
+
+def gecmise_kaydet(kup, hafta: str = None) -> Optional[str]:
+    """Küpü kendi veri klasörünün geçmiş deposuna ekle (hata küp yüklemesini bozmaz)"""
+    if not PYARROW_AVAILABLE or kup is None or not getattr(kup, 'veri_klasoru', None):
+        return None
+    try:
+        return gecmis_deposu(kup.veri_klasoru).kaydet(kup, hafta)
+    except Exception as e:
+        print(f"   ⚠️ Haftalık geçmiş kaydedilemedi: {e}")
+        return None
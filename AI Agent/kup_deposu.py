@@ -0,0 +1,477 @@
+"""
+Kup Deposu - Çoklu worker için paylaşımlı küp
+Sanal Planner veri küpünü Arrow IPC dosyalarına yazar, worker'lar bağlanır
+
+Load balancer arkasında birden fazla uygulama süreci çalışırken her süreç
+KupVeri'yi ayrı ayrı parse edip hazırlamasın diye:
+1. İlk worker küpü hazırlar ve veri versiyonu klasörüne Arrow IPC olarak yazar
+2. Diğer worker'lar aynı versiyon klasörünü memory-map ile açar (parse yok)
+3. Sayfalar işletim sisteminin page cache'inden paylaşılır - worker başına
+   bellek yaklaşık sabit kalır
+
+Yapılandırma:
+- SANAL_PLANNER_PAYLASIM_KLASORU ortam değişkeni (örn. /dev/shm/sanal_planner)
+  tanımlı değilse veya pyarrow kurulu değilse normal KupVeri yüklemesi yapılır.
+
+Kullanım:
+    kup = paylasimli_kup_yukle(DATA_DIR)
+
+    yonetici = KupYoneticisi(DATA_DIR)
+    yonetici.yenile()                 # arka planda yükle
+    with yonetici.kiralik() as kup:   # çalışma bitene kadar bu versiyon yaşar
+        ...
+"""
+
+import os
+import json
+import time
+import shutil
+import pickle
+import threading
+import pandas as pd
+from typing import Optional, Callable
+from contextlib import contextmanager
+
+from agent_tools import KupVeri, veri_versiyonu_hesapla
+from gecmis_deposu import gecmise_kaydet, eski_kilidi_temizle
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+    print("⚠️ pyarrow yüklü değil - paylaşımlı küp devre dışı")
+
+
+PAYLASIM_KLASORU = os.environ.get('SANAL_PLANNER_PAYLASIM_KLASORU', '')
+
+# Hazırlanmış (_hazirla sonrası) DataFrame tabloları
+KUP_TABLOLARI = [
+    'stok_satis', 'urun_master', 'magaza_master', 'depo_stok', 'kpi',
+    'trading', 'trading_detay', 'online_offline',
+    'cover_diagram', 'kapasite', 'siparis_takip',
+]
+
+# Hazırlayan worker kilidin değişiklik zamanını bu aralıkla yeniler (sn)
+KILIT_YENILEME_ARALIGI = 10
+# Bu süredir yenilenmeyen kilit düşen worker'dan kalmıştır (sn) - yükleme süresinden
+# bağımsızdır; bekleyenler kilit yenilendiği sürece bekler
+KILIT_ESKIME_SURESI = 90
+# Diskte tutulacak eski versiyon sayısı (bağlı worker'lar için)
+TUTULACAK_VERSIYON = 2
+
+
+# =============================================================================
+# YAZMA
+# =============================================================================
+
+def _tablo_yaz(df: pd.DataFrame, hedef_klasor: str, ad: str) -> str:
+    """DataFrame'i Arrow IPC olarak yaz - Arrow'a çevrilemezse pickle"""
+    try:
+        tablo = pa.Table.from_pandas(df)
+        with pa.OSFile(os.path.join(hedef_klasor, f"{ad}.arrow"), 'wb') as sink:
+            with pa.ipc.new_file(sink, tablo.schema) as writer:
+                writer.write_table(tablo)
+        return 'arrow'
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError) as e:
+        # Excel'den gelen karışık tipli kolonlar (örn. sayı + metin) Arrow'a sığmaz
+        print(f"   ℹ️ {ad} Arrow'a çevrilemedi ({e}), pickle kullanılıyor")
+        with open(os.path.join(hedef_klasor, f"{ad}.pkl"), 'wb') as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return 'pickle'
+
+
+def kup_yayinla(kup: KupVeri, klasor: str = PAYLASIM_KLASORU) -> Optional[str]:
+    """
+    Hazırlanmış küpü paylaşım klasörüne yaz
+
+    Önce geçici klasöre yazılır, sonra tek rename ile yayınlanır - yarım
+    yazılmış bir versiyona hiçbir worker bağlanamaz.
+
+    Returns:
+        Yayınlanan versiyon klasörü, hata olursa None
+    """
+    if not PYARROW_AVAILABLE or not klasor:
+        return None
+
+    hedef = os.path.join(klasor, kup.veri_versiyonu)
+    if os.path.isdir(hedef):
+        return hedef
+
+    gecici = f"{hedef}.tmp-{os.getpid()}"
+    baslangic = time.time()
+    try:
+        os.makedirs(gecici, exist_ok=True)
+        formatlar = {}
+        for ad in KUP_TABLOLARI:
+            df = getattr(kup, ad, None)
+            if df is None:
+                df = pd.DataFrame()
+            formatlar[ad] = _tablo_yaz(df, gecici, ad)
+
+        with open(os.path.join(gecici, "sc_sayfalari.pkl"), 'wb') as f:
+            pickle.dump(getattr(kup, 'sc_sayfalari', {}), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        meta = {
+            'veri_klasoru': kup.veri_klasoru,
+            'veri_versiyonu': kup.veri_versiyonu,
+            'tablolar': formatlar,
+            # yenile() için kaynak parmak izleri ve ham stok kolonları
+            'parmak_izleri': getattr(kup, '_parmak_izleri', {}),
+            'ham_stok_kolonlari': getattr(kup, '_ham_stok_kolonlari', None),
+            'ham_stok_satir': getattr(kup, '_ham_stok_satir', -1),
+            'olusturma': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with open(os.path.join(gecici, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        try:
+            os.rename(gecici, hedef)
+        except OSError as e:
+            shutil.rmtree(gecici, ignore_errors=True)
+            if not os.path.isdir(hedef):
+                # İzin, disk dolu vb. - yayınlanan bir versiyon yok
+                print(f"   ⚠️ Küp paylaşıma yazılamadı: {e}")
+                return None
+            # Başka worker aynı anda yayınladı - onunki kullanılır
+
+        print(f"   📤 Küp paylaşıma yazıldı: {hedef} ({time.time() - baslangic:.1f} sn)")
+        eski_versiyonlari_temizle(klasor)
+        return hedef
+    except Exception as e:
+        print(f"   ⚠️ Küp paylaşıma yazılamadı: {e}")
+        shutil.rmtree(gecici, ignore_errors=True)
+        return None
+
+
+def eski_versiyonlari_temizle(klasor: str = PAYLASIM_KLASORU, tut: int = TUTULACAK_VERSIYON):
+    """En yeni `tut` versiyon dışındakileri sil (bağlı worker'ların mmap'i açık kalır)"""
+    try:
+        versiyonlar = [
+            os.path.join(klasor, d) for d in os.listdir(klasor)
+            if os.path.isdir(os.path.join(klasor, d)) and '.tmp-' not in d
+        ]
+    except OSError:
+        return
+    versiyonlar.sort(key=os.path.getmtime, reverse=True)
+    for eski in versiyonlar[tut:]:
+        shutil.rmtree(eski, ignore_errors=True)
+        print(f"   🗑️ Eski küp versiyonu silindi: {os.path.basename(eski)}")
+
+
+# =============================================================================
+# BAĞLANMA
+# =============================================================================
+
+def _tablo_oku(kaynak_klasor: str, ad: str, bicim: str) -> pd.DataFrame:
+    """Arrow tablosunu memory-map ile aç (kopyasız), pickle ise normal oku"""
+    if bicim == 'pickle':
+        with open(os.path.join(kaynak_klasor, f"{ad}.pkl"), 'rb') as f:
+            return pickle.load(f)
+
+    kaynak = pa.memory_map(os.path.join(kaynak_klasor, f"{ad}.arrow"), 'r')
+    tablo = pa.ipc.open_file(kaynak).read_all()
+    # split_blocks: kolonlar tek bloğa birleştirilmez, sayısal kolonlar
+    # mmap buffer'ını doğrudan kullanabilir
+    return tablo.to_pandas(split_blocks=True)
+
+
+def kup_baglan(veri_versiyonu: str, klasor: str = PAYLASIM_KLASORU) -> Optional[KupVeri]:
+    """
+    Yayınlanmış küp versiyonuna bağlan
+
+    Returns:
+        Parse edilmeden oluşturulmuş KupVeri, versiyon yoksa None
+    """
+    if not PYARROW_AVAILABLE or not klasor:
+        return None
+
+    kaynak = os.path.join(klasor, veri_versiyonu)
+    meta_path = os.path.join(kaynak, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    try:
+        baslangic = time.time()
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+
+        # _yukle/_hazirla çalıştırmadan boş küp oluştur
+        kup = KupVeri.__new__(KupVeri)
+        kup.veri_klasoru = meta['veri_klasoru']
+        kup.veri_versiyonu = meta['veri_versiyonu']
+        kup._ilerleme = None
+        kup._arka_plan = False
+        kup._parmak_izleri = meta.get('parmak_izleri', {})
+        # Depodaki küp tüm gruplarıyla hazır - tembel yükleme tetiklenmez
+        kup._tembel_durum_olustur(KupVeri.VERI_GRUPLARI)
+        kup._ham_stok_kolonlari = meta.get('ham_stok_kolonlari')
+        kup._ham_stok_satir = meta.get('ham_stok_satir', -1)
+        for ad, bicim in meta['tablolar'].items():
+            setattr(kup, ad, _tablo_oku(kaynak, ad, bicim))
+        with open(os.path.join(kaynak, "sc_sayfalari.pkl"), 'rb') as f:
+            kup.sc_sayfalari = pickle.load(f)
+
+        print(f"   📥 Paylaşımlı küpe bağlanıldı: {veri_versiyonu} "
+              f"({len(kup.stok_satis):,} stok satırı, {time.time() - baslangic:.2f} sn)")
+        return kup
+    except Exception as e:
+        print(f"   ⚠️ Paylaşımlı küpe bağlanılamadı: {e}")
+        return None
+
+
+def _kup_olustur(veri_klasoru: str, ilerleme=None, onceki: Optional[KupVeri] = None,
+                 gruplar=None) -> KupVeri:
+    """
+    Önceki küp aynı klasördense artımlı yenile, değilse yeni küp oluştur
+
+    gruplar: dönmeden önce bu thread'de yüklenecek veri grupları (None = hepsi).
+    Diğerleri tembel kalır; kaynak parmak izleri küp oluşturulurken
+    sabitlendiği için sonradan değişen dosyalardan yüklenmezler. Grup
+    yüklenemezse hata yükselir (yarım küp hazır sayılmaz).
+    """
+    if onceki is not None and onceki.veri_klasoru == veri_klasoru and hasattr(onceki, '_parmak_izleri'):
+        kup = onceki.yenile(ilerleme=ilerleme)
+    else:
+        kup = KupVeri(veri_klasoru, ilerleme=ilerleme, arka_plan=False)
+    for grup in (KupVeri.VERI_GRUPLARI if gruplar is None else gruplar):
+        kup._grup_yukle(grup)
+    return kup
+
+
+def _kilidi_canli_tut(kilit: str, durdur: threading.Event):
+    """Küp hazırlanırken kilidin değişiklik zamanını yenile - bekleyenler kilidi eski saymaz"""
+    while not durdur.wait(KILIT_YENILEME_ARALIGI):
+        try:
+            os.utime(kilit)
+        except OSError:
+            return
+
+
+def paylasimli_kup_yukle(veri_klasoru: str, veri_versiyonu: str = None,
+                         klasor: str = PAYLASIM_KLASORU,
+                         ilerleme: Optional[Callable[[int, str], None]] = None,
+                         onceki: Optional[KupVeri] = None, gruplar=None) -> KupVeri:
+    """
+    Küpü paylaşımdan al, yoksa yükleyip paylaşıma yaz
+
+    onceki verilirse küp sıfırdan değil onceki.yenile() ile (yalnızca
+    değişen kaynaklar okunarak) oluşturulur. Paylaşım yoksa yalnızca
+    `gruplar` yüklenir (bkz. _kup_olustur); paylaşıma yazılan küp her zaman
+    tüm gruplarıyla hazırlanır.
+
+    Aynı versiyonu aynı anda yalnızca bir worker hazırlar (kilit dosyası);
+    diğerleri yayınlanmasını bekleyip bağlanır.
+    """
+    if not PYARROW_AVAILABLE or not klasor:
+        return _kup_olustur(veri_klasoru, ilerleme, onceki, gruplar)
+
+    veri_versiyonu = veri_versiyonu or veri_versiyonu_hesapla(veri_klasoru)
+    kup = kup_baglan(veri_versiyonu, klasor)
+    if kup is not None:
+        return kup
+
+    os.makedirs(klasor, exist_ok=True)
+    kilit = os.path.join(klasor, f"{veri_versiyonu}.kilit")
+    bekleme_bildirildi = False
+    while True:
+        # Hazırlarken düşen (kilidi yenilemeyi bırakan) worker'dan kalan kilidi temizle
+        eski_kilidi_temizle(kilit, KILIT_ESKIME_SURESI)
+        try:
+            fd = os.open(kilit, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            pass
+        # Başka worker hazırlıyor - kilidi yenilediği sürece bekle
+        if not bekleme_bildirildi:
+            print(f"   ⏳ Küp başka bir worker tarafından hazırlanıyor, bekleniyor...")
+            bekleme_bildirildi = True
+        while os.path.exists(kilit):
+            eski_kilidi_temizle(kilit, KILIT_ESKIME_SURESI)
+            time.sleep(0.5)
+        kup = kup_baglan(veri_versiyonu, klasor)
+        if kup is not None:
+            return kup
+        # Hazırlayan worker düştü veya yayınlayamadı - kilidi alıp kendimiz hazırlarız
+
+    durdur = threading.Event()
+    threading.Thread(target=_kilidi_canli_tut, args=(kilit, durdur),
+                     name="kup-kilit-yenileme", daemon=True).start()
+    try:
+        os.close(fd)
+        # Kilidi almadan hemen önce başka worker yayınlamış olabilir
+        kup = kup_baglan(veri_versiyonu, klasor)
+        if kup is not None:
+            return kup
+        kup = _kup_olustur(veri_klasoru, ilerleme, onceki)
+        if ilerleme:
+            ilerleme(95, "Paylaşımlı depoya yazılıyor")
+        if kup.veri_versiyonu == veri_versiyonu and kup_yayinla(kup, klasor):
+            # Kendi kopyamızı bırakıp mmap'e bağlan - tüm worker'lar aynı sayfaları paylaşır
+            paylasimli = kup_baglan(veri_versiyonu, klasor)
+            if paylasimli is not None:
+                return paylasimli
+        return kup
+    finally:
+        durdur.set()
+        try:
+            os.remove(kilit)
+        except OSError:
+            pass
+
+
+# =============================================================================
+# ARKA PLAN YÜKLEME + ATOMİK DEĞİŞİM
+# =============================================================================
+
+class KupYoneticisi:
+    """
+    Küpü arka plan thread'inde yükleyen ve hazır olunca atomik olarak
+    değiştiren yönetici
+
+    - Yükleme sürerken oturumlar eski küpü kullanmaya devam eder
+    - Yeni küp HAZIR_GRUPLARI yüklenince tek atama ile aktif küp değişir;
+      kalan gruplar değişimden sonra arka planda yüklenir (önce erişen araç
+      grup kilidinde bekler), yüklenemeyen grup durum['hata']'ya yazılır
+    - kiralik() ile alınan küp, kira bitene kadar (devam eden agent
+      çalışmaları) eski versiyon olarak tutulur
+    """
+
+    # Küp değişmeden önce yüklenen gruplar - kenar çubuğu her çizimde trading'i okur
+    HAZIR_GRUPLARI = ('trading',)
+
+    def __init__(self, veri_klasoru: str, klasor: str = PAYLASIM_KLASORU):
+        self.veri_klasoru = veri_klasoru
+        self.klasor = klasor
+        self._kilit = threading.Lock()
+        self._aktif: Optional[KupVeri] = None
+        self._thread: Optional[threading.Thread] = None
+        # id(küp) -> [küp, kira sayısı] (aktif olmayan ama kullanılan küpler dahil)
+        self._kiralar: dict = {}
+        self._durum = {'yukleniyor': False, 'yuzde': 0, 'mesaj': '', 'hata': None,
+                       'versiyon': None, 'baslangic': None, 'bitis': None}
+
+    def aktif(self) -> Optional[KupVeri]:
+        """Şu an kullanımdaki küp (henüz yüklenmediyse None)"""
+        return self._aktif
+
+    def yukleniyor(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def ilerleme(self) -> dict:
+        """Yükleme durumu: yuzde, mesaj, hata, versiyon, gecen_sure"""
+        with self._kilit:
+            durum = dict(self._durum)
+        if durum['baslangic']:
+            durum['gecen_sure'] = (durum['bitis'] or time.time()) - durum['baslangic']
+        return durum
+
+    def eski_versiyonlar(self) -> list:
+        """Aktif olmayan ama hâlâ kirada olan küp versiyonları"""
+        with self._kilit:
+            return [k.veri_versiyonu for k, _ in self._kiralar.values() if k is not self._aktif]
+
+    def yenile(self, zorla: bool = False) -> bool:
+        """
+        Veri değiştiyse (zorla=True ise her durumda) arka planda yeni küp yükle
+
+        Returns:
+            Yeni yükleme başladıysa True
+        """
+        versiyon = veri_versiyonu_hesapla(self.veri_klasoru)
+        with self._kilit:
+            if self.yukleniyor():
+                return False
+            if not zorla and self._aktif is not None and self._aktif.veri_versiyonu == versiyon:
+                return False
+            if not zorla and self._durum['hata'] and self._durum['versiyon'] == versiyon:
+                # Aynı dosyalar zaten hata verdi - her rerun'da tekrar deneme
+                return False
+            self._durum.update({'yukleniyor': True, 'yuzde': 0, 'mesaj': 'Yükleme başlıyor',
+                                'hata': None, 'versiyon': versiyon,
+                                'baslangic': time.time(), 'bitis': None})
+            self._thread = threading.Thread(target=self._yukleyici, args=(versiyon, zorla),
+                                            name="kup-yukleyici", daemon=True)
+            self._thread.start()
+        print(f"🔄 Küp arka planda yükleniyor: {versiyon}")
+        return True
+
+    def _ilerleme_guncelle(self, yuzde: int, mesaj: str):
+        with self._kilit:
+            self._durum['yuzde'] = yuzde
+            self._durum['mesaj'] = mesaj
+
+    def _yukleyici(self, versiyon: str, zorla: bool = False):
+        try:
+            # Zorla yenilemede paylaşımlı depodaki aynı versiyona bağlanmak yerine kaynaktan oku
+            # Normal yenilemede yalnızca değişen kaynaklar okunur (aktif küp üzerinden)
+            kup = paylasimli_kup_yukle(self.veri_klasoru, versiyon,
+                                       '' if zorla else self.klasor,
+                                       ilerleme=self._ilerleme_guncelle,
+                                       onceki=None if zorla else self._aktif,
+                                       gruplar=self.HAZIR_GRUPLARI)
+        except Exception as e:
+            print(f"❌ Arka plan küp yüklemesi başarısız: {e}")
+            with self._kilit:
+                self._durum.update({'yukleniyor': False, 'hata': str(e), 'bitis': time.time()})
+            return
+
+        with self._kilit:
+            # Yükleme bitti - küp artık yöneticinin ilerleme durumunu değiştirmez
+            kup._ilerleme = None
+            eski = self._aktif
+            self._aktif = kup
+            self._durum.update({'yukleniyor': False, 'yuzde': 100, 'mesaj': 'Hazır',
+                                'bitis': time.time()})
+        sure = self._durum['bitis'] - self._durum['baslangic']
+        if eski is not None:
+            print(f"✅ Küp değiştirildi: {eski.veri_versiyonu} → {kup.veri_versiyonu} ({sure:.1f} sn)")
+        else:
+            print(f"✅ Küp hazır: {kup.veri_versiyonu} ({sure:.1f} sn)")
+
+        # Kalan gruplar ve haftalık geçmiş küp değiştikten sonra - oturumlar beklemez,
+        # yeni bir yenile() de bu yüklemeyi beklemez
+        threading.Thread(target=self._on_yukle, args=(kup,), name="kup-on-yukleme", daemon=True).start()
+
+    def _on_yukle(self, kup: KupVeri):
+        """Değişimden sonra kalan grupları yükle; yüklenemeyen grup 'Hazır' yerine hata olarak görünür"""
+        hatalar = kup._yukle()
+        if hatalar:
+            ozet = '; '.join(f"{grup}: {hata}" for grup, hata in hatalar.items())
+            with self._kilit:
+                if self._aktif is kup:
+                    self._durum.update({'hata': f"Veri grubu yüklenemedi - {ozet}",
+                                        'mesaj': f"Eksik veri: {', '.join(hatalar)}"})
+            print(f"❌ Küp eksik yüklendi ({kup.veri_versiyonu}): {ozet}")
+            # Eksik küp haftalık geçmişe yazılmaz (karşılaştırmalarda sahte düşüş olmasın)
+            return
+
+        # Haftalık geçmişe ekle
+        gecmise_kaydet(kup)
+
+    @contextmanager
+    def kiralik(self):
+        """
+        Aktif küpü bir çalışma süresince kirala
+
+        Kira sürerken küp değişse bile bu küp bellekte tutulur; son kira
+        bitince eski versiyon bırakılır.
+        """
+        with self._kilit:
+            kup = self._aktif
+            if kup is not None:
+                kayit = self._kiralar.setdefault(id(kup), [kup, 0])
+                kayit[1] += 1
+        try:
+            yield kup
+        finally:
+            if kup is not None:
+                with self._kilit:
+                    kayit = self._kiralar.get(id(kup))
+                    if kayit is not None:
+                        kayit[1] -= 1
+                        if kayit[1] <= 0:
+                            del self._kiralar[id(kup)]
+                            if kup is not self._aktif:
+                                print(f"   🗑️ Eski küp bırakıldı: {kup.veri_versiyonu}")
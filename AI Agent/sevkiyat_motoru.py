@@ -348,84 +348,35 @@ class SevkiyatMotoru:
         if len(result) == 0:
             return pd.DataFrame()
         
-        # Öncelik sıralaması (ihtiyaca göre büyükten küçüğe)
-        result = result.sort_values('ihtiyac', ascending=False).reset_index(drop=True)
+        # Öncelik (ihtiyaca göre büyükten küçüğe) dağıtımda uygulanır - tam sıralama yok
+        result = result.reset_index(drop=True)
         
-        # Depo stok dictionary
-        depo_df = self.kup.depo_stok.copy()
+        # Depo stok - küpün tipli, tekil görünümü (kolon adı eşleme + tekrar toplama orada)
+        # agent_tools yalnızca burada yüklenir
+        from agent_tools import DepoStoku, VARSAYILAN_DEPO, depo_dagit
         
-        # Kolon adlarını küçük harfe çevir
-        depo_df.columns = [c.lower().strip() for c in depo_df.columns]
-        print(f"   [Motor] Depo stok kolonları: {list(depo_df.columns)}")
-        
-        # urun_kod kontrolü - farklı isimler olabilir
-        urun_col = None
-        for col in ['urun_kod', 'urun_kodu', 'urunkod', 'sku', 'product_code']:
-            if col in depo_df.columns:
-                urun_col = col
-                break
-        
-        if urun_col is None:
-            print(f"   ❌ [Motor] Depo stokta ürün kolonu bulunamadı!")
-            return pd.DataFrame()
-        
-        depo_df['urun_kod'] = depo_df[urun_col].astype(str)
-        
-        # depo_kod kontrolü - farklı isimler olabilir
-        depo_col = None
-        for col in ['depo_kod', 'depo_kodu', 'depokod', 'depo', 'warehouse']:
-            if col in depo_df.columns:
-                depo_col = col
-                break
-        
-        if depo_col is not None:
-            depo_df['depo_kod'] = pd.to_numeric(depo_df[depo_col], errors='coerce').fillna(1).astype(int)
+        if hasattr(self.kup, 'depo_gorunumu'):
+            depo_gorunum = self.kup.depo_gorunumu()
         else:
-            print(f"   ⚠️ [Motor] Depo stokta depo_kod kolonu yok, default 1 kullanılıyor")
-            depo_df['depo_kod'] = 1
-        
-        # stok kolonu kontrolü
-        stok_col = None
-        for col in ['stok', 'miktar', 'adet', 'quantity', 'stock']:
-            if col in depo_df.columns:
-                stok_col = col
-                break
-        
-        if stok_col is None:
-            print(f"   ❌ [Motor] Depo stokta stok kolonu bulunamadı!")
-            return pd.DataFrame()
+            depo_gorunum = DepoStoku(self.kup.depo_stok)
         
-        depo_df['stok'] = pd.to_numeric(depo_df[stok_col], errors='coerce').fillna(0)
+        if depo_gorunum.eksik_kolonlar:
+            print(f"   ❌ [Motor] Depo stokta kolon bulunamadı: {depo_gorunum.eksik_kolonlar}")
+            return pd.DataFrame()
         
         # result'ta da depo_kod kontrolü
         if 'depo_kod' not in result.columns:
-            result['depo_kod'] = 1
+            result['depo_kod'] = VARSAYILAN_DEPO
         else:
-            result['depo_kod'] = pd.to_numeric(result['depo_kod'], errors='coerce').fillna(1).astype(int)
+            result['depo_kod'] = pd.to_numeric(result['depo_kod'], errors='coerce').fillna(VARSAYILAN_DEPO).astype(int)
         
-        depo_stok_dict = {}
-        for _, row in depo_df.iterrows():
-            key = (int(row['depo_kod']), str(row['urun_kod']))
-            depo_stok_dict[key] = float(row['stok'])
+        print(f"   [Motor] Depo stok: {len(depo_gorunum)} ürün×depo")
         
-        print(f"   [Motor] Depo stok dict: {len(depo_stok_dict)} ürün×depo")
-        
-        # Sevkiyat hesapla
-        sevkiyat_list = []
-        
-        for idx, row in result.iterrows():
-            key = (int(row['depo_kod']), str(row['urun_kod']))
-            ihtiyac = float(row['ihtiyac'])
-            
-            if key in depo_stok_dict and depo_stok_dict[key] > 0:
-                sevk = min(ihtiyac, depo_stok_dict[key])
-                depo_stok_dict[key] -= sevk
-            else:
-                sevk = 0
-            
-            sevkiyat_list.append(sevk)
-        
-        result['sevkiyat_miktari'] = sevkiyat_list
+        # Sevkiyat hesapla - ortak dağıtım yardımcısı
+        grup = depo_gorunum.konum(result['depo_kod'], result['urun_kod'])
+        result['sevkiyat_miktari'] = depo_dagit(
+            result['ihtiyac'].to_numpy(dtype='float64'), grup, depo_gorunum.stok
+        )
         result['karsilanamayan'] = result['ihtiyac'] - result['sevkiyat_miktari']
         
         # Sonuç kolonlarını düzenle